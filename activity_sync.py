@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+
+from loguru import logger as l
+
+import db.crud
+import notifier
+from db.db_models import User, Course, SignInActivity
+from xxt_api import validate_cookies, xxt_get_course_active_list, activity_from_dict, fill_activity_details, \
+    xxt_get_attend_status
+
+# 参与指纹计算的活动字段。签到人数等随学生签到不断变化的字段不参与，否则每次查询都会被判定为有变化
+FINGERPRINT_FIELDS = ("id", "nameOne", "otherId", "startTime", "endTime", "status")
+
+# 活动有变化时从新数据更新的字段
+UPDATED_FIELDS = ("name", "start_time", "end_time", "status", "other_id", "type", "active_type", "attend_num",
+                  "release_num", "type_name", "location_range", "require_photo", "require_location")
+
+CLOSED_STATUS = 2
+"""活动已结束时记录的状态"""
+
+
+def activity_fingerprint(activity_dict: dict) -> str:
+    return hashlib.sha1(json.dumps([activity_dict.get(f) for f in FINGERPRINT_FIELDS]).encode()).hexdigest()
+
+
+def list_fingerprint(active_list: list[dict]) -> str:
+    """活动列表的指纹，与活动顺序无关。"""
+    return hashlib.sha1("".join(sorted(activity_fingerprint(a) for a in active_list)).encode()).hexdigest()
+
+
+@dataclass
+class ActivityDiff:
+    """一次活动列表与数据库中已有活动的差异。"""
+
+    new: list[dict] = field(default_factory=list)
+    """数据库中没有的活动（原始字典）"""
+    changed: list[tuple[SignInActivity, dict]] = field(default_factory=list)
+    """数据库中已有但内容有变化（或记录为已结束后重新开启）的活动及其新数据"""
+    unchanged: list[SignInActivity] = field(default_factory=list)
+    """数据库中已有且没有变化的活动"""
+    closed: list[SignInActivity] = field(default_factory=list)
+    """数据库中记录为进行中，但已不在活动列表中的活动"""
+    created: list[SignInActivity] = field(default_factory=list)
+    """本次为新活动创建的数据库记录"""
+
+    def __bool__(self):
+        return bool(self.new or self.changed or self.closed)
+
+
+def diff_activities(active_list: list[dict], known: list[SignInActivity]) -> ActivityDiff:
+    """
+    比较取得的活动列表与数据库中课程已有的活动。
+
+    :param active_list: 正在进行的活动的原始字典列表。
+    :param known: 数据库中该课程的活动。
+    :return: ActivityDiff
+    """
+    diff = ActivityDiff()
+    known_by_id = {activity.active_id: activity for activity in known}
+    current_ids = set()
+
+    for activity_dict in active_list:
+        active_id = str(activity_dict["id"])
+        current_ids.add(active_id)
+        existing = known_by_id.get(active_id)
+        if existing is None:
+            diff.new.append(activity_dict)
+        elif existing.fingerprint != activity_fingerprint(activity_dict) or existing.status == CLOSED_STATUS:
+            # 记录为已结束的活动重新出现在列表中（教师重新开启）时，按新数据恢复状态并重新查询签到状态
+            diff.changed.append((existing, activity_dict))
+        else:
+            diff.unchanged.append(existing)
+
+    diff.closed = [activity for activity in known
+                   if activity.active_id not in current_ids and activity.status != CLOSED_STATUS]
+    return diff
+
+
+async def sync_course_activities(course: Course, user: User, notify_user: bool = False) -> ActivityDiff:
+    """
+    取得课程的活动列表并同步到数据库，只处理有变化的部分：
+    列表指纹与该学生上次取得的相同时直接返回；否则只为新活动取得详情，只更新有变化或已结束的活动，
+    并只为该学生尚未关联的活动查询签到状态。新活动会通知课程的其他学生。
+
+    :param notify_user: 是否也通知该学生（后台轮询时）。
+    :return: 本次同步的差异。
+    """
+    cookies = await validate_cookies(user.cookies, phone_number=user.phone_number, password=user.password)
+    active_list = await xxt_get_course_active_list(course, cookies)
+    db.crud.set_activities_synced_at(course, int(time.time()))
+
+    fingerprint = list_fingerprint(active_list)
+    if fingerprint == db.crud.get_activities_fingerprint(user, course):
+        l.debug("课程 {} 的活动列表没有变化", course.name)
+        return ActivityDiff()
+
+    diff = diff_activities(active_list, course.activities)
+
+    # 先完成所有学习通请求，再修改数据库中的对象并提交，等待响应期间会话中没有未提交的修改，
+    # 请求失败时也不会留下只同步了一半的活动
+    new = []
+    for activity_dict in diff.new:
+        activity = activity_from_dict(activity_dict)
+        activity.fingerprint = activity_fingerprint(activity_dict)
+        await fill_activity_details(activity, cookies)
+        signed = await xxt_get_attend_status(activity, cookies) != 0
+        new.append((activity, signed))
+
+    changed = []
+    for existing, activity_dict in diff.changed:
+        updated = activity_from_dict(activity_dict)
+        await fill_activity_details(updated, cookies)
+        changed.append((existing, updated, activity_fingerprint(activity_dict)))
+
+    # 活动本身没有变化，但该学生可能是第一次取得它
+    attend = [(existing, await xxt_get_attend_status(existing, cookies) == 0)
+              for existing in [a for a, _ in diff.changed] + diff.unchanged if existing not in user.activities]
+
+    for activity, signed in new:
+        db.crud.create_sign_in_activity(activity, course, None if signed else user)
+        if signed:
+            db.crud.mark_signed_in(user, activity)
+        diff.created.append(activity)
+
+    for existing, updated, activity_fp in changed:
+        for field_name in UPDATED_FIELDS:
+            setattr(existing, field_name, getattr(updated, field_name))
+        existing.fingerprint = activity_fp
+
+    for existing, unsigned in attend:
+        if unsigned:
+            existing.users.append(user)
+        else:
+            db.crud.mark_signed_in(user, existing)
+
+    for existing in diff.closed:
+        existing.status = CLOSED_STATUS
+        existing.users = []
+
+    db.crud.update_user(user)
+    db.crud.set_activities_fingerprint(user, course, fingerprint)
+    notifier.queue_new_activities(course, diff.created, syncing_user=user, notify_syncing_user=notify_user)
+
+    l.debug("课程 {} 活动同步: 新增 {} 个，变化 {} 个，结束 {} 个",
+            course.name, len(diff.new), len(diff.changed), len(diff.closed))
+    return diff
@@ -0,0 +1,65 @@
+"""
+批量导入吞吐量测试
+
+使用 loadtest 的临时数据库和模拟学习通接口（每次登录 3 个请求，每个请求 --latency 秒），
+用不同的并发数（system.bulk_import_concurrency）导入同样数量的新用户，比较每秒导入的行数。
+并发数为 1 相当于学生逐个发送“登录”指令。--rate 为每秒开始的登录数，0 为不限制。
+
+用法（在仓库根目录下）：
+    python benchmarks/bulk_import_throughput.py --rows 200 --latency 0.2 --concurrency 1 4 8 16
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import tempfile
+
+import loadtest
+
+
+def make_csv(rows: int, offset: int) -> str:
+    lines = ["手机号,密码,QQ号"]
+    lines += [f"1{5000000000 + offset + i},password{i % 10}a,{20000000 + offset + i}" for i in range(rows)]
+    return "\n".join(lines)
+
+
+async def bench(rows: int, offset: int) -> tuple[float, int]:
+    """
+    :return: (每秒导入的行数, 成功的行数)
+    """
+    import bulk_import
+    from db.db import session_scope
+
+    with session_scope():
+        results, elapsed = await bulk_import.run(*bulk_import.parse_csv(make_csv(rows, offset)))
+    return len(results) / elapsed, sum(1 for result in results if result.ok)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入吞吐量测试")
+    parser.add_argument("--rows", type=int, default=200, help="每种情况导入的行数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟的学习通每个请求的延迟（秒）")
+    parser.add_argument("--rate", type=float, default=0, help="每秒最多开始的登录数，0 为不限制")
+    parser.add_argument("--batch-size", type=int, default=20, help="每批写入数据库的用户数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16], help="要比较的并发数")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    loadtest.prepare_environment(tempfile.mkdtemp(prefix="xxt_bulk_import_"))
+    seed = loadtest.seed_database(users=0, courses=50, courses_per_user=0, activities_per_course=0, rng=rng)
+    loadtest.install_fake_xxt_api(seed, args.latency, 0, False, rng)
+
+    from config import c
+    c.system.bulk_import_login_rate = args.rate
+    c.system.bulk_import_batch_size = args.batch_size
+
+    print(f"{'并发数':<10}{'行/秒':>10}{'成功':>10}")
+    for i, concurrency in enumerate(args.concurrency):
+        c.system.bulk_import_concurrency = concurrency
+        throughput, succeeded = asyncio.run(bench(args.rows, i * args.rows))
+        print(f"{concurrency:<10}{throughput:>10.2f}{succeeded:>10}")
+
+
+if __name__ == "__main__":
+    main()
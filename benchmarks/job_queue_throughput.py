@@ -0,0 +1,150 @@
+"""
+任务队列吞吐量测试
+
+使用临时 SQLite 数据库测量 jobs 表的：
+  - 入队：每个任务单独提交，以及按批提交（job_queue.enqueue 一次加入多个任务）
+  - 领取 + 完成：claim_jobs 每次领取不同数量的任务后逐个 complete_job
+  - 多进程同时领取：检查每个任务只被领取一次
+每秒处理的任务数越高越好。
+
+用法（在仓库根目录下）：
+    python benchmarks/job_queue_throughput.py --jobs 5000 --claimers 4
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def setup(db_url: str):
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    from db.db import init_db
+    init_db(db_url)
+
+
+def make_jobs(n: int, start: int = 0) -> list:
+    import job_queue
+
+    return [job_queue.make_job("sign_in", {"activity_id": i, "user_id": i}, job_queue.PRIORITY_SIGN_IN,
+                               dedupe_key=f"bench:{i}") for i in range(start, start + n)]
+
+
+def reset():
+    from db.db import session_scope
+    from db.db_models import Job
+
+    with session_scope() as s:
+        s.query(Job).delete()
+        s.commit()
+
+
+def bench_enqueue(n: int, batch: int) -> float:
+    import job_queue
+    from db.db import session_scope
+
+    reset()
+    start = time.perf_counter()
+    for offset in range(0, n, batch):
+        with session_scope():
+            job_queue.enqueue(make_jobs(min(batch, n - offset), offset))
+    return n / (time.perf_counter() - start)
+
+
+def bench_claim(n: int, batch: int) -> float:
+    import db.crud
+    import job_queue
+    from db.db import session_scope
+
+    reset()
+    with session_scope():
+        job_queue.enqueue(make_jobs(n))
+
+    start = time.perf_counter()
+    done = 0
+    while True:
+        with session_scope():
+            jobs = db.crud.claim_jobs(batch, 300, 0)
+            for job in jobs:
+                db.crud.complete_job(job)
+        if not jobs:
+            break
+        done += len(jobs)
+    assert done == n, f"完成了 {done} 个任务，应为 {n} 个"
+    return n / (time.perf_counter() - start)
+
+
+def claimer(db_url: str, batch: int, claimed: multiprocessing.Queue):
+    """子进程：不断领取并完成任务，把领到的任务 id 送回主进程。"""
+    setup(db_url)
+    import db.crud
+    from db.db import session_scope
+
+    ids = []
+    while True:
+        with session_scope():
+            jobs = db.crud.claim_jobs(batch, 300, 0)
+            for job in jobs:
+                db.crud.complete_job(job)
+        if not jobs:
+            break
+        ids.extend(job.id for job in jobs)
+    claimed.put(ids)
+
+
+def bench_concurrent_claim(db_url: str, n: int, claimers: int, batch: int) -> tuple[float, int]:
+    """
+    :return: (每秒完成的任务数, 被重复领取的任务数)
+    """
+    import job_queue
+    from db.db import session_scope
+
+    reset()
+    with session_scope():
+        job_queue.enqueue(make_jobs(n))
+
+    ctx = multiprocessing.get_context("spawn")
+    claimed = ctx.Queue()
+    processes = [ctx.Process(target=claimer, args=(db_url, batch, claimed)) for _ in range(claimers)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    ids = []
+    for _ in processes:
+        ids.extend(claimed.get())
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    assert len(set(ids)) == n, f"领取了 {len(set(ids))} 个不同的任务，应为 {n} 个"
+    return n / elapsed, len(ids) - len(set(ids))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="任务队列吞吐量测试")
+    parser.add_argument("--jobs", type=int, default=5000, help="每种情况的任务数")
+    parser.add_argument("--claimers", type=int, default=4, help="同时领取任务的进程数")
+    args = parser.parse_args(argv)
+
+    db_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='xxt_jobs_'), 'jobs.db')}"
+    setup(db_url)
+
+    print(f"{'操作':<36}{'任务/秒':>12}")
+    for batch in (1, 100):
+        print(f"{f'入队，每批 {batch} 个':<36}{bench_enqueue(args.jobs, batch):>12.0f}")
+    for batch in (1, 8, 32):
+        print(f"{f'领取 + 完成，每次领取 {batch} 个':<36}{bench_claim(args.jobs, batch):>12.0f}")
+    throughput, duplicates = bench_concurrent_claim(db_url, args.jobs, args.claimers, 8)
+    print(f"{f'{args.claimers} 个进程同时领取，每次 8 个':<36}{throughput:>12.0f}    重复领取: {duplicates}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+handle_message 压测工具
+
+直接驱动 handle_message，使用伪造的 _respond、预先填充的 SQLite 数据库和带可配置延迟的模拟 xxt_api 层，
+按目标速率回放指令组合（登录风暴、课程列表、查询课程、签到、待签到），
+报告吞吐量、每条指令的 p50/p95/p99 延迟以及事件循环延迟。
+
+用法（在仓库根目录下）：
+    python benchmarks/loadtest.py --users 500 --rate 50 --duration 30 --latency 0.2
+    python benchmarks/loadtest.py --mix login=5,courses=1 --blocking-io   # 模拟同步 requests 阻塞事件循环
+    python benchmarks/loadtest.py --mix query=1,pending=1   # 比较实时查询课程与从数据库读取的“待签到”
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = ("login", "courses", "query", "sign", "pending")
+DEFAULT_MIX = "login=1,courses=4,query=3,sign=2"
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"未知指令类型 {name}，可选：{', '.join(COMMANDS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def prepare_environment(workdir: str):
+    """
+    在临时目录中写入配置文件并切换工作目录，使 config 与 db 指向临时 SQLite 数据库。
+    """
+    with open(os.path.join(workdir, "config.cfg"), "w", encoding="utf-8") as f:
+        f.write(
+            "[db]\n"
+            f"sqlalchemy_db_url = \"sqlite:///{os.path.join(workdir, 'loadtest.db')}\"\n"
+            "[system]\n"
+            "web_requests_lantency = 0\n"
+            "[respond]\n"
+            "reply_latency = 0\n"
+        )
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+
+def seed_database(users: int, courses: int, courses_per_user: int, activities_per_course: int,
+                  rng: random.Random) -> dict:
+    """
+    预先填充用户、课程和签到活动。
+
+    :return: 包含已登录 QQ 号、每个用户的课程 ID 和活动 ID 的字典，供生成指令使用。
+    """
+    from config import init_config
+    from db.db import db_session as s, init_db
+    from db.db_models import User, Course, SignInActivity
+
+    init_config()
+    init_db()
+
+    course_objs = [
+        Course(name=f"课程{i}", course_id=str(100000 + i), cpi=str(200000 + i), class_id=str(300000 + i),
+               teacher_name=f"教师{i}")
+        for i in range(courses)
+    ]
+    s.add_all(course_objs)
+
+    now = datetime.datetime.now()
+    activity_seq = itertools.count()
+    for course in course_objs:
+        for _ in range(activities_per_course):
+            n = next(activity_seq)
+            course.activities.append(fake_activity(str(900000000 + n), f"签到{n}", now))
+
+    user_objs = []
+    for i in range(users):
+        user = User(xxt_user_id=str(500000 + i), qq_num=str(1000000 + i), name=f"学生{i}",
+                    cookies="{}", phone_number=f"1{3000000000 + i}", password="password1")
+        user.courses = rng.sample(course_objs, min(courses_per_user, courses))
+        user.activities = [a for course in user.courses for a in course.activities]
+        user_objs.append(user)
+    s.add_all(user_objs)
+    s.commit()
+
+    return {
+        "qq_nums": [u.qq_num for u in user_objs],
+        "courses_of": {u.qq_num: [c.id for c in u.courses] for u in user_objs},
+        "activities_of": {u.qq_num: [a.id for a in u.activities] for u in user_objs},
+        "course_by_id": {c.id: c.class_id for c in course_objs},
+        "active_ids_of_course": {c.id: [a.active_id for a in c.activities] for c in course_objs},
+    }
+
+
+def fake_activity(active_id: str, name: str, start_time: datetime.datetime):
+    from db.db_models import SignInActivity
+
+    return SignInActivity(name=name, type_name="普通签到", start_time=start_time, end_time=None, status=1,
+                          user_status=0, other_id=0, group_id=1, source=15, is_look=1, release_num=0, type=2,
+                          attend_num=0, active_type=2, active_id=active_id, location_range=0,
+                          require_photo=False, require_location=False)
+
+
+def fake_active_dict(active_id: str, name: str, start_ms: int) -> dict:
+    """activelist 接口返回的单个活动。"""
+    return {"id": int(active_id), "nameOne": name, "otherId": 0, "startTime": start_ms, "endTime": 0, "status": 1,
+            "userStatus": 0, "groupId": 1, "source": 15, "isLook": 1, "type": 2, "releaseNum": 0, "attendNum": 0,
+            "activeType": 2}
+
+
+def install_fake_xxt_api(seed: dict, latency: float, jitter: float, blocking_io: bool, rng: random.Random):
+    """
+    用带延迟的假实现替换 xxt_jobs 和 activity_sync 中引用的 xxt_api 函数（任务在本进程中执行）。
+
+    blocking_io 为 True 时使用 time.sleep 模拟同步 requests 调用对事件循环的阻塞。
+    """
+    import activity_sync
+    import xxt_jobs
+    from db.db_models import User, Course
+
+    async def upstream_delay(calls: int = 1):
+        for _ in range(calls):
+            delay = max(0.0, rng.gauss(latency, jitter)) if jitter else latency
+            if blocking_io:
+                time.sleep(delay)
+            else:
+                await asyncio.sleep(delay)
+
+    course_ids = list(seed["course_by_id"].items())
+
+    async def fake_get_user_and_courses_info(phone, password, qq_num, is_admin, cookies_raw=None):
+        # 登录、取得个人空间、取得课程列表
+        await upstream_delay(3)
+        picked = rng.sample(course_ids, min(3, len(course_ids)))
+        return {
+            "user": User(xxt_user_id=f"9{phone}", qq_num=qq_num, name=f"新学生{qq_num}", cookies="{}",
+                         phone_number=phone, password=password, is_admin=is_admin),
+            "courses": [Course(name=f"课程{class_id}", course_id=class_id, cpi=class_id, class_id=class_id,
+                               teacher_name="教师") for _, class_id in picked],
+        }
+
+    start_ms = int(time.time()) * 1000
+
+    async def fake_validate_cookies(cookies_raw, phone_number, password):
+        return None
+
+    async def fake_get_course_active_list(course, cookies):
+        # 课程中转页 + 活动列表
+        await upstream_delay(2)
+        return [fake_active_dict(active_id, f"签到{active_id}", start_ms)
+                for active_id in seed["active_ids_of_course"].get(course.id, [])]
+
+    async def fake_fill_activity_details(activity, cookies):
+        await upstream_delay(1)
+        activity.location_range, activity.require_photo, activity.require_location = 0, False, False
+
+    async def fake_get_attend_status(activity, cookies):
+        await upstream_delay(1)
+        return 0
+
+    async def fake_sign_in(activity, user, *args, **kwargs):
+        await upstream_delay(1)
+        return True
+
+    xxt_jobs.xxt_get_user_and_courses_info = fake_get_user_and_courses_info
+    activity_sync.validate_cookies = fake_validate_cookies
+    activity_sync.xxt_get_course_active_list = fake_get_course_active_list
+    activity_sync.fill_activity_details = fake_fill_activity_details
+    activity_sync.xxt_get_attend_status = fake_get_attend_status
+    xxt_jobs.xxt_sign_in = fake_sign_in
+
+
+class CommandGenerator:
+    """根据指令权重生成 (指令类型, QQ 号, 消息) 三元组。"""
+
+    def __init__(self, seed: dict, weights: dict[str, float], rng: random.Random):
+        self.seed = seed
+        self.rng = rng
+        self.names = list(weights)
+        self.weights = [weights[n] for n in self.names]
+        self.new_users = itertools.count()
+
+    def next(self) -> tuple[str, str, str]:
+        kind = self.rng.choices(self.names, self.weights)[0]
+        if kind == "login":
+            n = next(self.new_users)
+            return kind, str(8000000 + n), f"登录 1{5000000000 + n} password{n % 10}a"
+
+        qq_num = self.rng.choice(self.seed["qq_nums"])
+        if kind == "courses":
+            return kind, qq_num, "课程列表"
+        if kind == "query":
+            course_ids = self.seed["courses_of"][qq_num] or [0]
+            return kind, qq_num, f"查询课程 {self.rng.choice(course_ids)}"
+        if kind == "pending":
+            return kind, qq_num, "待签到"
+        activity_ids = self.seed["activities_of"][qq_num] or [0]
+        return kind, qq_num, f"签到 {self.rng.choice(activity_ids)}"
+
+
+async def monitor_loop_lag(samples: list[float], interval: float, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def run_load(generator: CommandGenerator, rate: float, duration: float, lag_interval: float) -> dict:
+    from handle_msg import handle_message
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    replies: dict[str, int] = defaultdict(int)
+    lag_samples: list[float] = []
+    stop = asyncio.Event()
+
+    async def one(kind: str, qq_num: str, message: str):
+        async def respond(msg, qq_number: str = None):
+            replies[kind] += 1
+
+        start = time.perf_counter()
+        try:
+            await handle_message(respond, qq_num, message)
+        except Exception:
+            errors[kind] += 1
+        latencies[kind].append(time.perf_counter() - start)
+
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples, lag_interval, stop))
+    in_flight = set()
+    total = int(rate * duration)
+    start = time.perf_counter()
+    for i in range(total):
+        # 开环负载：按计划时间发出消息，不等待上一条完成
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(one(*generator.next()))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    send_elapsed = time.perf_counter() - start
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+
+    return {
+        "messages": total,
+        "send_elapsed": send_elapsed,
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "errors": errors,
+        "replies": replies,
+        "lag": lag_samples,
+    }
+
+
+def summarize(result: dict) -> dict:
+    summary = {
+        "messages": result["messages"],
+        "elapsed_s": round(result["elapsed"], 3),
+        "offered_rate": round(result["messages"] / result["send_elapsed"], 2) if result["send_elapsed"] else 0,
+        "throughput": round(result["messages"] / result["elapsed"], 2) if result["elapsed"] else 0,
+        "commands": {},
+    }
+    for kind, values in sorted(result["latencies"].items()):
+        values = sorted(values)
+        summary["commands"][kind] = {
+            "count": len(values),
+            "errors": result["errors"][kind],
+            "replies": result["replies"][kind],
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2) if values else 0,
+        }
+    lag = sorted(result["lag"])
+    summary["loop_lag"] = {
+        "samples": len(lag),
+        "p50_ms": round(percentile(lag, 50) * 1000, 2),
+        "p95_ms": round(percentile(lag, 95) * 1000, 2),
+        "p99_ms": round(percentile(lag, 99) * 1000, 2),
+        "max_ms": round(lag[-1] * 1000, 2) if lag else 0,
+    }
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"消息数: {summary['messages']}  耗时: {summary['elapsed_s']}s  "
+          f"发送速率: {summary['offered_rate']}/s  吞吐量: {summary['throughput']}/s")
+    print(f"{'指令':<10}{'次数':>8}{'错误':>8}{'p50(ms)':>12}{'p95(ms)':>12}{'p99(ms)':>12}{'max(ms)':>12}")
+    for kind, stats in summary["commands"].items():
+        print(f"{kind:<10}{stats['count']:>8}{stats['errors']:>8}{stats['p50_ms']:>12}{stats['p95_ms']:>12}"
+              f"{stats['p99_ms']:>12}{stats['max_ms']:>12}")
+    lag = summary["loop_lag"]
+    print(f"事件循环延迟: p50 {lag['p50_ms']}ms  p95 {lag['p95_ms']}ms  p99 {lag['p99_ms']}ms  "
+          f"max {lag['max_ms']}ms  ({lag['samples']} 个样本)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="handle_message 压测工具")
+    parser.add_argument("--users", type=int, default=200, help="预置的已登录用户数")
+    parser.add_argument("--courses", type=int, default=50, help="预置的课程数")
+    parser.add_argument("--courses-per-user", type=int, default=6, help="每个用户关联的课程数")
+    parser.add_argument("--activities-per-course", type=int, default=2, help="每门课程预置的签到活动数")
+    parser.add_argument("--rate", type=float, default=20, help="目标消息速率（条/秒）")
+    parser.add_argument("--duration", type=float, default=10, help="发送消息的持续时间（秒）")
+    parser.add_argument("--latency", type=float, default=0.1, help="模拟的每次学习通请求延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的标准差（秒）")
+    parser.add_argument("--blocking-io", action="store_true", help="以 time.sleep 模拟同步请求阻塞事件循环")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"指令权重，默认 {DEFAULT_MIX}")
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="事件循环延迟采样间隔（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", dest="json_path", help="将结果以 JSON 写入该文件")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="xxt_loadtest_")
+    prepare_environment(workdir)
+
+    seed = seed_database(args.users, args.courses, args.courses_per_user, args.activities_per_course, rng)
+    install_fake_xxt_api(seed, args.latency, args.jitter, args.blocking_io, rng)
+
+    generator = CommandGenerator(seed, args.mix, rng)
+    result = asyncio.run(run_load(generator, args.rate, args.duration, args.lag_interval))
+    summary = summarize(result)
+    print_summary(summary)
+
+    if args.json_path:
+        with open(os.path.join(REPO_ROOT, args.json_path) if not os.path.isabs(args.json_path)
+                  else args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
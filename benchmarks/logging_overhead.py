@@ -0,0 +1,107 @@
+"""
+日志开销测试
+
+测量调用方每条日志的耗时（微秒），对比：
+  - 同步输出 + f-string：在调用的线程中格式化并写入，消息在调用前拼好（原来的方式）
+  - 队列输出 + 延迟格式化：logs.QueuedSink，由后台线程写入，消息只在需要输出时格式化
+  - 队列输出 + 延迟格式化 + 限流：同上，并按调用位置限流（logs.CallSiteSampler）
+分别在 DEBUG 级别（调试日志会输出）和 INFO 级别（调试日志被过滤）下测试。
+--write-delay 模拟较慢的终端或磁盘（每次写入的延迟）。
+
+用法（在仓库根目录下）：
+    python benchmarks/logging_overhead.py --messages 20000
+    python benchmarks/logging_overhead.py --messages 2000 --write-delay 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from loguru import logger as l  # noqa: E402
+
+import logs  # noqa: E402
+
+COURSES = [f"课程{i}" for i in range(20)]
+
+
+class SlowFile:
+    """每次写入前等待 delay 秒的文件。"""
+
+    def __init__(self, path: str, delay: float):
+        self._file = open(path, "a", encoding="utf-8")
+        self.delay = delay
+
+    def write(self, text: str):
+        if self.delay:
+            time.sleep(self.delay)
+        self._file.write(text)
+
+    def flush(self):
+        self._file.flush()
+
+
+def log_eager(n: int):
+    for i in range(n):
+        l.debug(f"第 {i} 次同步: {', '.join(COURSES)}")
+
+
+def log_lazy(n: int):
+    for i in range(n):
+        l.debug("第 {} 次同步: {}", i, COURSES)
+
+
+def measure(body, n: int) -> tuple[float, float]:
+    """
+    :return: (调用方每条耗时（微秒）, 之后等待队列写完的时间（毫秒）)
+    """
+    start = time.perf_counter()
+    body(n)
+    caller = (time.perf_counter() - start) / n * 1e6
+    start = time.perf_counter()
+    logs.flush()
+    drain = (time.perf_counter() - start) * 1000
+    l.remove()
+    return caller, drain
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日志开销测试")
+    parser.add_argument("--messages", type=int, default=20000, help="每种情况输出的日志条数")
+    parser.add_argument("--write-delay", type=float, default=0, help="模拟的每次写入延迟（毫秒）")
+    args = parser.parse_args(argv)
+
+    log_file = os.path.join(tempfile.mkdtemp(prefix="xxt_logging_"), "bench.log")
+    delay = args.write_delay / 1000
+
+    def sync_sink(level: str):
+        l.add(SlowFile(log_file, delay), level=level, format=logs.text_format)
+
+    def queued_sink(level: str):
+        l.add(logs.QueuedSink(SlowFile(log_file, delay)), level=level, format=logs.text_format)
+
+    def sampled_sink(level: str):
+        l.add(logs.QueuedSink(SlowFile(log_file, delay)), level=level, format=logs.text_format,
+              filter=logs.CallSiteSampler("DEBUG", rate=1, burst=10))
+
+    cases = [
+        ("同步输出 + f-string", sync_sink, log_eager),
+        ("队列输出 + 延迟格式化", queued_sink, log_lazy),
+        ("队列输出 + 延迟格式化 + 限流", sampled_sink, log_lazy),
+    ]
+    l.remove()
+    print(f"{'级别':<8}{'方式':<28}{'调用方(us/条)':>16}{'写完队列(ms)':>16}")
+    for level in ("DEBUG", "INFO"):
+        for name, add_sink, body in cases:
+            add_sink(level)
+            caller, drain = measure(body, args.messages)
+            print(f"{level:<8}{name:<28}{caller:>16.2f}{drain:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
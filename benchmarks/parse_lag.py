@@ -0,0 +1,124 @@
+"""
+网页解析对事件循环延迟的影响：inline / thread / process
+
+模拟一批并发登录，每次登录解析一份个人空间网页和一份课程列表网页（与学习通的网页结构相同，大小可调），
+同时以固定间隔在事件循环上计时，报告各解析方式下的事件循环延迟和总耗时。
+
+用法（在仓库根目录下）：
+    python benchmarks/parse_lag.py --logins 40 --courses 200
+    python benchmarks/parse_lag.py --modes inline process --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def course_list_html(courses: int) -> str:
+    items = []
+    for i in range(courses):
+        items.append(
+            f'<li class="course clearfix"><input type="hidden" class="clazzId" value="{300000 + i}"/>'
+            f'<input type="hidden" class="courseId" value="{100000 + i}"/>'
+            f'<div class="course-info"><a class="color1" href="https://mooc1.chaoxing.com/visit/stucoursemiddle?'
+            f'courseid={100000 + i}&clazzid={300000 + i}&cpi={200000 + i}&ismooc2=1">'
+            f'<span class="course-name overHidden2" title="课程{i}">课程{i}</span></a>'
+            f'<p class="margint10 line2" title="说明">说明文字{i}</p>'
+            f'<p class="line2 color3" title="教师{i}">教师{i}</p></div></li>'
+        )
+    return f'<html><body><ul class="course-list">{"".join(items)}</ul></body></html>'
+
+
+def profile_html(filler: int) -> str:
+    rows = "".join(f'<div class="item"><a href="/x?{i}">链接{i}</a><span>{i}</span></div>' for i in range(filler))
+    return f'<html><body><div class="header"><p class="user-name">张三</p></div>{rows}</body></html>'
+
+
+async def monitor_loop_lag(samples: list[float], interval: float, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def bench_mode(mode: str, logins: int, courses_html: str, profile: str, lag_interval: float) -> dict:
+    import parse_pool
+    import xxt_api
+    from config import c
+
+    c.system.parse_executor = mode
+    # 预热解析池（进程池需要启动子进程并导入 bs4）
+    await parse_pool.run(len, "")
+    await xxt_api.Profile(profile).parse_user_name()
+
+    async def login():
+        await xxt_api.Profile(profile).parse_user_name()
+        courses = await xxt_api.xxt_parse_courses(courses_html)
+        assert courses and courses[0].class_id
+
+    samples: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(samples, lag_interval, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    parse_pool.shutdown()
+
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "lag_p50": statistics.median(samples) if samples else 0.0,
+        "lag_p99": percentile(samples, 0.99),
+        "lag_max": max(samples) if samples else 0.0,
+        "samples": len(samples),
+    }
+
+
+async def main_async(args):
+    from loguru import logger
+
+    from config import c
+
+    logger.remove()
+    c.system.parse_workers = args.workers
+    courses_html = course_list_html(args.courses)
+    profile = profile_html(args.profile_filler)
+    print(f"课程列表网页 {len(courses_html) / 1024:.0f}KB，个人空间网页 {len(profile) / 1024:.0f}KB，"
+          f"{args.logins} 个并发登录，{args.workers} 个工作者")
+
+    results = [await bench_mode(mode, args.logins, courses_html, profile, args.lag_interval) for mode in args.modes]
+
+    print(f"{'方式':<10}{'总耗时':>10}{'延迟p50':>12}{'延迟p99':>12}{'最大延迟':>12}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['elapsed']:>9.2f}s{r['lag_p50'] * 1000:>10.1f}ms{r['lag_p99'] * 1000:>10.1f}ms"
+              f"{r['lag_max'] * 1000:>10.1f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="网页解析对事件循环延迟的影响")
+    parser.add_argument("--logins", type=int, default=40, help="并发登录数")
+    parser.add_argument("--courses", type=int, default=200, help="课程列表网页中的课程数")
+    parser.add_argument("--profile-filler", type=int, default=2000, help="个人空间网页中的填充元素数")
+    parser.add_argument("--workers", type=int, default=2, help="解析池的工作者数")
+    parser.add_argument("--lag-interval", type=float, default=0.005, help="事件循环计时间隔（秒）")
+    parser.add_argument("--modes", nargs="+", default=["inline", "thread", "process"],
+                        choices=["inline", "thread", "process"])
+    asyncio.run(main_async(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
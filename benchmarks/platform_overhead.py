@@ -0,0 +1,228 @@
+"""
+平台适配器开销对比：OneBot (aiocqhttp) 与 Ariadne (mirai-api-http 反向 ws)
+
+分别以子进程运行 xxt.py（只配置一个平台），用本地伪造的 OneBot / mirai-api-http 客户端连接反向 ws，
+逐条发送好友消息并等待机器人回复，报告启动耗时、内存占用（RSS）以及每条消息的往返延迟。
+两种平台收到的是同一条指令，走同一个 handle_message，差异即适配器本身的开销。
+
+用法（在仓库根目录下，仅支持 Linux 读取 RSS）：
+    python benchmarks/platform_overhead.py --messages 500
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_QQ = 10000
+USER_QQ = 20000
+MESSAGE = "课程列表"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def write_config(workdir: str, platform: str, port: int):
+    if platform == "onebot":
+        section = f"[onebot]\nqq = {BOT_QQ}\nreverse_ws_host = \"127.0.0.1\"\nreverse_ws_port = {port}\n"
+    else:
+        section = f"[mirai]\nqq = {BOT_QQ}\nreverse_ws_host = \"127.0.0.1\"\nreverse_ws_port = {port}\n"
+    with open(os.path.join(workdir, "config.cfg"), "w", encoding="utf-8") as f:
+        f.write(
+            section +
+            "[db]\n"
+            f"sqlalchemy_db_url = \"sqlite:///{os.path.join(workdir, 'bench.db')}\"\n"
+            "[respond]\n"
+            "reply_latency = 0\n"
+        )
+
+
+async def wait_for_port(port: int, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"机器人进程已退出，退出码 {proc.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise TimeoutError("等待反向 ws 端口超时")
+
+
+class FakeOnebotClient:
+    """模拟 go-cqhttp 的 Universal 反向 ws 客户端。"""
+
+    url = "/ws/"
+    headers = {"X-Self-ID": str(BOT_QQ), "X-Client-Role": "Universal"}
+
+    def __init__(self, ws, replies: asyncio.Queue):
+        self.ws = ws
+        self.replies = replies
+        self.message_id = 0
+
+    async def handshake(self):
+        await self.ws.send_json({"post_type": "meta_event", "meta_event_type": "lifecycle", "sub_type": "connect",
+                                 "self_id": BOT_QQ, "time": int(time.time())})
+
+    async def send_message(self, text: str):
+        self.message_id += 1
+        await self.ws.send_json({
+            "post_type": "message", "message_type": "private", "sub_type": "friend", "self_id": BOT_QQ,
+            "message_id": self.message_id, "user_id": USER_QQ, "message": text, "raw_message": text, "font": 0,
+            "sender": {"user_id": USER_QQ, "nickname": "bench"}, "time": int(time.time()),
+        })
+
+    async def on_frame(self, data: dict):
+        if "action" not in data:
+            return
+        await self.ws.send_json({"status": "ok", "retcode": 0, "data": {"message_id": 1}, "echo": data.get("echo")})
+        if data["action"] in ("send_msg", "send_private_msg"):
+            self.replies.put_nowait(time.perf_counter())
+
+
+class FakeMiraiClient:
+    """模拟 mirai-api-http 的反向 ws 客户端。"""
+
+    url = "/"
+    headers = {}
+
+    def __init__(self, ws, replies: asyncio.Queue):
+        self.ws = ws
+        self.replies = replies
+        self.message_id = 0
+
+    async def handshake(self):
+        pass
+
+    async def send_message(self, text: str):
+        self.message_id += 1
+        await self.ws.send_json({"syncId": "-1", "data": {
+            "type": "FriendMessage",
+            "sender": {"id": USER_QQ, "nickname": "bench", "remark": ""},
+            "messageChain": [{"type": "Source", "id": self.message_id, "time": int(time.time())},
+                             {"type": "Plain", "text": text}],
+        }})
+
+    async def on_frame(self, data: dict):
+        command = data.get("command")
+        if command is None:
+            return
+        if command == "verify":
+            await self.ws.send_json({"syncId": data["syncId"], "data": {"code": 0, "session": "bench"}})
+        elif command == "about":
+            await self.ws.send_json({"syncId": data["syncId"], "data": {"code": 0, "data": {"version": "2.7.0"}}})
+        elif command in ("sendFriendMessage", "sendGroupMessage"):
+            await self.ws.send_json({"syncId": data["syncId"], "data": {"code": 0, "msg": "", "messageId": 1}})
+            self.replies.put_nowait(time.perf_counter())
+        else:
+            await self.ws.send_json({"syncId": data["syncId"], "data": {"code": 0, "data": []}})
+
+
+async def bench_platform(platform: str, messages: int, warmup: int) -> dict:
+    import aiohttp
+
+    workdir = tempfile.mkdtemp(prefix=f"xxt_{platform}_")
+    port = free_port()
+    write_config(workdir, platform, port)
+
+    env = dict(os.environ, PYTHONWARNINGS="ignore")
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "xxt.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_for_port(port, proc)
+        startup = time.perf_counter() - start
+        client_cls = FakeOnebotClient if platform == "onebot" else FakeMiraiClient
+        replies: asyncio.Queue = asyncio.Queue()
+
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(f"http://127.0.0.1:{port}{client_cls.url}",
+                                          headers=client_cls.headers) as ws:
+                client = client_cls(ws, replies)
+
+                async def reader():
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            await client.on_frame(json.loads(msg.data))
+
+                reader_task = asyncio.create_task(reader())
+                await client.handshake()
+                await asyncio.sleep(1)
+                rss_idle = rss_mb(proc.pid)
+
+                latencies = []
+                for i in range(warmup + messages):
+                    sent = time.perf_counter()
+                    await client.send_message(MESSAGE)
+                    replied = await asyncio.wait_for(replies.get(), timeout=30)
+                    if i >= warmup:
+                        latencies.append(replied - sent)
+
+                rss_loaded = rss_mb(proc.pid)
+                reader_task.cancel()
+    finally:
+        proc.kill()
+        proc.wait()
+
+    latencies.sort()
+    return {
+        "platform": platform,
+        "startup_s": startup,
+        "rss_idle_mb": rss_idle,
+        "rss_loaded_mb": rss_loaded,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def fmt(value: float | None, unit: str) -> str:
+    return "N/A" if value is None else f"{value:.1f}{unit}"
+
+
+async def main_async(args):
+    results = []
+    for platform in args.platforms:
+        results.append(await bench_platform(platform, args.messages, args.warmup))
+
+    print(f"{'平台':<10}{'启动':>10}{'空闲RSS':>12}{'负载后RSS':>12}{'p50':>10}{'p95':>10}{'平均':>10}")
+    for r in results:
+        print(f"{r['platform']:<10}{fmt(r['startup_s'], 's'):>10}{fmt(r['rss_idle_mb'], 'MB'):>12}"
+              f"{fmt(r['rss_loaded_mb'], 'MB'):>12}{fmt(r['p50_ms'], 'ms'):>10}{fmt(r['p95_ms'], 'ms'):>10}"
+              f"{fmt(r['mean_ms'], 'ms'):>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="平台适配器开销对比")
+    parser.add_argument("--messages", type=int, default=300, help="每个平台发送的消息数")
+    parser.add_argument("--warmup", type=int, default=20, help="不计入统计的预热消息数")
+    parser.add_argument("--platforms", nargs="+", default=["onebot", "ariadne"], choices=["onebot", "ariadne"])
+    asyncio.run(main_async(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+长时间运行的内存测试
+
+使用 loadtest 的临时数据库和模拟学习通接口，连续向 handle_message 发送大量消息，
+定期记录进程的常驻内存（RSS）、gc 跟踪的对象数和内存中的 ORM 对象数，
+预热之后这些数值应当保持平稳。超过允许的增长时以非零退出码结束，可以放在 CI 中运行。
+
+用法（在仓库根目录下）：
+    python benchmarks/soak.py --messages 100000
+    python benchmarks/soak.py --messages 5000 --samples 5 --max-rss-growth 10
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import loadtest
+
+
+def rss_mb() -> float:
+    """当前进程的常驻内存（MB）。非 Linux 系统上退回到峰值常驻内存。"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def orm_objects() -> int:
+    """内存中仍然存活的用户、课程和活动对象数。"""
+    from db.db_models import Course, SignInActivity, User
+
+    return sum(1 for o in gc.get_objects() if isinstance(o, (User, Course, SignInActivity)))
+
+
+def sample() -> dict:
+    gc.collect()
+    return {"rss_mb": rss_mb(), "objects": len(gc.get_objects()), "orm_objects": orm_objects()}
+
+
+async def soak(generator: loadtest.CommandGenerator, messages: int, concurrency: int, samples: int) -> list[dict]:
+    from handle_msg import handle_message
+
+    async def respond(msg, qq_number: str = None):
+        pass
+
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def one(qq_num: str, message: str):
+        nonlocal errors
+        async with semaphore:
+            try:
+                await handle_message(respond, qq_num, message)
+            except Exception:
+                errors += 1
+
+    results = []
+    every = max(messages // samples, 1)
+    start = time.perf_counter()
+    for sent in range(0, messages, every):
+        batch = min(every, messages - sent)
+        await asyncio.gather(*(one(*generator.next()[1:]) for _ in range(batch)))
+        point = sample()
+        point.update(messages=sent + batch, elapsed_s=round(time.perf_counter() - start, 1), errors=errors)
+        results.append(point)
+        print(f"{point['messages']:>8} 条  {point['elapsed_s']:>7}s  RSS {point['rss_mb']:>7.1f}MB  "
+              f"对象 {point['objects']:>9}  ORM 对象 {point['orm_objects']:>6}  错误 {errors}")
+    return results
+
+
+def check(results: list[dict], warmup: int, max_rss_growth: float, max_object_growth: float,
+          max_orm_objects: int) -> list[str]:
+    """
+    比较预热后的第一个采样点与最后一个采样点。
+
+    :return: 不满足的条件，为空表示通过。
+    """
+    baseline, last = results[min(warmup, len(results) - 1)], results[-1]
+    failures = []
+    rss_growth = last["rss_mb"] - baseline["rss_mb"]
+    if rss_growth > max_rss_growth:
+        failures.append(f"RSS 增长 {rss_growth:.1f}MB，超过 {max_rss_growth}MB")
+    object_growth = (last["objects"] - baseline["objects"]) / baseline["objects"]
+    if object_growth > max_object_growth:
+        failures.append(f"对象数增长 {object_growth:.1%}，超过 {max_object_growth:.0%}")
+    if last["orm_objects"] > max_orm_objects:
+        failures.append(f"消息处理完后仍有 {last['orm_objects']} 个 ORM 对象，超过 {max_orm_objects}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="handle_message 长时间运行内存测试")
+    parser.add_argument("--messages", type=int, default=100000, help="发送的消息总数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同时处理的消息数")
+    parser.add_argument("--samples", type=int, default=20, help="采样次数")
+    parser.add_argument("--warmup", type=int, default=2, help="作为基准前跳过的采样次数")
+    parser.add_argument("--users", type=int, default=2000, help="预置的已登录用户数")
+    parser.add_argument("--courses", type=int, default=200, help="预置的课程数")
+    parser.add_argument("--mix", type=loadtest.parse_mix, default=loadtest.parse_mix(loadtest.DEFAULT_MIX),
+                        help=f"指令权重，默认 {loadtest.DEFAULT_MIX}")
+    parser.add_argument("--max-rss-growth", type=float, default=20, help="允许的 RSS 增长（MB）")
+    parser.add_argument("--max-object-growth", type=float, default=0.05, help="允许的对象数增长比例")
+    parser.add_argument("--max-orm-objects", type=int, default=100, help="采样时允许存活的 ORM 对象数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    loadtest.prepare_environment(tempfile.mkdtemp(prefix="xxt_soak_"))
+    seed = loadtest.seed_database(args.users, args.courses, 6, 2, rng)
+    loadtest.install_fake_xxt_api(seed, 0, 0, False, rng)
+
+    # 预置数据时加载的对象不属于任何一次操作，先释放
+    from db.db import db_session
+    db_session.remove()
+
+    generator = loadtest.CommandGenerator(seed, args.mix, rng)
+    results = asyncio.run(soak(generator, args.messages, args.concurrency, args.samples))
+
+    failures = check(results, args.warmup, args.max_rss_growth, args.max_object_growth, args.max_orm_objects)
+    for failure in failures:
+        print(f"未通过: {failure}")
+    if failures:
+        sys.exit(1)
+    print("通过: 内存保持平稳")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+冷启动基准测试
+
+1. 以 python -X importtime 分别导入各模块，报告累计导入耗时及最慢的依赖；
+2. 测量首条回复时间：从启动解释器到载入配置、连接数据库、处理第一条指令并调用回复函数为止。
+
+用法（在仓库根目录下）：
+    python benchmarks/startup.py
+    python benchmarks/startup.py --target-ms 800 --with-platform   # 同时导入 Ariadne 平台模块
+超出首条回复时间目标时以状态码 1 退出。
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ("config", "db.db", "db.crud", "xxt_api", "handle_msg", "platforms.ariadne_bot")
+
+FIRST_REPLY_SCRIPT = """
+import asyncio, sys
+from loguru import logger
+logger.remove()
+from config import init_config
+from db.db import init_db
+init_config()
+init_db()
+from handle_msg import handle_message
+if {with_platform}:
+    import platforms.ariadne_bot
+
+async def respond(msg, qq_number=None):
+    print("FIRST_REPLY", flush=True)
+    sys.exit(0)
+
+asyncio.run(handle_message(respond, "10000", "课程列表"))
+"""
+
+
+def write_config(workdir: str):
+    with open(os.path.join(workdir, "config.cfg"), "w", encoding="utf-8") as f:
+        f.write(
+            "[db]\n"
+            f"sqlalchemy_db_url = \"sqlite:///{os.path.join(workdir, 'startup.db')}\"\n"
+        )
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONWARNINGS"] = "ignore"
+    return env
+
+
+def import_time(module: str, workdir: str) -> tuple[float, list[tuple[float, str]]]:
+    """
+    :return: (模块累计导入耗时（毫秒）, [(累计耗时（毫秒）, 依赖名), ...] 按耗时降序)
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=workdir, env=child_env(), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    total = 0.0
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        cumulative_ms = int(cumulative) / 1000
+        name = name.rstrip()[1:]
+        if name.strip() == module:
+            total = cumulative_ms
+        elif name.startswith("  ") and not name.startswith("   "):
+            # 只统计直接依赖（缩进两格）
+            entries.append((cumulative_ms, name.strip()))
+    return total, sorted(entries, reverse=True)
+
+
+def first_reply_time(workdir: str, with_platform: bool) -> float:
+    script = FIRST_REPLY_SCRIPT.format(with_platform=with_platform)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", script], cwd=workdir, env=child_env(),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if line.startswith("FIRST_REPLY"):
+            elapsed = time.perf_counter() - start
+            proc.wait()
+            return elapsed * 1000
+    raise RuntimeError(f"没有收到回复:\n{proc.stderr.read()[-2000:]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="首条回复时间的测量次数")
+    parser.add_argument("--top", type=int, default=5, help="每个模块显示的最慢直接依赖数")
+    parser.add_argument("--target-ms", type=float, default=1000, help="首条回复时间目标（毫秒，取中位数）")
+    parser.add_argument("--with-platform", action="store_true", help="首条回复前同时导入 Ariadne 平台模块")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="xxt_startup_")
+    write_config(workdir)
+
+    print("模块导入耗时（-X importtime，累计）:")
+    for module in MODULES:
+        total, entries = import_time(module, workdir)
+        print(f"  {module:<24}{total:>10.1f} ms")
+        for cumulative_ms, name in entries[:args.top]:
+            print(f"      {name:<32}{cumulative_ms:>10.1f} ms")
+
+    samples = [first_reply_time(workdir, args.with_platform) for _ in range(args.runs)]
+    median = statistics.median(samples)
+    print(f"首条回复时间: 中位数 {median:.1f} ms  最小 {min(samples):.1f} ms  最大 {max(samples):.1f} ms  "
+          f"目标 {args.target_ms:.0f} ms")
+    if median > args.target_ms:
+        print("未达到首条回复时间目标")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+工作进程扩展性测试
+
+向工作进程池（workers.WorkerPool）并发提交解析课程列表页面的任务（xxt_jobs.parse_courses，只占用 CPU），
+比较不同工作进程数下每秒完成的任务数。0 表示在前端进程中直接执行。
+同时在前端的事件循环上计时，工作进程模式下事件循环不再被解析阻塞。
+
+用法（在仓库根目录下）：
+    python benchmarks/workers_scaling.py --jobs 200 --courses 200 --processes 0 1 2 4
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import parse_lag
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def prepare_environment(workdir: str):
+    """写入临时配置文件并切换工作目录，工作进程启动时读取同一份配置。"""
+    with open(os.path.join(workdir, "config.cfg"), "w", encoding="utf-8") as f:
+        f.write(
+            "[db]\n"
+            f"sqlalchemy_db_url = \"sqlite:///{os.path.join(workdir, 'workers.db')}\"\n"
+            "[system]\n"
+            "parse_executor = \"inline\"\n"
+            "[logging]\n"
+            "level = \"WARNING\"\n"
+        )
+    os.chdir(workdir)
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+
+async def bench(processes: int, jobs: int, courses_html: str) -> dict:
+    import workers
+
+    lag: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(parse_lag.monitor_loop_lag(lag, 0.01, stop))
+
+    if processes:
+        pool = workers.WorkerPool(processes)
+        pool.start(asyncio.get_running_loop())
+        # 等待所有进程启动完成
+        await asyncio.gather(*(pool.call("parse_courses", "<html></html>") for _ in range(processes * 4)))
+        call = pool.call
+    else:
+        pool = None
+        call = workers.run
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call("parse_courses", courses_html) for _ in range(jobs)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await monitor
+    if pool is not None:
+        pool.stop()
+    return {"elapsed": elapsed, "throughput": jobs / elapsed, "max_lag_ms": max(lag, default=0) * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="工作进程扩展性测试")
+    parser.add_argument("--jobs", type=int, default=200, help="提交的任务数")
+    parser.add_argument("--courses", type=int, default=200, help="每份课程列表页面中的课程数")
+    parser.add_argument("--processes", type=int, nargs="+", default=[0, 1, 2, 4], help="要比较的工作进程数")
+    args = parser.parse_args(argv)
+
+    prepare_environment(tempfile.mkdtemp(prefix="xxt_workers_"))
+    from config import init_config
+    from db.db import init_db
+    init_config()
+    init_db()
+
+    courses_html = parse_lag.course_list_html(args.courses)
+    print(f"CPU 核心数: {os.cpu_count()}")
+    print(f"{'工作进程':<10}{'耗时(s)':>10}{'任务/秒':>10}{'最大事件循环延迟(ms)':>24}")
+    for processes in args.processes:
+        result = asyncio.run(bench(processes, args.jobs, courses_html))
+        print(f"{processes:<10}{result['elapsed']:>10.2f}{result['throughput']:>10.1f}{result['max_lag_ms']:>24.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+批量导入用户。
+
+管理员发送“批量导入”并在之后各行附上 CSV（每行 手机号,密码,QQ号），或运行 python bulk_import.py users.csv。
+登录在 system.bulk_import_concurrency 的并发和 bulk_import_login_rate 的速率限制下进行，
+登录成功的用户每 bulk_import_batch_size 个在一个事务中写入数据库，最后给出每一行的结果和总吞吐量。
+"""
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import re
+import time
+from dataclasses import dataclass
+
+from loguru import logger as l
+
+import db.crud
+import workers
+from config import c, ConfigError
+from db.db import session_scope
+from logs import mask
+from resilience import CircuitOpenError, RateLimiter
+from xxt_api import IncorrectPasswordError, LoginError, GetCoursesError
+
+PHONE_PATTERN = re.compile(r"1\d{10}")
+# 与“登录”指令相同的密码格式
+PASSWORD_PATTERN = re.compile(r"[A-Za-z0-9!@#$%^&*()_+-=]{8,16}")
+QQ_PATTERN = re.compile(r"\d{5,13}")
+
+
+@dataclass
+class ImportRow:
+    line: int
+    """CSV 中的行号，从 1 开始"""
+    phone_number: str
+    password: str
+    qq_num: str
+
+
+@dataclass
+class RowResult:
+    line: int
+    phone_number: str
+    ok: bool
+    message: str
+    """“新建”、“更新”或失败原因"""
+    courses: int = 0
+    """导入的课程数"""
+    seconds: float = 0
+    """登录用时（秒）"""
+
+
+def parse_csv(text: str) -> tuple[list[ImportRow], list[RowResult]]:
+    """
+    解析 手机号,密码,QQ号 格式的 CSV，第一行可以是表头。
+
+    :return: (格式正确的行, 格式有误的行的结果)
+    """
+    rows, errors = [], []
+    phones, qq_nums = set(), set()
+    for line, fields in enumerate(csv.reader(io.StringIO(text.strip())), 1):
+        fields = [field.strip() for field in fields]
+        if not any(fields):
+            continue
+        if line == 1 and not fields[0].isdigit():
+            continue
+        phone = fields[0]
+
+        def error(message: str):
+            errors.append(RowResult(line, phone, False, message))
+
+        if len(fields) < 3:
+            error("格式有误，应为 手机号,密码,QQ号")
+        elif not PHONE_PATTERN.fullmatch(phone):
+            error("手机号格式有误")
+        elif not PASSWORD_PATTERN.fullmatch(fields[1]):
+            error("密码格式有误")
+        elif not QQ_PATTERN.fullmatch(fields[2]):
+            error("QQ 号格式有误")
+        elif phone in phones or fields[2] in qq_nums:
+            error("手机号或 QQ 号与前面的行重复")
+        else:
+            phones.add(phone)
+            qq_nums.add(fields[2])
+            rows.append(ImportRow(line, phone, fields[1], fields[2]))
+    return rows, errors
+
+
+def check_existing(row: ImportRow) -> str | None:
+    """
+    :return: 不能导入该行的原因，可以导入时为 None。
+    """
+    user = db.crud.get_user(phone_number=row.phone_number)
+    if user is not None and user.is_banned:
+        return "该手机号的用户已被封禁"
+    owner = db.crud.get_user(qq_num=row.qq_num)
+    if owner is not None and owner.phone_number != row.phone_number:
+        return "该 QQ 号已绑定其他学习通账号"
+    return None
+
+
+def describe_error(e: Exception) -> str:
+    if isinstance(e, IncorrectPasswordError):
+        return "用户名或密码有误"
+    if isinstance(e, CircuitOpenError):
+        return "学习通暂时无法访问"
+    if isinstance(e, LoginError):
+        return "登录方法有变"
+    if isinstance(e, GetCoursesError):
+        return "无法取得课程列表"
+    if isinstance(e, ConfigError):
+        return "配置文件有误"
+    return f"未知错误: {e}"
+
+
+async def import_users(rows: list[ImportRow]) -> list[RowResult]:
+    """|coro|
+    登录各行的账号并写入数据库。同一手机号的已有用户更新信息和课程，与“登录”指令相同。
+
+    :return: 每一行的结果，按行号排序。
+    """
+    semaphore = asyncio.Semaphore(c.system.bulk_import_concurrency)
+    limiter = RateLimiter(c.system.bulk_import_login_rate)
+    results: dict[int, RowResult] = {}
+    # 登录成功、等待写入数据库的 (行, 登录结果, 登录用时)
+    pending: list[tuple[ImportRow, dict, float]] = []
+
+    def write(batch: list[tuple[ImportRow, dict, float]]):
+        try:
+            created = db.crud.upsert_users([(info["user"], info["courses"]) for _, info, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # 逐个重试，找出出错的行
+                for entry in batch:
+                    write([entry])
+                return
+            row, _, seconds = batch[0]
+            l.error("批量导入 {} 时写入数据库失败: {}", mask(row.phone_number), e)
+            results[row.line] = RowResult(row.line, row.phone_number, False, f"写入数据库失败: {e}", seconds=seconds)
+            return
+        for (row, info, seconds), new in zip(batch, created):
+            results[row.line] = RowResult(row.line, row.phone_number, True, "新建" if new else "更新",
+                                          len(info["courses"]), seconds)
+
+    async def login(row: ImportRow):
+        # 每一行使用自己的会话，一行登录或写入出错回滚时不影响其他行
+        with session_scope(fresh=True):
+            await login_row(row)
+
+    async def login_row(row: ImportRow):
+        reason = check_existing(row)
+        if reason:
+            results[row.line] = RowResult(row.line, row.phone_number, False, reason)
+            return
+        async with semaphore:
+            await limiter.acquire()
+            start = time.perf_counter()
+            try:
+                info = await workers.run("login", row.phone_number, row.password, row.qq_num, False)
+            except Exception as e:
+                l.warning("批量导入 {} 时登录失败: {}", mask(row.phone_number), e)
+                results[row.line] = RowResult(row.line, row.phone_number, False, describe_error(e),
+                                              seconds=time.perf_counter() - start)
+                return
+        pending.append((row, info, time.perf_counter() - start))
+        if len(pending) >= c.system.bulk_import_batch_size:
+            batch = pending[:]
+            pending.clear()
+            write(batch)
+
+    await asyncio.gather(*(login(row) for row in rows))
+    if pending:
+        write(pending)
+    return [results[line] for line in sorted(results)]
+
+
+def summarize(results: list[RowResult], elapsed: float) -> str:
+    succeeded = [result for result in results if result.ok]
+    created = sum(1 for result in succeeded if result.message == "新建")
+    logins = [result.seconds for result in results if result.seconds]
+    average = sum(logins) / len(logins) if logins else 0
+    return (f"共 {len(results)} 行：成功 {len(succeeded)} 行（新建 {created}，更新 {len(succeeded) - created}），"
+            f"失败 {len(results) - len(succeeded)} 行。用时 {elapsed:.1f} 秒，"
+            f"{len(results) / elapsed if elapsed else 0:.2f} 行/秒，平均每次登录 {average:.1f} 秒")
+
+
+def format_row(result: RowResult) -> str:
+    detail = f"，{result.courses} 门课程" if result.ok else ""
+    return f"第 {result.line} 行 {mask(result.phone_number)}: {result.message}{detail}"
+
+
+async def run(rows: list[ImportRow], errors: list[RowResult]) -> tuple[list[RowResult], float]:
+    """|coro|
+    导入 parse_csv 的结果。
+
+    :return: (每一行的结果（包括格式有误的行）, 用时（秒）)
+    """
+    start = time.perf_counter()
+    l.info(f"批量导入 {len(rows)} 个用户，{len(errors)} 行格式有误")
+    results = sorted(errors + await import_users(rows), key=lambda result: result.line)
+    elapsed = time.perf_counter() - start
+    l.success(f"批量导入完成。{summarize(results, elapsed)}")
+    return results, elapsed
+
+
+def write_report(results: list[RowResult], path: str):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["行号", "手机号", "结果", "说明", "课程数", "登录用时(秒)"])
+        for result in results:
+            writer.writerow([result.line, result.phone_number, "成功" if result.ok else "失败", result.message,
+                             result.courses, f"{result.seconds:.2f}"])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import logs
+    from config import init_config
+    from db.db import init_db
+
+    parser = argparse.ArgumentParser(description="从 CSV（每行 手机号,密码,QQ号）批量导入用户")
+    parser.add_argument("csv", help="CSV 文件")
+    parser.add_argument("--report", help="把每一行的结果写入这个 CSV 文件")
+    args = parser.parse_args()
+
+    init_config()
+    logs.setup()
+    init_db()
+
+    async def main():
+        workers.start(asyncio.get_running_loop())
+        with open(args.csv, encoding="utf-8-sig") as f, session_scope():
+            return await run(*parse_csv(f.read()))
+
+    results, elapsed = asyncio.run(main())
+    for result in results:
+        print(format_row(result))
+    print(summarize(results, elapsed))
+    if args.report:
+        write_report(results, args.report)
@@ -1,22 +1,21 @@
 from __future__ import annotations
-from typing import Optional
-from pydantic import BaseModel
-from charset_normalizer import from_bytes
+from typing import List, Optional
+from pydantic import BaseModel, root_validator
 from loguru import logger
 import sys
-import toml
 
-'''
+
 class Onebot(BaseModel):
     qq: int
     """Bot 的 QQ 号"""
     manager_qq: int = 0
     """机器人管理员的 QQ 号"""
+    access_token: Optional[str] = None
+    """OneBot 实现中配置的 access_token"""
     reverse_ws_host: str = "0.0.0.0"
     """go-cqhttp 的 反向 ws 主机号"""
-    reverse_ws_port: Optional[int] = 8566
-    """go-cqhttp 的 反向 ws 端口号，填写后开启 反向 ws 模式"""
-'''
+    reverse_ws_port: int = 8566
+    """go-cqhttp 的 反向 ws 端口号"""
 
 
 class Mirai(BaseModel):
@@ -46,6 +45,61 @@ class System(BaseModel):
     web_requests_lantency: float = 0.5
     """每个web请求之间的延迟，对所有请求适用，不分用户"""
 
+    cookies_auto_refresh: bool = False
+    """在 cookies 失效前自动重新登录，避免用户操作时才发现 cookies 失效。默认关闭：开启后会在后台为所有用户登录学习通"""
+
+    cookies_refresh_ahead: float = 3600
+    """提前多少秒刷新 cookies。实际刷新时间在失效前 cookies_refresh_ahead 到 cookies_refresh_ahead / 2 秒之间，按用户分散"""
+
+    cookies_max_lifetime: float = 172800
+    """cookies 的最长使用时间（秒）。学习通的会话 cookies 没有失效时间，按此估计"""
+
+    cookies_refresh_interval: float = 5
+    """两次自动刷新之间的最小间隔（秒），避免集中登录"""
+
+    parse_executor: str = "thread"  # inline, thread, process
+    """解析学习通网页的方式：inline 在事件循环中直接解析，thread 使用线程池，process 使用进程池（多核并行，不受 GIL 限制）"""
+
+    parse_workers: int = 2
+    """解析池的线程数或进程数"""
+
+    course_sync_interval: float = 0
+    """后台增量同步每个用户课程列表的间隔（秒），如 86400。默认为 0，不同步"""
+
+    course_sync_spacing: float = 5
+    """两个用户的课程同步之间的最小间隔（秒）"""
+
+    notify_new_activities: bool = False
+    """发现新签到活动时私聊通知课程的学生。默认关闭：开启后机器人会主动给学生发私聊消息"""
+
+    notify_rate: float = 1
+    """发送通知的速率上限（条/秒），避免触发 QQ 的发送频率限制"""
+
+    notify_concurrency: int = 4
+    """同时发送的通知数"""
+
+    sign_in_batch_concurrency: int = 8
+    """有人提交签到解后，为同一活动的其他学生签到时的最大并发数"""
+
+    bulk_import_concurrency: int = 8
+    """批量导入用户时同时进行的登录数"""
+
+    bulk_import_login_rate: float = 2
+    """批量导入用户时每秒最多开始的登录数，避免触发学习通的限流"""
+
+    bulk_import_batch_size: int = 20
+    """批量导入用户时每批写入数据库的用户数"""
+
+    warmup_enable: bool = False
+    """机器人启动并连接成功后，预先校验所有用户的 cookies（失效时重新登录）并取得各课程的跳转页。
+    默认关闭：开启后每次启动都会为所有用户请求学习通，用户较多时应配合较小的 warmup_concurrency"""
+
+    warmup_concurrency: int = 8
+    """预热时同时处理的用户数"""
+
+    warmup_prefetch_courses: bool = True
+    """预热时是否取得各课程的跳转页（写入页面缓存），用户的第一次“查询课程”不必再等待"""
+
 
 class Respond(BaseModel):
     new_user_message: str = "欢迎新用户使用。本程序具有这些功能：..."
@@ -93,16 +147,181 @@ class XxtAPI(BaseModel):
     xxt_login_encrypt_key: str = "u2oh6Vu^HWe4_AES"
     """加密密钥，只在对称加密算法(aes, des...)有效"""
 
+    circuit_failure_threshold: int = 5
+    """同一主机连续失败多少次后熔断，熔断期间不再发送请求而直接失败"""
+
+    circuit_recovery_time: float = 30
+    """熔断多少秒后放行一个试探请求"""
+
+    cookies_check_ttl: float = 0
+    """这段时间（秒）内向学习通确认过有效的 cookies 直接使用，不再下载个人空间页面校验，如 1800。
+    默认为 0，每次都校验：这段时间内 cookies 被服务器作废（如在其他设备登录）时，请求会失败而不会重新登录"""
+
+    http_cache_enable: bool = True
+    """缓存很少变化的页面（课程列表、课程跳转页），过期后用 ETag/Last-Modified 向学习通确认"""
+
+    http_cache_path: str = "http_cache.db"
+    """页面缓存的文件，重启后继续使用"""
+
+    http_cache_ttl: dict = {
+        "courselistdata": 600,
+        "stucoursemiddle": 86400,
+    }
+    """学习通没有返回 Cache-Control/Expires 时，各页面缓存的有效时间（秒）"""
+
+
+class Metrics(BaseModel):
+    enable: bool = False
+    """是否开启 Prometheus 指标接口"""
+
+    host: str = "127.0.0.1"
+    """独立指标服务器的监听地址"""
+
+    port: int = 9108
+    """独立指标服务器的端口"""
+
+    path: str = "/metrics"
+    """指标接口的路径"""
+
+    share_reverse_ws_server: bool = False
+    """Mirai 为反向 ws 模式时，把指标接口挂载到反向 ws 使用的服务器上，不再单独启动服务器"""
+
+
+class Workers(BaseModel):
+    processes: int = 0
+    """学习通工作进程数。大于 0 时本进程只处理 QQ 消息，登录、扫描活动、签到等任务交给工作进程，0 为全部在本进程中执行"""
+
+    concurrency: int = 32
+    """每个工作进程同时执行的任务数"""
+
+    job_timeout: float = 120
+    """等待工作进程返回结果的最长时间（秒）"""
+
+
+class JobQueue(BaseModel):
+    enable: bool = False
+    """是否使用数据库中的任务队列执行后台签到、cookies 刷新和轮询失败的重试，重启后未完成的任务继续执行。默认关闭"""
+
+    concurrency: int = 8
+    """本进程同时执行的任务数"""
+
+    poll_interval: float = 2
+    """队列为空时检查新任务的间隔（秒）"""
+
+    lease: int = 300
+    """任务的租约时长（秒）。任务最多执行这么久，执行它的进程退出后任务在租约到期时被重新领取"""
+
+    max_attempts: int = 5
+    """任务最多执行的次数，仍然失败的任务转入死信，不再重试"""
+
+    retry_delay: float = 30
+    """第一次重试前等待的时间（秒），之后每次加倍"""
+
+    done_retention: float = 86400
+    """已完成的任务保留多久（秒）后删除，死信不删除"""
+
+
+class Tracing(BaseModel):
+    enable: bool = False
+    """为每条消息记录学习通请求、数据库操作、网页解析、发送和等待的时间线。默认关闭：开启后会向 dir 写入文件"""
+
+    slow_threshold: float = 5
+    """处理一条消息超过这么多秒时，把时间线写入 dir 目录"""
+
+    dir: str = "traces"
+    """时间线文件（Chrome trace event JSON）的目录"""
+
+    max_files: int = 100
+    """最多保留的时间线文件数，超过时删除最早的"""
+
+    max_spans: int = 5000
+    """每条消息最多记录的 span 数"""
+
+
+class Logging(BaseModel):
+    level: str = "DEBUG"
+    """输出的最低日志级别"""
+
+    serialize: bool = False
+    """每条日志输出为一行 JSON"""
+
+    file: str = ""
+    """同时写入的日志文件，为空则只输出到终端"""
+
+    file_max_mb: float = 10
+    """日志文件超过这个大小（MB）后轮换"""
+
+    file_backups: int = 5
+    """轮换后保留的旧日志文件数"""
+
+    enqueue: bool = True
+    """日志放入队列，由后台线程写入，不在事件循环中等待终端或磁盘"""
+
+    sample_max_level: str = "DEBUG"
+    """对这个级别及以下的日志按调用位置限流"""
+
+    sample_rate: float = 1
+    """每个调用位置平均每秒最多输出的日志条数，0 为不限流"""
+
+    sample_burst: int = 10
+    """每个调用位置短时间内最多连续输出的日志条数"""
+
+
+class Poller(BaseModel):
+    enable: bool = False
+    """是否在后台轮询课程活动"""
+
+    hot_interval: float = 60
+    """课程通常发布活动的时间段内的轮询间隔（秒）"""
+
+    base_interval: float = 300
+    """其他时间的初始轮询间隔（秒），没有新变化时按指数增长"""
+
+    max_interval: float = 7200
+    """轮询间隔的上限（秒）"""
+
+    slot_minutes: int = 30
+    """统计活动时间的时间段长度（分钟）"""
+
+    hot_margin_minutes: int = 15
+    """在通常的时间段前后各扩展多少分钟"""
+
+    min_history: int = 2
+    """某个时间段（星期几 + 时刻）历史上至少发布过几次活动才视为活跃时间段"""
+
+    history_days: int = 120
+    """统计最近多少天的活动"""
+
+    requests_per_hour: int = 600
+    """轮询每小时最多向学习通发送的请求数，所有课程共用"""
+
+    requests_per_poll: int = 3
+    """估计的每次轮询的请求数（校验 cookies、课程中转页、活动列表），用于预算和预估"""
+
 
 class Db(BaseModel):
     sqlalchemy_db_url: str = ''
     '''参考文档：https://www.osgeo.cn/sqlalchemy/core/engines.html#database-urls'''
 
+    pool_size: int = 10
+    """连接池保持的连接数（SQLite 以外的数据库）"""
+
+    max_overflow: int = 20
+    """连接池在 pool_size 之外最多再打开的连接数。同时处理的消息和后台任务较多时应调大，但不要超过数据库服务器允许的连接数"""
+
+    pool_timeout: float = 10
+    """连接池已满时等待空闲连接的最长时间（秒），超时后该操作失败"""
+
+    sqlite_busy_timeout: float = 5
+    """SQLite 等待其他连接释放写锁的最长时间（秒）"""
+
 
 class Config(BaseModel):
     # === Platform Settings ===
-    # onebot: Optional[Onebot] = None
+    onebot: Optional[Onebot] = None
     mirai: Optional[Mirai] = None
+    mirai_shards: List[Mirai] = []
+    """多账号分片模式：每个账号在独立进程中运行，按 QQ 号的哈希分配用户，填写后忽略 mirai 配置，不能与 onebot 同时使用"""
 
     # === General Settings ===
     system: System = System()
@@ -116,10 +335,38 @@ class Config(BaseModel):
     # === Database Settings ===
     db: Db = Db()
 
+    # === Metrics Settings ===
+    metrics: Metrics = Metrics()
+
+    # === Poller Settings ===
+    poller: Poller = Poller()
+
+    # === Workers Settings ===
+    workers: Workers = Workers()
+
+    # === Job Queue Settings ===
+    job_queue: JobQueue = JobQueue()
+
+    # === Tracing Settings ===
+    tracing: Tracing = Tracing()
+
+    # === Logging Settings ===
+    logging: Logging = Logging()
+
+    @root_validator(skip_on_failure=True)
+    def check_shards(cls, values):
+        # 每个分片进程都会启动已配置的平台，OneBot 服务端会在同一端口上重复监听；通知也只按 mirai 分片分配
+        if values.get("mirai_shards") and values.get("onebot"):
+            raise ValueError("mirai_shards 分片模式不能与 onebot 同时配置，请删除其中之一")
+        return values
+
     @staticmethod
-    def load_config() -> Config:
+    def load_config(path: str = "config.cfg") -> Config:
+        from charset_normalizer import from_bytes
+        import toml
+
         try:
-            with open("config.cfg", "rb") as f:
+            with open(path, "rb") as f:
                 if guessed_str := from_bytes(f.read()).best():
                     return Config.parse_obj(toml.loads(str(guessed_str)))
                 else:
@@ -131,6 +378,8 @@ class Config(BaseModel):
 
     @staticmethod
     def save_config(config: Config):
+        import toml
+
         try:
             with open("config.cfg", "wb") as f:
                 parsed_str = toml.dumps(config.dict()).encode(sys.getdefaultencoding())
@@ -140,18 +389,26 @@ class Config(BaseModel):
             logger.warning("配置保存失败。")
 
 
-try:
+c = Config()
+"""全局配置。在调用 init_config() 之前为默认值，其他模块应在运行时读取其属性，而不是在导入时。"""
+
+
+def init_config(path: str = "config.cfg") -> Config:
+    """
+    载入配置文件，并原地更新全局配置 c，使已经导入 c 的模块也能读取到新配置。
+    配置文件有误时退出程序。
+
+    :param path: 配置文件路径。
+    :return: 全局配置 c。
+    """
     logger.info("载入配置文件")
-    c = Config.load_config()
-except Exception as e:
-    logger.error("配置文件有误")
-    logger.exception(e)
-    exit(1)
+    loaded = Config.load_config(path)
+    for field in loaded.__fields__:
+        setattr(c, field, getattr(loaded, field))
+    logger.success("载入配置文件成功")
+    return c
 
 
 class ConfigError(Exception):
     """Raised when there is an error in the configuration file."""
     pass
-
-
-logger.success("载入配置文件成功")
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import zlib
+
+from loguru import logger as l
+
+import db.crud
+import job_queue
+import sharding
+import workers
+from logs import mask
+from config import c
+from db.db import session_scope
+from db.db_models import User
+
+CHECK_INTERVAL = 60
+"""检查待刷新用户的间隔（秒）"""
+
+FAILURE_BACKOFF = 3600
+"""刷新失败（如密码已修改）后，多久再尝试该用户（秒）"""
+
+# 用户 id -> 下次允许尝试（或加入任务队列）的时间戳
+_failed_until: dict[int, float] = {}
+
+
+def refresh_due_at(user: User) -> float:
+    """
+    用户 cookies 的计划刷新时间。按手机号在失效前 cookies_refresh_ahead 到 cookies_refresh_ahead / 2 秒之间分散，
+    同一时间登录的用户不会同时刷新。没有记录失效时间的用户（旧数据）立即刷新。
+
+    :param user: 用户对象。
+    :return: 时间戳。
+    """
+    if user.cookies_expire_at is None:
+        return 0
+    ahead = c.system.cookies_refresh_ahead
+    spread = zlib.crc32(user.phone_number.encode()) % max(int(ahead / 2), 1)
+    return user.cookies_expire_at - ahead + spread
+
+
+def queue_due_users() -> int:
+    """
+    把到达计划刷新时间的本分片用户加入任务队列，执行时间依次错开 cookies_refresh_interval 秒。
+    失败的刷新由任务队列重试；加入队列后 FAILURE_BACKOFF 秒内不再为该用户加入（刷新成功的用户不会再到期）。
+
+    :return: 加入队列的用户数。
+    """
+    now = time.time()
+    queued = 0
+    for user in db.crud.get_users_with_cookies_expiring(int(now + c.system.cookies_refresh_ahead)):
+        if not sharding.owns(user.qq_num) or refresh_due_at(user) > now or _failed_until.get(user.id, 0) > now:
+            continue
+        if job_queue.enqueue_refresh_cookies(user, delay=queued * c.system.cookies_refresh_interval):
+            queued += 1
+        _failed_until[user.id] = now + FAILURE_BACKOFF
+    return queued
+
+
+async def refresh_due_users() -> int:
+    """
+    刷新到达计划刷新时间的本分片用户，每次刷新之间间隔 cookies_refresh_interval 秒。
+
+    :return: 刷新成功的用户数。
+    """
+    now = time.time()
+    refreshed = 0
+    for user in db.crud.get_users_with_cookies_expiring(int(now + c.system.cookies_refresh_ahead)):
+        if not sharding.owns(user.qq_num) or refresh_due_at(user) > now or _failed_until.get(user.id, 0) > now:
+            continue
+        try:
+            await workers.run("refresh_cookies", user.id)
+            _failed_until.pop(user.id, None)
+            refreshed += 1
+            l.debug("已提前刷新用户 {} 的 cookies", mask(user.phone_number))
+        except Exception as e:
+            _failed_until[user.id] = now + FAILURE_BACKOFF
+            l.warning("刷新用户 {} 的 cookies 失败: {}", mask(user.phone_number), e)
+        await asyncio.sleep(c.system.cookies_refresh_interval)
+        now = time.time()
+    return refreshed
+
+
+async def run():
+    """|coro|
+    后台定时刷新即将失效的 cookies，使用户操作时几乎不需要重新登录。
+    """
+    l.info("已开启 cookies 自动刷新")
+    while True:
+        try:
+            if c.job_queue.enable:
+                with session_scope():
+                    queued = queue_due_users()
+                if queued:
+                    l.info(f"已将 {queued} 个用户的 cookies 刷新加入任务队列")
+            else:
+                with session_scope():
+                    refreshed = await refresh_due_users()
+                if refreshed:
+                    l.info(f"已提前刷新 {refreshed} 个用户的 cookies")
+        except Exception as e:
+            l.error(f"自动刷新 cookies 时出错: {e}")
+        await asyncio.sleep(CHECK_INTERVAL)
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import zlib
+
+from loguru import logger as l
+
+import db.crud
+import sharding
+import workers
+from logs import mask
+from config import c
+from db.db import session_scope
+from db.db_models import User
+from xxt_api import validate_cookies, xxt_get_courses_raw, xxt_parse_courses
+
+CHECK_INTERVAL = 60
+"""检查到期用户的间隔（秒）"""
+
+_started_at = time.time()
+
+# 用户 id -> 上次同步的时间戳（进程内记录，重启后按手机号分散重新同步）
+_synced_at: dict[int, float] = {}
+
+
+async def sync_user(user: User) -> tuple[list, list, list]:
+    """
+    用已保存的 cookies 取得用户的课程列表并增量同步，不需要重新登录（cookies 失效时才会登录）。
+    跳过页面缓存的有效期，直接向学习通确认课程列表是否有变化。
+
+    :return: (新关联的课程, 移除关联的课程, 字段有变化的课程)
+    """
+    cookies = await validate_cookies(user.cookies, phone_number=user.phone_number, password=user.password)
+    courses = await xxt_parse_courses(await xxt_get_courses_raw(cookies, revalidate=True))
+    return db.crud.sync_user_courses(user, courses)
+
+
+def sync_due_at(user: User) -> float:
+    """用户下次同步的时间。进程启动后第一次同步按手机号分散在一个同步周期内。"""
+    interval = c.system.course_sync_interval
+    last = _synced_at.get(user.id)
+    if last is None:
+        return _started_at + zlib.crc32(user.phone_number.encode()) % max(int(interval), 1)
+    return last + interval
+
+
+async def run():
+    """|coro|
+    后台定期为本分片的用户增量同步课程列表，每次同步之间间隔 course_sync_spacing 秒。
+    """
+    l.info("已开启课程列表定期同步")
+    while True:
+        try:
+            now = time.time()
+            with session_scope():
+                due = [user.id for user in db.crud.get_logged_in_users()
+                       if sharding.owns(user.qq_num) and sync_due_at(user) <= now]
+            for user_id in due:
+                # 每个用户单独一个会话，同步大量用户时不会在一个会话中积累所有用户的课程
+                with session_scope():
+                    user = db.crud.get_user(user_id=user_id)
+                    try:
+                        added, removed, changed = await workers.run("sync_courses", user_id)
+                        _synced_at[user_id] = time.time()
+                        if added or removed or changed:
+                            l.info("用户 {} 课程同步: 新增 {} 门，移除 {} 门，更新 {} 门",
+                                   mask(user.phone_number), added, removed, changed)
+                    except Exception as e:
+                        _synced_at[user_id] = time.time()
+                        l.warning("同步用户 {} 的课程列表失败: {}", mask(user.phone_number), e)
+                await asyncio.sleep(c.system.course_sync_spacing)
+        except Exception as e:
+            l.error(f"同步课程列表时出错: {e}")
+        await asyncio.sleep(CHECK_INTERVAL)
+
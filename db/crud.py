@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+import datetime
+import time
+import uuid
 from typing import List
 
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import func, exc
+from sqlalchemy import func, exc, insert, select, update
 
 from db.db_models import *
-from db.db import db_session as s, engine
+from db.db import db_session as s
+import metrics
 
 
+@metrics.timed("crud")
 def delete_all_data() -> bool:
     """
     删库跑路
@@ -20,8 +25,8 @@ def delete_all_data() -> bool:
     try:
         s.commit()
 
-        Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
+        Base.metadata.drop_all(s.get_bind())
+        Base.metadata.create_all(s.get_bind())
 
     except Exception as e:
         s.rollback()
@@ -29,32 +34,75 @@ def delete_all_data() -> bool:
     return True
 
 
+COURSE_FIELDS = ("name", "course_id", "cpi", "teacher_name")
+"""从学习通取得、需要与数据库同步的课程字段"""
+
+
+def _apply_courses(user: User, courses: List[Course]) -> tuple[list, list, list]:
+    """
+    按 class_id 比较取得的课程与用户已关联的课程，只新增、移除关联和更新有变化的字段，不提交。
+    已关联且没有变化的课程不会产生任何写入，关联表中的行（及其中的活动列表指纹）得以保留。
+
+    :return: (新关联的课程, 移除关联的课程, 字段有变化的课程)
+    """
+    fetched = {course.class_id: course for course in courses}
+    stored = {course.class_id: course for course in
+              s.query(Course).filter(Course.class_id.in_(list(fetched))).all()} if fetched else {}
+    linked = {course.class_id: course for course in user.courses}
+    added, removed, changed = [], [], []
+
+    for class_id, course in fetched.items():
+        existing_course = stored.get(class_id)
+        if existing_course is None:
+            s.add(course)
+            existing_course = course
+        elif any(getattr(existing_course, f) != getattr(course, f) for f in COURSE_FIELDS):
+            for f in COURSE_FIELDS:
+                setattr(existing_course, f, getattr(course, f))
+            changed.append(existing_course)
+        if class_id not in linked:
+            user.courses.append(existing_course)
+            added.append(existing_course)
+
+    for class_id, course in linked.items():
+        if class_id not in fetched:
+            user.courses.remove(course)
+            removed.append(course)
+
+    return added, removed, changed
+
+
+@metrics.timed("crud")
+def sync_user_courses(user: User, courses: List[Course]) -> tuple[list, list, list]:
+    """
+    增量同步用户的课程列表。
+
+    :param user: 用户对象。
+    :param courses: 从学习通取得的完整课程列表。
+    :return: (新关联的课程, 移除关联的课程, 字段有变化的课程)
+    """
+    try:
+        result = _apply_courses(user, courses)
+        if any(result):
+            s.commit()
+        return result
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
 def update_user(user: User, courses: List[Course] = None) -> bool:
     """
     更新用户信息和关联课程。
 
     :param user: 用户对象。
-    :param courses: 要关联的课程对象列表。
+    :param courses: 要关联的课程对象列表，与已关联的课程增量同步。
     """
     try:
         # 如果传入了课程列表，则更新用户关联的课程
         if courses:
-            updated_courses = []
-            for course in courses:
-                existing_course = s.query(Course).filter_by(class_id=course.class_id).first()
-                if existing_course:
-                    # 更新现有课程的信息
-                    existing_course.name = course.name
-                    existing_course.course_id = course.course_id
-                    existing_course.cpi = course.cpi
-                    existing_course.teacher_name = course.teacher_name
-                    updated_courses.append(existing_course)
-                else:
-                    # 如果课程不存在，将其添加到会话
-                    s.add(course)
-                    updated_courses.append(course)
-            # 更新用户关联的课程
-            user.courses = updated_courses
+            _apply_courses(user, courses)
         # 提交更改到数据库
         s.commit()
         return True
@@ -64,6 +112,7 @@ def update_user(user: User, courses: List[Course] = None) -> bool:
         raise e
 
 
+@metrics.timed("crud")
 def create_user(user: User, courses: List[Course]) -> bool:
     """
     创建新用户并保存到数据库。
@@ -79,22 +128,10 @@ def create_user(user: User, courses: List[Course]) -> bool:
     # 否则，尝试创建新的用户
     try:
         s.commit()
-        # 对于每个课程，检查是否已经存在，如果存在则更新本地课程信息，否则创建新的
-        for i, course in enumerate(courses):
-            existing_course = s.query(Course).filter_by(class_id=course.class_id).first()
-            if existing_course:
-                # 更新现有课程的信息
-                existing_course.name = course.name
-                existing_course.course_id = course.course_id
-                existing_course.cpi = course.cpi
-                existing_course.teacher_name = course.teacher_name
-                courses[i] = existing_course
-            else:
-                # 如果课程不存在，将其添加到会话
-                s.add(course)
+        # 已存在的课程只更新有变化的字段，不存在的课程新建
+        _apply_courses(user, courses)
 
         # 添加用户和关联的课程到会话
-        user.courses.extend(courses)
         s.add(user)
         s.commit()
         return True
@@ -103,6 +140,39 @@ def create_user(user: User, courses: List[Course]) -> bool:
         raise e
 
 
+@metrics.timed("crud")
+def upsert_users(entries: List[tuple[User, List[Course]]]) -> List[bool]:
+    """
+    在一个事务中批量创建或更新用户（按手机号匹配已有用户）并增量同步其课程。
+    同一批中的多个学生共有的课程只创建一次。
+
+    :param entries: (登录得到的用户对象, 课程列表) 的列表。
+    :return: 每个用户是否为新建。
+    """
+    try:
+        phones = [user.phone_number for user, _ in entries]
+        existing = {user.phone_number: user for user in s.query(User).filter(User.phone_number.in_(phones))}
+        created = []
+        for user, courses in entries:
+            stored = existing.get(user.phone_number)
+            if stored is None:
+                s.add(user)
+                stored = user
+            else:
+                for f in ("xxt_user_id", "qq_num", "name", "cookies", "password"):
+                    setattr(stored, f, getattr(user, f))
+                if user.cookies_expire_at is not None:
+                    stored.cookies_expire_at = user.cookies_expire_at
+            _apply_courses(stored, courses)
+            created.append(stored is user)
+        s.commit()
+        return created
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
 def create_course(course: Course) -> bool:
     """
     创建新课程并保存到数据库。
@@ -129,6 +199,7 @@ def create_course(course: Course) -> bool:
         raise e  # 再次抛出该异常，这样你可以在上级函数中捕获它并处理
 
 
+@metrics.timed("crud")
 def get_course(course_id: int = None, user: User = None) -> Course | None:
     """
     通过各种参数获取一个Course对象。
@@ -153,6 +224,7 @@ def get_course(course_id: int = None, user: User = None) -> Course | None:
     return None
 
 
+@metrics.timed("crud")
 def get_courses_list(qq_num: str = None, ) -> List[Course]:
     """
         获取数据库内某用户的所有课程。
@@ -166,6 +238,7 @@ def get_courses_list(qq_num: str = None, ) -> List[Course]:
     return []
 
 
+@metrics.timed("crud")
 def get_user(qq_num: str = None, phone_number: str = None, user_id: int = None) -> User | None:
     """
     在数据库里查询用户。
@@ -186,6 +259,41 @@ def get_user(qq_num: str = None, phone_number: str = None, user_id: int = None)
     return None
 
 
+@metrics.timed("crud")
+def get_logged_in_users() -> List[User]:
+    """
+    查询已绑定 QQ 号、有 cookies 且未被封禁的用户。
+    """
+    return (s.query(User)
+            .filter(User.qq_num.is_not(None), User.cookies.is_not(None), User.is_banned.is_(False))
+            .all())
+
+
+@metrics.timed("crud")
+def count_users_with_valid_cookies(now: int) -> tuple[int, int]:
+    """
+    :return: (cookies 尚未到预计失效时间的已登录用户数, 已登录用户数)
+    """
+    logged_in = s.query(User).filter(User.qq_num.is_not(None), User.cookies.is_not(None))
+    return logged_in.filter(User.cookies_expire_at > now).count(), logged_in.count()
+
+
+@metrics.timed("crud")
+def get_users_with_cookies_expiring(before: int) -> List[User]:
+    """
+    查询 cookies 将在指定时间前失效的未封禁用户，包括没有记录失效时间的用户。
+
+    :param before: 时间戳。
+    :return: 按失效时间排序的 User 列表，没有记录失效时间的排在最前。
+    """
+    return (s.query(User)
+            .filter(User.cookies.is_not(None), User.is_banned.is_(False))
+            .filter((User.cookies_expire_at.is_(None)) | (User.cookies_expire_at < before))
+            .order_by(User.cookies_expire_at.is_not(None), User.cookies_expire_at)
+            .all())
+
+
+@metrics.timed("crud")
 def get_activity(active_id: str = None, id: int = None) -> SignInActivity | None:
     if active_id:
         activity = s.query(SignInActivity).filter(SignInActivity.active_id == active_id).first()
@@ -197,6 +305,7 @@ def get_activity(active_id: str = None, id: int = None) -> SignInActivity | None
     return activity
 
 
+@metrics.timed("crud")
 def update_sign_in_activity(activity: SignInActivity, course: Course, user: User) -> bool:
     try:
         # 查找数据库中是否有相应的activity
@@ -223,12 +332,280 @@ def update_sign_in_activity(activity: SignInActivity, course: Course, user: User
         raise ValueError(f"Failed to update activity in the database: {e}")
 
 
-def create_sign_in_activity(activity: SignInActivity, course: Course, user: User) -> bool:
+@metrics.timed("crud")
+def set_activity_solution(activity: SignInActivity, solution: str) -> bool:
+    """
+    保存签到活动的解（手势、签到码、位置等），同一活动的其他学生签到时直接使用。
+
+    :param activity: 签到活动。
+    :param solution: 签到解。
+    :return: True 如果成功。
+    """
+    try:
+        activity.solve = solution
+        s.commit()
+        return True
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def get_courses_with_students() -> List[Course]:
+    """
+    查询至少关联了一个学生的课程，即需要轮询的课程。
+    """
+    return s.query(Course).filter(Course.students.any()).all()
+
+
+@metrics.timed("crud")
+def get_activity_start_times(since: datetime.datetime) -> List[tuple]:
+    """
+    查询某时间之后开始的签到活动的开始时间，用于统计各课程通常发布活动的时间段。
+
+    :param since: 只查询这之后开始的活动。
+    :return: (Course.id, 开始时间) 列表。
+    """
+    return (s.query(activity_course_association.c.course_id, SignInActivity.start_time)
+            .join(SignInActivity, SignInActivity.id == activity_course_association.c.activity_id)
+            .filter(SignInActivity.start_time >= since)
+            .all())
+
+
+@metrics.timed("crud")
+def get_activities_fingerprint(user: User, course: Course) -> str | None:
+    """
+    查询该学生上次取得的课程活动列表的指纹。
+
+    :return: 指纹，没有记录时返回 None。
+    """
+    return s.execute(
+        select(student_course_association.c.activities_fingerprint)
+        .where(student_course_association.c.user_id == user.id,
+               student_course_association.c.course_id == course.id)
+    ).scalar()
+
+
+@metrics.timed("crud")
+def set_activities_fingerprint(user: User, course: Course, fingerprint: str) -> bool:
+    """
+    记录该学生本次取得的课程活动列表的指纹。
+
+    :return: True 如果成功。
+    """
+    try:
+        s.execute(
+            update(student_course_association)
+            .where(student_course_association.c.user_id == user.id,
+                   student_course_association.c.course_id == course.id)
+            .values(activities_fingerprint=fingerprint)
+        )
+        s.commit()
+        return True
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def set_activities_synced_at(course: Course, synced_at: int) -> bool:
+    """
+    记录课程的活动列表的同步时间，“待签到”据此显示数据的新旧。
+
+    :param synced_at: 时间戳。
+    :return: True 如果成功。
+    """
+    try:
+        s.execute(update(Course).where(Course.id == course.id).values(activities_synced_at=synced_at))
+        s.commit()
+        return True
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def get_activities_synced_at(user: User) -> List[int | None]:
+    """
+    查询学生的各门课程的活动列表的同步时间。
+
+    :return: 时间戳列表，从未同步的课程为 None。
+    """
+    return [row[0] for row in s.query(Course.activities_synced_at)
+            .join(student_course_association, student_course_association.c.course_id == Course.id)
+            .filter(student_course_association.c.user_id == user.id)]
+
+
+@metrics.timed("crud")
+def get_open_activities(user: User, now: datetime.datetime, closed_status: int) -> List[tuple]:
+    """
+    一次查询学生所有课程中正在进行、且不知道已签到的活动。
+    与学生关联的活动确认过未签到；其他活动（如只收到了新活动通知）没有查询过该学生的签到状态。
+
+    :param now: 当前时间。
+    :param closed_status: 已结束的活动的状态值。
+    :return: (SignInActivity, 课程名, 是否确认过未签到) 列表，按开始时间排序。
+    """
+    linked = (select(user_activity_association.c.activity_id)
+              .where(user_activity_association.c.user_id == user.id,
+                     user_activity_association.c.activity_id == SignInActivity.id)
+              .exists())
+    signed = (select(user_signed_activity_association.c.activity_id)
+              .where(user_signed_activity_association.c.user_id == user.id,
+                     user_signed_activity_association.c.activity_id == SignInActivity.id)
+              .exists())
+    return (s.query(SignInActivity, Course.name, linked)
+            .join(activity_course_association, activity_course_association.c.activity_id == SignInActivity.id)
+            .join(student_course_association,
+                  student_course_association.c.course_id == activity_course_association.c.course_id)
+            .join(Course, Course.id == activity_course_association.c.course_id)
+            .filter(student_course_association.c.user_id == user.id,
+                    SignInActivity.status != closed_status,
+                    SignInActivity.start_time <= now,
+                    SignInActivity.end_time.is_(None) | (SignInActivity.end_time > now),
+                    ~signed)
+            .order_by(SignInActivity.start_time)
+            .all())
+
+
+@metrics.timed("crud")
+def mark_signed_in(user: User, activity: SignInActivity) -> bool:
+    """
+    记录学生已签到该活动：解除待签到的关联，并记为已签到，“待签到”不再列出。
+
+    :return: True 如果成功。
+    """
+    try:
+        if activity in user.activities:
+            user.activities.remove(activity)
+        known = s.execute(
+            select(user_signed_activity_association.c.activity_id)
+            .where(user_signed_activity_association.c.user_id == user.id,
+                   user_signed_activity_association.c.activity_id == activity.id)
+        ).first()
+        if known is None:
+            s.execute(insert(user_signed_activity_association).values(user_id=user.id, activity_id=activity.id))
+        s.commit()
+        return True
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def queue_notifications(activity: SignInActivity, users: List[User]) -> int:
+    """
+    把新活动的通知加入队列。每个用户对同一活动只会有一条通知，已有的跳过。
+
+    :return: 新加入的通知数。
+    """
+    try:
+        user_ids = {user.id for user in users}
+        existing = {row[0] for row in s.query(Notification.user_id)
+                    .filter(Notification.activity_id == activity.id, Notification.user_id.in_(user_ids))}
+        now = int(time.time())
+        new = [Notification(user_id=user_id, activity_id=activity.id, created_at=now)
+               for user_id in user_ids - existing]
+        s.add_all(new)
+        s.commit()
+        return len(new)
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def queue_messages(activity: SignInActivity, users: List[User], message: str) -> int:
+    """
+    把关于活动的消息（如自动签到的结果）加入通知队列，由负责该用户的进程（分片）发送。
+    每个用户对同一活动只有一条通知，已有的通知（包括已发送的新活动通知）改为这条消息并重新发送。
+
+    :return: 加入队列的消息数。
+    """
+    try:
+        user_ids = {user.id for user in users}
+        existing = {notification.user_id: notification for notification in s.query(Notification)
+                    .filter(Notification.activity_id == activity.id, Notification.user_id.in_(user_ids))}
+        now = int(time.time())
+        for user_id in user_ids:
+            notification = existing.get(user_id)
+            if notification is None:
+                s.add(Notification(user_id=user_id, activity_id=activity.id, created_at=now, message=message))
+            else:
+                notification.message = message
+                notification.created_at = now
+                notification.sent_at = None
+                notification.attempts = 0
+                notification.next_attempt_at = None
+        s.commit()
+        return len(user_ids)
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def get_pending_notifications(now: int) -> List[Notification]:
+    """
+    查询尚未发送、且已到重试时间的通知。
+
+    :param now: 当前时间戳。
+    """
+    return (s.query(Notification)
+            .filter(Notification.sent_at.is_(None),
+                    Notification.next_attempt_at.is_(None) | (Notification.next_attempt_at <= now))
+            .order_by(Notification.id).all())
+
+
+@metrics.timed("crud")
+def count_pending_notifications() -> int:
+    return s.query(Notification).filter(Notification.sent_at.is_(None)).count()
+
+
+@metrics.timed("crud")
+def mark_notifications_sent(notifications: List[Notification]) -> bool:
+    try:
+        now = int(time.time())
+        for notification in notifications:
+            notification.sent_at = now
+        s.commit()
+        return True
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def record_notification_failure(notifications: List[Notification], retry_at: int) -> bool:
+    """
+    记录通知发送失败，retry_at 之前不再发送。
+
+    :param retry_at: 下次重试的时间戳。
+    :return: True 如果成功。
+    """
+    try:
+        for notification in notifications:
+            notification.attempts = (notification.attempts or 0) + 1
+            notification.next_attempt_at = retry_at
+        s.commit()
+        return True
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def create_sign_in_activity(activity: SignInActivity, course: Course, user: User | None) -> bool:
+    """
+    新建签到活动。
+
+    :param user: 尚未签到的用户，为 None 时不关联用户（用户已签到，只保存活动信息）。
+    """
     try:
         # add the sign in activity to the session
 
         activity.course = [course]
-        activity.users = [user]
+        activity.users = [user] if user else []
 
         s.add(activity)
         # commit the transaction
@@ -237,3 +614,124 @@ def create_sign_in_activity(activity: SignInActivity, course: Course, user: User
     except Exception as e:
         s.rollback()
         raise Exception(f"添加签到活动到数据库时失败: {e}")
+
+
+# 可以领取的任务：等待中且已到执行时间，或执行中但租约已过期（执行它的进程已退出或超时）
+def _claimable(now: int):
+    return ((Job.status == "pending") & (Job.run_at <= now)) | \
+        ((Job.status == "running") & (Job.leased_until < now))
+
+
+@metrics.timed("crud")
+def enqueue_jobs(jobs: List[Job]) -> List[Job]:
+    """
+    把任务加入队列。已有相同 dedupe_key 的未完成任务时跳过该任务。
+
+    :return: 实际加入的任务。
+    """
+    try:
+        keys = {job.dedupe_key for job in jobs if job.dedupe_key}
+        existing = {row[0] for row in s.query(Job.dedupe_key)
+                    .filter(Job.dedupe_key.in_(keys), Job.status.in_(("pending", "running")))} if keys else set()
+        new = []
+        for job in jobs:
+            if job.dedupe_key and job.dedupe_key in existing:
+                continue
+            existing.add(job.dedupe_key)
+            new.append(job)
+        s.add_all(new)
+        s.commit()
+        return new
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def claim_jobs(limit: int, lease: int, shard: int) -> List[Job]:
+    """
+    领取最多 limit 个任务，按优先级和执行时间排序，并为其设置租约。
+    先查出候选任务，再用一条 UPDATE 在仍可领取的条件下写入本次的令牌，多个进程同时领取时每个任务只会被其中一个领到。
+
+    :param lease: 租约时长（秒），到期未完成的任务可以被重新领取。
+    :param shard: 当前进程的分片序号，只领取属于该分片或不限分片的任务。
+    :return: 领到的任务，attempts 已加一。
+    """
+    try:
+        now = int(time.time())
+        ids = [row[0] for row in s.query(Job.id)
+               .filter(_claimable(now), Job.shard.is_(None) | (Job.shard == shard))
+               .order_by(Job.priority, Job.run_at, Job.id).limit(limit)]
+        if not ids:
+            s.commit()
+            return []
+        token = uuid.uuid4().hex
+        s.execute(update(Job).where(Job.id.in_(ids), _claimable(now))
+                  .values(status="running", lease_token=token, leased_until=now + lease, attempts=Job.attempts + 1)
+                  .execution_options(synchronize_session=False))
+        s.commit()
+        return s.query(Job).filter(Job.lease_token == token).populate_existing().all()
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+def _finish_job(job: Job, values: dict) -> bool:
+    # 只有租约仍属于本次领取时才修改，租约过期后被其他进程重新领取的任务以新的执行结果为准
+    try:
+        result = s.execute(update(Job).where(Job.id == job.id, Job.lease_token == job.lease_token)
+                           .values(lease_token=None, leased_until=None, **values)
+                           .execution_options(synchronize_session=False))
+        s.commit()
+        return result.rowcount > 0
+    except Exception as e:
+        s.rollback()
+        raise e
+
+
+@metrics.timed("crud")
+def complete_job(job: Job) -> bool:
+    """
+    :return: 是否仍持有该任务的租约。
+    """
+    return _finish_job(job, {"status": "done", "finished_at": int(time.time())})
+
+
+@metrics.timed("crud")
+def fail_job(job: Job, error: str, retry_at: int | None) -> bool:
+    """
+    记录任务失败。
+
+    :param retry_at: 重试时间（时间戳），为 None 时转入死信，不再重试。
+    :return: 是否仍持有该任务的租约。
+    """
+    if retry_at is None:
+        values = {"status": "dead", "finished_at": int(time.time())}
+    else:
+        values = {"status": "pending", "run_at": retry_at}
+    return _finish_job(job, {"last_error": error[:500], **values})
+
+
+@metrics.timed("crud")
+def count_jobs() -> dict[str, int]:
+    """
+    :return: 各状态的任务数。
+    """
+    return dict(s.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+
+
+@metrics.timed("crud")
+def delete_finished_jobs(before: int) -> int:
+    """
+    删除 before 之前已完成的任务，死信保留。
+
+    :return: 删除的任务数。
+    """
+    try:
+        deleted = s.query(Job).filter(Job.status == "done", Job.finished_at < before) \
+            .delete(synchronize_session=False)
+        s.commit()
+        return deleted
+    except Exception as e:
+        s.rollback()
+        raise e
@@ -1,28 +1,142 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+from contextvars import ContextVar
 
+from sqlalchemy import create_engine, event, inspect, make_url, text
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import NullPool, StaticPool
+
+import metrics
 from db.db_models import Base
 from config import c
 from loguru import logger as l
 
-l.info("连接到数据库")
+engine = None
+
+# 未绑定引擎的会话工厂，init_db() 时再绑定，导入本模块不会连接数据库。
+# 会话只在一次操作内使用，提交后不必让对象过期：操作结束时会话整个关闭，下次操作重新从数据库读取
+Session = sessionmaker(expire_on_commit=False)
+
+# 当前操作的标识。asyncio 任务和 asyncio.to_thread 会复制上下文，操作中创建的任务和线程共用同一个会话
+_scope: ContextVar[object | None] = ContextVar("db_scope", default=None)
+db_session = scoped_session(Session, scopefunc=_scope.get)
+
+
+@contextmanager
+def session_scope(fresh: bool = False):
+    """
+    为一次操作（处理一条消息、后台任务的一轮）使用单独的会话，结束时关闭会话并清空其身份映射，
+    使长时间运行时内存中不会积累所有加载过的用户、课程和活动。嵌套使用时沿用外层的会话。
+
+    :param fresh: 为 True 时即使已在会话中也使用新的会话。用于 asyncio.gather 并发的任务：
+        它们复制了外层的上下文，否则会共用外层的会话，一个任务的提交或回滚会影响其他任务未提交的修改。
+    """
+    if _scope.get() is not None and not fresh:
+        yield db_session
+        return
+    token = _scope.set(object())
+    try:
+        yield db_session
+    finally:
+        db_session.remove()
+        _scope.reset(token)
+
+
+def engine_options(db_url: str) -> dict:
+    """
+    每个会话使用独立的连接和事务，会话之间互不可见未提交的修改，一个会话回滚也不会丢弃其他会话的写入。
+    SQLite 每个会话打开一个新连接（打开文件的开销很小），等待其他连接的写锁最多 db.sqlite_busy_timeout 秒；
+    内存数据库只存在于一个连接中，只能共用该连接。
+    其他数据库使用有上限的连接池（db.pool_size + db.max_overflow），不会因并发的操作耗尽数据库服务器的连接。
+    """
+    url = make_url(db_url)
+    if url.get_backend_name() == "sqlite":
+        connect_args = {"check_same_thread": False, "timeout": c.db.sqlite_busy_timeout}
+        if url.database in (None, "", ":memory:"):
+            return {"poolclass": StaticPool, "connect_args": connect_args}
+        return {"poolclass": NullPool, "connect_args": connect_args}
+    return {"pool_size": c.db.pool_size, "max_overflow": c.db.max_overflow, "pool_timeout": c.db.pool_timeout}
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    # WAL 模式下读事务不阻塞写事务的提交。会话在等待学习通响应时可能一直持有读事务
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def _count_query(conn, cursor, statement: str, parameters, context, executemany):
+    # 按语句类型（SELECT、INSERT……）计数，供“状态”指令和指标接口使用
+    metrics.db_queries.inc(statement.lstrip()[:6].upper())
+
+
+def add_missing_columns(engine):
+    """
+    create_all 不会修改已存在的表。为旧数据库补上模型中新增的列（新增列均可为空）。
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                l.info(f"已为表 {table.name} 添加列 {column.name}")
+
+
+def add_missing_indexes(engine):
+    """
+    create_all 也不会为已存在的表创建新的索引。为旧数据库补上模型中新增的索引。
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                index.create(conn)
+                l.info(f"已为表 {table.name} 添加索引 {index.name}")
+
+
+def init_db(db_url: str = None):
+    """
+    连接数据库并按模型创建缺失的表。失败时退出程序。
+
+    :param db_url: SQLAlchemy 数据库链接，默认使用配置文件中的 db.sqlalchemy_db_url。
+    :return: 数据库引擎。
+    """
+    global engine
+
+    l.info("连接到数据库")
 
-try:
-    engine = create_engine(c.db.sqlalchemy_db_url)
-except AttributeError as e:
-    l.error(f"数据库链接填写有误，请参考文档。填写了：{e}")
-    exit(1)
-except Exception as e:
-    l.error(f"未知错误： {e}")
-    exit(1)
+    try:
+        db_url = db_url or c.db.sqlalchemy_db_url
+        engine = create_engine(db_url, **engine_options(db_url))
+        event.listen(engine, "before_cursor_execute", _count_query)
+        if engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+            event.listen(engine, "connect", _enable_wal)
+    except AttributeError as e:
+        l.error(f"数据库链接填写有误，请参考文档。填写了：{e}")
+        exit(1)
+    except Exception as e:
+        l.error(f"未知错误： {e}")
+        exit(1)
 
-try:
-    Base.metadata.create_all(engine)
+    try:
+        Base.metadata.create_all(engine)
+        add_missing_columns(engine)
+        add_missing_indexes(engine)
 
-    Session = sessionmaker(bind=engine)
-    db_session = Session()
-except Exception as e:
-    l.error(f"创建数据库时发生未知错误： {e}")
-    exit(1)
+        Session.configure(bind=engine)
+    except Exception as e:
+        l.error(f"创建数据库时发生未知错误： {e}")
+        exit(1)
 
-l.success("连接到数据库成功")
+    l.success("连接到数据库成功")
+    return engine
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Sequence, Table
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, Sequence, Table, \
+    UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -8,19 +9,32 @@ Base = declarative_base()
 student_course_association = Table(
     'student_course', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id')),
-    Column('course_id', Integer, ForeignKey('courses.id'))
+    Column('course_id', Integer, ForeignKey('courses.id')),
+    Column('activities_fingerprint', String(40), nullable=True, comment="该学生上次取得的课程活动列表的指纹"),
+    Index('ix_student_course_user', 'user_id', 'course_id')
 )
 
 activity_course_association = Table(
     'activity_course', Base.metadata,
     Column('activity_id', Integer, ForeignKey('sign_in_activities.id')),
-    Column('course_id', Integer, ForeignKey('courses.id'))
+    Column('course_id', Integer, ForeignKey('courses.id')),
+    Index('ix_activity_course_activity', 'activity_id', 'course_id'),
+    Index('ix_activity_course_course', 'course_id', 'activity_id')
 )
 
 user_activity_association = Table(
     'user_activity', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id')),
-    Column('activity_id', Integer, ForeignKey('sign_in_activities.id'))
+    Column('activity_id', Integer, ForeignKey('sign_in_activities.id')),
+    Index('ix_user_activity_user', 'user_id', 'activity_id')
+)
+
+# 已知学生已签到的活动：学生通过本机器人签到成功，或同步活动时查询到已签到
+user_signed_activity_association = Table(
+    'user_signed_activity', Base.metadata,
+    Column('user_id', Integer, ForeignKey('users.id')),
+    Column('activity_id', Integer, ForeignKey('sign_in_activities.id')),
+    Index('ix_user_signed_activity_user', 'user_id', 'activity_id')
 )
 
 
@@ -32,6 +46,8 @@ class User(Base):
     qq_num = Column(String(15), nullable=True, unique=True, index=True, comment="QQ Number")  # 相当于用户使用本机器人的 token，谨慎修改
     name = Column(String(50), nullable=True, comment="学生姓名")
     cookies = Column(String(500), nullable=True, comment="学习通网页cookies")
+    cookies_expire_at = Column(Integer, nullable=True, comment="cookies 预计失效时间（时间戳），用于提前刷新")
+    cookies_checked_at = Column(Integer, nullable=True, comment="上次向学习通确认 cookies 有效的时间（时间戳）")
     phone_number = Column(String(15), nullable=False,index=True, comment="手机号")
     password = Column(String(256), nullable=False, comment="由于学习通喜欢换加密算法，只能存储明文密码，请注意。")
     is_admin = Column(Boolean, nullable=False, default=False, comment="是否管理员")
@@ -52,6 +68,7 @@ class Course(Base):
     class_id = Column(String(30), nullable=False, index=True, unique=True, comment="clazzId")
     teacher_name = Column(String(50), nullable=True, comment="教师名")
     check_in_count = Column(Integer, default=0, nullable=False, comment="总签到次数")
+    activities_synced_at = Column(Integer, nullable=True, comment="上次从学习通同步活动列表的时间（时间戳）")
 
     students = relationship("User", secondary=student_course_association, back_populates="courses")
     activities = relationship("SignInActivity", secondary=activity_course_association, back_populates="course")
@@ -64,8 +81,8 @@ class SignInActivity(Base):
     id = Column(Integer, Sequence('activity_id_seq'), primary_key=True)
     name = Column(String(100), nullable=False, comment="活动名称/nameOne")
     type_name = Column(String(20), nullable=False, comment="活动类型名称")
-    start_time = Column(Integer, nullable=False, comment="开始时间（时间戳）/startTime")
-    end_time = Column(Integer, nullable=True, comment="结束时间（时间戳，如为空就是教师手动结束）/endTime")
+    start_time = Column(DateTime, nullable=False, index=True, comment="开始时间/startTime")
+    end_time = Column(DateTime, nullable=True, comment="结束时间（如为空就是教师手动结束）/endTime")
     status = Column(Integer, nullable=False, comment="活动状态，0为未签到，1为已签到，...")
 
     # 签到相关
@@ -85,6 +102,46 @@ class SignInActivity(Base):
     active_type = Column(Integer, nullable=False, comment="activeType")
     active_id = Column(String(30), index=True, unique=True, nullable=False, comment="id/activeId")
     location_range = Column(Integer, nullable=True, comment="locationRange")
+    fingerprint = Column(String(40), nullable=True, comment="活动列表中该活动数据的指纹，用于判断活动是否变化")
 
     course = relationship("Course", secondary=activity_course_association, back_populates="activities")
     users = relationship("User", secondary=user_activity_association, back_populates="activities")
+
+
+class Notification(Base):
+    __tablename__ = 'notifications'
+    __table_args__ = (UniqueConstraint('user_id', 'activity_id'),)
+
+    id = Column(Integer, Sequence('notification_id_seq'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    activity_id = Column(Integer, ForeignKey('sign_in_activities.id'), nullable=False)
+    created_at = Column(Integer, nullable=False, comment="加入通知队列的时间（时间戳）")
+    message = Column(String(200), nullable=True, comment="要发送的消息（如自动签到的结果），为空表示新活动通知")
+    attempts = Column(Integer, nullable=True, default=0, comment="发送失败的次数")
+    next_attempt_at = Column(Integer, nullable=True, comment="发送失败后下次重试的时间（时间戳），为空表示立即发送")
+    sent_at = Column(Integer, nullable=True, index=True, comment="发送时间（时间戳），为空表示尚未发送")
+
+    user = relationship("User")
+    activity = relationship("SignInActivity")
+
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    __table_args__ = (Index('ix_jobs_claim', 'status', 'priority', 'run_at'),)
+
+    id = Column(Integer, Sequence('job_id_seq'), primary_key=True)
+    kind = Column(String(30), nullable=False, comment="任务类型，见 job_queue.HANDLERS")
+    payload = Column(String(500), nullable=False, comment="任务参数（JSON）")
+    priority = Column(Integer, nullable=False, default=0, comment="优先级，数值小的先执行")
+    status = Column(String(10), nullable=False, default="pending",
+                    comment="pending 等待执行，running 执行中，done 已完成，dead 多次失败后不再重试")
+    run_at = Column(Integer, nullable=False, comment="最早执行时间（时间戳）")
+    shard = Column(Integer, nullable=True, comment="负责执行的分片，为空表示任何分片都可以执行")
+    dedupe_key = Column(String(100), nullable=True, index=True, comment="同一个键同时只有一个未完成的任务")
+    attempts = Column(Integer, nullable=False, default=0, comment="已执行次数")
+    max_attempts = Column(Integer, nullable=False, comment="最多执行次数，达到后转入死信")
+    lease_token = Column(String(32), nullable=True, index=True, comment="领取任务时生成的令牌")
+    leased_until = Column(Integer, nullable=True, comment="租约到期时间（时间戳），到期未完成的任务可以被重新领取")
+    last_error = Column(String(500), nullable=True, comment="最近一次失败的原因")
+    created_at = Column(Integer, nullable=False, comment="加入队列的时间（时间戳）")
+    finished_at = Column(Integer, nullable=True, comment="完成或转入死信的时间（时间戳）")
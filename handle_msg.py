@@ -1,22 +1,42 @@
+from __future__ import annotations
+
 import datetime
-from typing import Callable
+from typing import Callable, TYPE_CHECKING
 from loguru import logger as l
 import re
 
-from graia.ariadne.message.chain import MessageChain
-
 import db.crud as db
+import metrics
+import sharding
+import tracing
+from logs import mask
+from db.db import session_scope
 from db.db_models import User, Course, SignInActivity
 from config import c, ConfigError
 from xxt_api import xxt_get_cookies_by_phone_password_login, xxt_parse_raw_courses_to_courses_list, \
-    xxt_get_user_and_courses_info, \
-    IncorrectPasswordError, LoginError, GetCoursesError, xxt_get_course_activities, xxt_sign_in
+    IncorrectPasswordError, LoginError, GetCoursesError, \
+    solution_to_params, SOLUTION_REQUIRED_SIGN_TYPES, CircuitOpenError
+from activity_sync import CLOSED_STATUS
+
+# workers、job_queue、sign_in_solutions、status 和 bulk_import 只在用到它们的指令中导入，
+# 以加快启动和第一条回复（工作进程池、任务队列和 CSV 解析在大多数部署中不会立即用到）
+
+UPSTREAM_UNAVAILABLE_MESSAGE = "学习通暂时无法访问，请稍后再试。"
+
+BULK_IMPORT_MAX_FAILED_ROWS = 30
+"""批量导入的回复中最多列出的失败行数"""
+
+if TYPE_CHECKING:
+    # 只用于类型标注，平台无关的指令处理不需要在导入时载入 Ariadne 的消息链
+    from graia.ariadne.message.chain import MessageChain
 
 
 async def user_login(_respond: Callable, qq_num: str, message: str,
-                     chain: MessageChain = MessageChain("Unsupported"), is_admin: bool = False):
+                     chain: MessageChain = None, is_admin: bool = False):
+    import workers
+
     if db.get_user(qq_num=qq_num):
-        l.debug(f"{qq_num} 尝试重复登录")
+        l.debug("{} 尝试重复登录", qq_num)
         await _respond("用户已存在，请勿重复登录。若要换号，请先退出登录")
         return
     if bool(re.match(r"^登录 1\d{10} [A-Za-z0-9!@#$%^&*()_+-=]{8,16}$", message)):
@@ -29,20 +49,22 @@ async def user_login(_respond: Callable, qq_num: str, message: str,
         await _respond("正在尝试登录学习通...")
 
         try:
-            user_and_course_info = await xxt_get_user_and_courses_info(phone_number, password, qq_num, is_admin)
+            user_and_course_info = await workers.run("login", phone_number, password, qq_num, is_admin)
         except ConfigError as e:
             l.error(f"配置文件错误: {e}")
             await _respond("失败。软件配置有误，请联系管理员。")
             return
+        except CircuitOpenError as e:
+            l.warning(f"登录失败: {e}")
+            await _respond(UPSTREAM_UNAVAILABLE_MESSAGE)
+            return
         except IncorrectPasswordError as e:
-            l.warning(
-                f"登录失败: 用户名:{phone_number} 密码:{password} 加密算法: {c.xxt_api.xxt_login_encrypt_scheme} 加密密钥: {c.xxt_api.xxt_login_encrypt_key}")
-            l.warning(f"用户名密码或加密算法错误: {e}\n")
+            l.warning("登录失败: 用户名 {} 加密算法 {}", mask(phone_number), c.xxt_api.xxt_login_encrypt_scheme)
+            l.warning("用户名密码或加密算法错误: {}", e)
             await _respond("失败。用户名密码有误。如果确认用户名和密码可以在官方app或网站登录，请联系管理员。")
             return
         except LoginError as e:
-            l.error(
-                f"登录失败: 用户名:{phone_number} 密码:{password} 加密算法: {c.xxt_api.xxt_login_encrypt_scheme} 加密密钥: {c.xxt_api.xxt_login_encrypt_key}(只在对称加密算法有效)")
+            l.error("登录失败: 用户名 {} 加密算法 {}: {}", mask(phone_number), c.xxt_api.xxt_login_encrypt_scheme, e)
             await _respond("失败，登录方法有变。请联系管理员。")
             return
         except GetCoursesError as e:
@@ -50,14 +72,11 @@ async def user_login(_respond: Callable, qq_num: str, message: str,
             await _respond("登录成功，但无法正确取得课程列表。请联系管理员。")
             return
         except Exception as e:
-            l.warning(
-                f"失败: 用户名:{phone_number} 密码:{password} 加密算法: {c.xxt_api.xxt_login_encrypt_scheme} 加密密钥: {c.xxt_api.xxt_login_encrypt_key}")
-            l.error(f"失败: {e}")
+            l.error("登录失败: 用户名 {}: {}", mask(phone_number), e)
             await _respond("失败。未知原因，请联系管理员。")
             return
 
-        l.success(
-            f"登录成功: 用户名:{phone_number} 密码:{password} 加密算法: {c.xxt_api.xxt_login_encrypt_scheme} 加密密钥: {c.xxt_api.xxt_login_encrypt_key}")
+        l.success("登录成功: 用户名 {}", mask(phone_number))
         await _respond("学习通登录成功，正在创建用户。")
 
         user = user_and_course_info["user"]
@@ -68,11 +87,15 @@ async def user_login(_respond: Callable, qq_num: str, message: str,
             existing_user.qq_num = user.qq_num
             existing_user.name = user.name
             existing_user.cookies = user.cookies
+            if user.cookies_expire_at is not None:
+                existing_user.cookies_expire_at = user.cookies_expire_at
             existing_user.password = user.password
             existing_user.is_admin = user.is_admin
 
             try:
-                db.update_user(existing_user, user_and_course_info["courses"])
+                db.update_user(existing_user)
+                added, removed, changed = db.sync_user_courses(existing_user, user_and_course_info["courses"])
+                l.debug("课程同步: 新增 {} 门，移除 {} 门，更新 {} 门", len(added), len(removed), len(changed))
             except Exception as e:
                 l.error(f"绑定数据库内已有用户时失败： {e}")
                 await _respond("登录失败：内部错误，请联系管理员。")
@@ -90,24 +113,13 @@ async def user_login(_respond: Callable, qq_num: str, message: str,
                 await _respond("登录失败：内部错误，请联系管理员。")
                 return
 
-        course_info = []
-        course_info_user = []  # 展示给用户看的课程列表
-        try:
-            for i in user_and_course_info["courses"]:
-                try:
-                    if not db.create_course(i):
-                        l.debug(f"尝试导入已有课程班级 {i.name}: {i.class_id}")
-                    course_info.append(i)
-                    course_info_user.append(i.name)
-                except Exception as e:
-                    l.error(f"导入课程 {i.name} 失败: {e}")
-                    await _respond(f"导入课程 {i.name} 失败")
-                    continue
-        except Exception as e:
-            l.error(f"在数据库中导入课程失败：{e}")
-            await _respond("部分或全部课程导入失败。请联系管理员。")
-        l.success(f"已导入 {len(course_info)} 门课程。")
-        await _respond(f"已导入 {len(course_info)} 门课程：{course_info_user}")
+        # 课程已在创建或更新用户时增量同步
+        course_info_user = [course.name for course in user_and_course_info["courses"]]  # 展示给用户看的课程列表
+        l.success(f"已导入 {len(course_info_user)} 门课程。")
+        await _respond(f"已导入 {len(course_info_user)} 门课程：{course_info_user}")
+
+        if sharding.is_enabled() and sharding.owner_account(qq_num) != c.mirai.qq:
+            await _respond(f"签到通知将由机器人 {sharding.owner_account(qq_num)} 发送，请添加其为好友。")
         return
     else:
         await _respond(
@@ -116,7 +128,7 @@ async def user_login(_respond: Callable, qq_num: str, message: str,
 
 
 async def user_logout(_respond: Callable, qq_num: str, message: str,
-                      chain: MessageChain = MessageChain("Unsupported"), is_manager: bool = False):
+                      chain: MessageChain = None, is_manager: bool = False):
     try:
         user = db.get_user(qq_num=qq_num)
         if not user:
@@ -132,7 +144,9 @@ async def user_logout(_respond: Callable, qq_num: str, message: str,
 
 
 async def check_course_activity(_respond: Callable, qq_num: str, message: str,
-                                chain: MessageChain = MessageChain("Unsupported"), is_manager: bool = False):
+                                chain: MessageChain = None, is_manager: bool = False):
+    import workers
+
     matched = re.match(r"查询课程\s(\d{1,10})", message)
 
     if not matched:
@@ -152,57 +166,181 @@ async def check_course_activity(_respond: Callable, qq_num: str, message: str,
         return
 
     try:
-        course_activities_list = await xxt_get_course_activities(user=user, course=course)
+        counts = await workers.run("scan_course", course.id, user.id)
+    except CircuitOpenError as e:
+        l.warning(f"获取课程时失败：{e}")
+        await _respond(UPSTREAM_UNAVAILABLE_MESSAGE)
+        return
     except Exception as e:
         await _respond("获取失败：内部错误。请联系管理员。")
         l.error(f"获取课程时失败：{e}")
         return
 
-    for activity in course_activities_list:
-        try:
-            existing_activity = db.get_activity(active_id=activity.active_id)
-            if existing_activity:
-                # 使用传入的activity的信息替换表内已有的activity
-                existing_activity.name = activity.name
-                existing_activity.type_name = activity.type_name
-                existing_activity.start_time = activity.start_time
-                existing_activity.end_time = activity.end_time
-                existing_activity.status = activity.status
-                existing_activity.require_photo = activity.require_photo
-                existing_activity.require_location = activity.require_location
-                existing_activity.user_status = activity.user_status
-                existing_activity.other_id = activity.other_id
-                existing_activity.group_id = activity.group_id
-                existing_activity.source = activity.source
-                existing_activity.is_look = activity.is_look
-                existing_activity.release_num = activity.release_num
-                existing_activity.type = activity.type
-                existing_activity.attend_num = activity.attend_num
-                existing_activity.active_type = activity.active_type
-                existing_activity.location_range = activity.location_range
-
-                l.debug("数据库内已有活动，尝试更新")
-                db.update_sign_in_activity(existing_activity, course, user)
-            else:
-                l.debug("在数据库内新建活动")
-                db.create_sign_in_activity(activity, course, user)
-        except Exception as e:
-            l.error(f"在数据库内保存或更新课程活动失败: {e}")
-            await _respond("获取失败：内部错误。请联系管理员。")
-            return
-
     user = db.get_user(user_id=user.id)
 
-    sorted_activities = sorted(user.activities, key=lambda x: x.id)
+    course_activities = sorted((activity for activity in user.activities if course in activity.course),
+                               key=lambda x: x.id)
     respond_text = "\n".join(
                 [f"{idx + 1}. {activity.name}: {activity.type_name}, ID: {activity.id}, [{activity.start_time}-{'教师手动结束' if activity.end_time is None else activity.end_time}]" for idx, activity in
-                 enumerate(sorted_activities)])
+                 enumerate(course_activities)])
+
+    changes = f"（新增 {counts['new']} 个，结束 {counts['closed']} 个）" if any(counts.values()) else ""
+    await _respond(f"当前 {course.name} 课程活动有 {len(course_activities)} 个{changes}\n{respond_text}")
+
+
+def format_age(seconds: float) -> str:
+    if seconds < 60:
+        return f"{max(int(seconds), 0)} 秒"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} 分钟"
+    return f"{int(seconds // 3600)} 小时"
+
+
+def format_staleness(synced_at: list[int | None], now: float) -> str:
+    """
+    按学生各门课程的活动列表中最早的同步时间说明数据的新旧。
+    """
+    if not synced_at:
+        return "当前账号没有课程"
+    never = sum(1 for t in synced_at if t is None)
+    synced = [t for t in synced_at if t is not None]
+    if not synced:
+        return "课程活动尚未同步，请稍后再试或使用“查询课程”"
+    staleness = f"数据更新于 {format_age(now - min(synced))}前"
+    if never:
+        staleness += f"，{never} 门课程尚未同步"
+    return staleness
+
+
+async def list_open_activities(_respond: Callable, qq_num: str):
+    """
+    从数据库列出学生所有课程中正在进行、不知道已签到的活动，不请求学习通。
+    活动由后台轮询和“查询课程”同步，回复中附上数据的新旧；没有查询过该学生签到状态的活动加以标注。
+    """
+    user = db.get_user(qq_num=qq_num)
+    if user is None:
+        await _respond("用户未登录")
+        return
+
+    now = datetime.datetime.now()
+    activities = db.get_open_activities(user, now, CLOSED_STATUS)
+    staleness = format_staleness(db.get_activities_synced_at(user), now.timestamp())
+    if not activities:
+        await _respond(f"当前没有待签到的活动（{staleness}）")
+        return
+
+    lines = [f"{idx + 1}. {course_name} {activity.name}: {activity.type_name}, ID: {activity.id}, "
+             f"[{activity.start_time:%m-%d %H:%M}-"
+             f"{'教师手动结束' if activity.end_time is None else f'{activity.end_time:%m-%d %H:%M}'}]"
+             f"{'' if checked else '（签到状态未确认）'}"
+             for idx, (activity, course_name, checked) in enumerate(activities)]
+    unchecked = sum(1 for _, _, checked in activities if not checked)
+    note = f"\n其中 {unchecked} 个尚未确认签到状态，可能已经签到，使用“查询课程”确认" if unchecked else ""
+    await _respond(f"待签到的活动有 {len(activities)} 个（{staleness}）\n" + "\n".join(lines) + note)
+
+
+async def user_sign_in(_respond: Callable, qq_num: str, _id: int, solution: str | None, is_admin: bool = False):
+    """
+    签到。需要手势、签到码等的签到，第一个提交解并签到成功的人会把解保存下来，并为同一活动的其他学生一起签到。
+    管理员可以为不在自己名下的活动提交解。
+    学生自己课程中尚未关联的活动（新活动通知只通知、不关联）也可以签到。
+    """
+    import job_queue
+    import workers
+    from sign_in_solutions import share_solution, queue_solution
+
+    try:
+        activity = db.get_activity(id=_id)
+        user = db.get_user(qq_num=qq_num)
+        linked = bool(activity and user and (
+            activity in user.activities or
+            (activity.status != CLOSED_STATUS and any(course in user.courses for course in activity.course))))
+        if not activity or not (linked or (is_admin and solution)):
+            await _respond(f"没有签到活动: {_id}")
+            return
+
+        solution = solution or activity.solve
+        if activity.other_id in SOLUTION_REQUIRED_SIGN_TYPES and not solution:
+            await _respond(f"该活动为{activity.type_name}，请按'签到 {_id} [解]'的格式发送，"
+                           f"解为{SOLUTION_REQUIRED_SIGN_TYPES[activity.other_id]}")
+            return
+        try:
+            solution_to_params(activity.other_id, solution)
+        except ValueError as e:
+            await _respond(f"签到失败：{e}")
+            return
 
-    await _respond(f"当前 {course.name} 课程活动有 {len(course_activities_list)} 个\n{respond_text}")
+        verified = False
+        if linked:
+            try:
+                ok = await workers.run("sign_in", activity.id, user.id, solution)
+            except Exception as e:
+                # 任务队列只为已关联（确认未签到）的学生签到
+                if not c.job_queue.enable or activity not in user.activities:
+                    raise
+                # 学习通暂时无法访问等，由任务队列稍后重试，不需要用户再次发送
+                l.warning(f"签到失败，已加入任务队列：{e}")
+                job_queue.enqueue_sign_ins(activity, [user], solution)
+                await _respond("签到暂时失败，已加入重试队列，签到成功后会私信通知")
+                return
+            if not ok:
+                await _respond("签到失败：学习通未接受签到，请检查提交的解")
+                return
+            await _respond("签到成功")
+            db.mark_signed_in(user, activity)
+            verified = True
+
+        # 新提交的解：保存并为同一活动的其他学生签到
+        if activity.other_id in SOLUTION_REQUIRED_SIGN_TYPES and solution != activity.solve and activity.users:
+            if c.job_queue.enable:
+                queued = queue_solution(activity, solution, verified)
+                await _respond(f"已使用该解为其他 {queued} 名同学加入签到队列，签到成功后会分别通知")
+            else:
+                signed = await share_solution(activity, solution, verified)
+                await _respond(f"已使用该解为其他 {len(signed)} 名同学签到")
+    except CircuitOpenError as e:
+        l.warning(f"签到失败：{e}")
+        await _respond(UPSTREAM_UNAVAILABLE_MESSAGE)
+    except Exception as e:
+        await _respond("签到失败：未知错误。请联系管理员。")
+        l.warning(f"签到失败：{e}。")
+
+
+# 指令名及其匹配规则，仅用于指标统计，顺序与 _handle_message 中的匹配顺序一致
+COMMAND_PATTERNS = [
+    ("login", r'^登录'),
+    ("nuke", r'删库跑路'),
+    ("ban", r'(封禁|解封)'),
+    ("status", r'^状态$'),
+    ("bulk_import", r'^批量导入'),
+    ("logout", r'^退出登录'),
+    ("course_list", r'^课程列表$'),
+    ("sign_in", r'^签到'),
+    ("query_course", r'^查询课程'),
+    ("open_activities", r'^待签到$'),
+]
+
+
+def classify_command(message: str) -> str:
+    if message.startswith('@'):
+        message = message.split(' ', 1)[-1].lstrip()
+    for name, pattern in COMMAND_PATTERNS:
+        if re.match(pattern, message):
+            return name
+    return "unknown"
 
 
 async def handle_message(_respond: Callable, qq_num: str, message: str,
-                         chain: MessageChain = MessageChain("Unsupported"), is_admin: bool = False):
+                         chain: MessageChain = None, is_admin: bool = False):
+    command = classify_command(message)
+    metrics.messages_per_minute.mark()
+    # 消息内容可能包含密码，不记录在时间线中
+    with tracing.trace(command, qq_num=mask(qq_num)), metrics.measure("command", command), session_scope():
+        await _handle_message(_respond, qq_num, message, chain, is_admin)
+
+
+async def _handle_message(_respond: Callable, qq_num: str, message: str,
+                          chain: MessageChain = None, is_admin: bool = False):
     # 从上到下依次匹配消息，添加匹配记得 return
 
     if db.get_user(qq_num=qq_num) is not None and db.get_user(qq_num=qq_num).is_banned:
@@ -277,6 +415,38 @@ async def handle_message(_respond: Callable, qq_num: str, message: str,
             l.warning(f"封禁或解封失败: {e}")
             return
 
+    # 运行状态
+    if message == "状态":
+        if is_admin:
+            import status
+
+            await _respond(status.build_report())
+        else:
+            await _respond("权限不足")
+        return
+
+    # 批量导入用户
+    if message.startswith("批量导入"):
+        if not is_admin:
+            await _respond("权限不足")
+            return
+        import bulk_import
+
+        rows, errors = bulk_import.parse_csv(message[len("批量导入"):])
+        if not rows and not errors:
+            await _respond("请在“批量导入”之后每行发送一个账号：手机号,密码,QQ号")
+            return
+        await _respond(f"正在导入 {len(rows)} 个账号……")
+        results, elapsed = await bulk_import.run(rows, errors)
+        failed = [bulk_import.format_row(result) for result in results if not result.ok]
+        report = bulk_import.summarize(results, elapsed)
+        if failed:
+            report += "\n失败的行：\n" + "\n".join(failed[:BULK_IMPORT_MAX_FAILED_ROWS])
+            if len(failed) > BULK_IMPORT_MAX_FAILED_ROWS:
+                report += f"\n……等 {len(failed)} 行"
+        await _respond(report)
+        return
+
     # --- 管理员指令 ---
 
     #  --- 登录用户指令 ---
@@ -314,29 +484,12 @@ async def handle_message(_respond: Callable, qq_num: str, message: str,
 
     # 签到
     if message.startswith('签到'):
-        match = re.match(r'^签到 (\d{1,7})$', message)
+        match = re.match(r'^签到 (\d{1,7})(?: (.+))?$', message)
         if match:
-            _id = int(match.group(1))
-            try:
-                activity = db.get_activity(id=_id)
-                user = db.get_user(qq_num=qq_num)
-                if activity and user and activity in user.activities:
-                    if await xxt_sign_in(activity=activity, user=user):
-                        await _respond("签到成功")
-                        user.activities.remove(activity)
-                        db.update_user(user)
-                        return
-                    else:
-                        raise Exception
-                else:
-                    await _respond(f"没有签到活动: {_id}")
-                    return
-            except Exception as e:
-                await _respond("签到失败：未知错误。请联系管理员。")
-                l.warning(f"签到失败：{e}。")
+            await user_sign_in(_respond, qq_num, int(match.group(1)), match.group(2), is_admin)
             return
         else:
-            await _respond("消息格式不正确。请按'签到 [1-7位数字]'的格式发送")
+            await _respond("消息格式不正确。请按'签到 [1-7位数字]'或'签到 [1-7位数字] [手势/签到码/位置/二维码]'的格式发送")
             return
     # 签到
 
@@ -346,6 +499,12 @@ async def handle_message(_respond: Callable, qq_num: str, message: str,
         return
     # 查询课程
 
+    # 待签到
+    if message == "待签到":
+        await list_open_activities(_respond, qq_num)
+        return
+    # 待签到
+
     # --- 登录用户指令 ---
 
     if not db.get_user(qq_num=qq_num) and not is_admin:
@@ -358,6 +517,9 @@ async def handle_message(_respond: Callable, qq_num: str, message: str,
 登录 [学习通手机号] [学习通密码]
 课程列表: 返回当前账号下的课程列表
 查询课程 [课程数字ID]：查询课程活动
+待签到：所有课程中正在进行、未签到的活动（来自后台同步的数据，立即返回）
+签到 [活动ID]：签到
+签到 [活动ID] [手势/签到码/位置/二维码]：需要解的签到，同一活动的其他同学会一起签到
 退出登录
 ...
     
@@ -366,6 +528,8 @@ async def handle_message(_respond: Callable, qq_num: str, message: str,
 
     if is_admin:
         await _respond('''管理员指令：
+状态：运行时间、消息量、各指令延迟、队列和缓存等运行状况
+批量导入（换行）手机号,密码,QQ号（每行一个账号）：批量登录并导入用户
 封禁 ["手机号" / "QQ"] [手机号 / QQ]
 解封 ["手机号" / "QQ"] [手机号 / QQ]
 ...
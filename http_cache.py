@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Callable
+
+from loguru import logger as l
+
+import metrics
+from config import c
+
+if TYPE_CHECKING:
+    import requests
+    from requests.cookies import RequestsCookieJar
+
+MAX_AGE = 7 * 24 * 3600
+"""超过这个时间（秒）没有更新的缓存在启动时删除"""
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+
+
+class CachedResponse:
+    """缓存中的一条响应。"""
+
+    def __init__(self, text: str, etag: str | None, last_modified: str | None, expires_at: float):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> dict:
+        """条件请求的请求头。"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        # 分片模式下多个进程共用同一个文件，由 SQLite 的文件锁保证一致
+        _conn = sqlite3.connect(c.xxt_api.http_cache_path, timeout=5, check_same_thread=False)
+        _conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                      "key TEXT PRIMARY KEY, text TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+                      "expires_at REAL NOT NULL, stored_at REAL NOT NULL)")
+        _conn.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - MAX_AGE,))
+        _conn.commit()
+    return _conn
+
+
+def account_of(cookies: RequestsCookieJar) -> str | None:
+    """cookies 所属的学习通账号（uid），没有则返回 None。"""
+    for cookie in cookies or []:
+        if cookie.name in ("_uid", "UID") and cookie.value:
+            return cookie.value
+    return None
+
+
+def cache_key(method: str, url: str, account: str, data: dict | None = None) -> str:
+    raw = json.dumps([method, url, account, sorted((data or {}).items())], default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def freshness(resp: requests.Response, ttl: float) -> float | None:
+    """
+    响应可以直接使用的秒数。优先使用 Cache-Control，其次 Expires，都没有时使用配置的 ttl。
+
+    :return: 秒数，no-cache 时为 0（仍然缓存，但每次都要重新验证）；no-store 时返回 None，不缓存。
+    """
+    cache_control = resp.headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    if match:
+        return float(match.group(1))
+    expires = resp.headers.get("Expires")
+    if expires:
+        try:
+            return max(parsedate_to_datetime(expires).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            # 学习通有时返回 Expires: 0 或 -1，表示已过期
+            return 0
+    return ttl
+
+
+def get(key: str) -> CachedResponse | None:
+    with _lock:
+        row = _connect().execute("SELECT text, etag, last_modified, expires_at FROM responses WHERE key = ?",
+                                 (key,)).fetchone()
+    return CachedResponse(*row) if row else None
+
+
+def put(key: str, entry: CachedResponse):
+    with _lock:
+        conn = _connect()
+        conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                     (key, entry.text, entry.etag, entry.last_modified, entry.expires_at, time.time()))
+        conn.commit()
+
+
+def invalidate(key: str):
+    with _lock:
+        conn = _connect()
+        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        conn.commit()
+
+
+def fetch(endpoint: str, method: str, url: str, cookies: RequestsCookieJar,
+          send: Callable[[dict], requests.Response], revalidate: bool = False, data: dict = None) -> str:
+    """
+    通过缓存取得页面文本。缓存未过期时直接返回；过期后带上 ETag/Last-Modified 发送条件请求，
+    学习通返回 304 时继续使用缓存的内容。
+
+    :param endpoint: 接口名，用于选择 TTL 和作为指标标签。
+    :param cookies: 请求使用的 cookies，缓存按其中的账号区分。
+    :param send: 发送请求的函数，参数为额外的请求头。
+    :param revalidate: 即使缓存未过期也向学习通确认（后台同步时使用）。
+    :param data: POST 的表单数据，参与缓存键。
+    :return: 页面文本。
+    """
+    account = account_of(cookies)
+    if not c.xxt_api.http_cache_enable or account is None:
+        return send({}).text
+
+    key = cache_key(method, url, account, data)
+    entry = get(key)
+    if entry is not None and entry.fresh and not revalidate:
+        metrics.http_cache_requests.inc(endpoint, "hit")
+        return entry.text
+
+    resp = send(entry.validators() if entry else {})
+    ttl = c.xxt_api.http_cache_ttl.get(endpoint, 0)
+
+    if resp.status_code == 304 and entry is not None:
+        metrics.http_cache_requests.inc(endpoint, "revalidated")
+        entry.expires_at = time.time() + (freshness(resp, ttl) or 0)
+        put(key, entry)
+        return entry.text
+
+    metrics.http_cache_requests.inc(endpoint, "miss")
+    # cookies 失效时学习通会重定向到登录页，不能缓存
+    max_age = freshness(resp, ttl) if resp.ok and not resp.history else None
+    if max_age is None or (max_age == 0 and not (resp.headers.get("ETag") or resp.headers.get("Last-Modified"))):
+        if entry is not None:
+            invalidate(key)
+        return resp.text
+    put(key, CachedResponse(resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified"),
+                            time.time() + max_age))
+    l.debug("已缓存 {} 的响应（{:.0f} 秒）", endpoint, max_age)
+    return resp.text
+
+
+def stats() -> dict[str, dict[str, int]]:
+    """各接口的缓存命中、未命中和重新验证次数。"""
+    result: dict[str, dict[str, int]] = {}
+    for (endpoint, outcome), value in metrics.http_cache_requests.values().items():
+        result.setdefault(endpoint, {})[outcome] = int(value)
+    return result
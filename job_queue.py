@@ -0,0 +1,213 @@
+"""
+数据库中的持久任务队列。
+
+后台签到、cookies 刷新和轮询失败后的课程扫描写入 jobs 表，由 run() 按优先级领取并在有限的并发下执行，
+重启后未完成的任务继续执行。领取任务时设置租约，执行它的进程退出后任务在租约到期时被重新领取；
+失败的任务按指数退避重试，达到 job_queue.max_attempts 次仍失败的转入死信（status 为 dead），不再重试。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+
+from loguru import logger as l
+
+import db.crud
+import metrics
+import sharding
+import workers
+from config import c
+from db.db import session_scope
+from db.db_models import Job, SignInActivity, User
+from xxt_api import IncorrectPasswordError
+
+# 优先级，数值小的先执行。签到有时限，最先执行
+PRIORITY_SIGN_IN = 0
+PRIORITY_REFRESH_COOKIES = 10
+PRIORITY_SCAN_COURSE = 20
+
+PURGE_INTERVAL = 3600
+"""删除过期的已完成任务的间隔（秒）"""
+
+_wakeup: asyncio.Event | None = None
+
+
+class PermanentJobError(Exception):
+    """重试也不会成功的失败（如学习通不接受签到解），任务直接转入死信。"""
+
+
+def make_job(kind: str, payload: dict, priority: int, delay: float = 0, qq_num: str = None,
+             dedupe_key: str = None) -> Job:
+    """
+    :param kind: 任务类型，见 HANDLERS。
+    :param payload: 传给任务函数的关键字参数，要能转换为 JSON。
+    :param delay: 多少秒后才可以执行。
+    :param qq_num: 任务所属用户的 QQ 号，分片模式下只由负责该用户的分片执行（执行中会给用户发消息）。
+    :param dedupe_key: 同一个键同时只有一个未完成的任务。
+    """
+    now = int(time.time())
+    return Job(kind=kind, payload=json.dumps(payload), priority=priority, status="pending", run_at=now + int(delay),
+               shard=sharding.shard_of(qq_num) if qq_num and sharding.is_enabled() else None,
+               dedupe_key=dedupe_key, attempts=0, max_attempts=c.job_queue.max_attempts, created_at=now)
+
+
+def enqueue(jobs: list[Job]) -> list[Job]:
+    """
+    把任务加入队列，并唤醒本进程的 run()。
+
+    :return: 实际加入的任务（已有相同 dedupe_key 的未完成任务时跳过）。
+    """
+    queued = db.crud.enqueue_jobs(jobs)
+    if queued and _wakeup is not None:
+        _wakeup.set()
+    return queued
+
+
+def enqueue_sign_ins(activity: SignInActivity, users: list[User], solution: str = None,
+                     save_solution: bool = False) -> int:
+    """
+    为用户签到。签到成功后私信通知用户。
+
+    :param save_solution: 签到成功后把 solution 保存为活动的解（解尚未被验证时）。
+    :return: 加入队列的任务数。
+    """
+    return len(enqueue([
+        make_job("sign_in", {"activity_id": activity.id, "user_id": user.id, "solution": solution,
+                             "save_solution": save_solution},
+                 PRIORITY_SIGN_IN, qq_num=user.qq_num, dedupe_key=f"sign_in:{activity.id}:{user.id}")
+        for user in users
+    ]))
+
+
+def enqueue_refresh_cookies(user: User, delay: float = 0) -> bool:
+    return bool(enqueue([make_job("refresh_cookies", {"user_id": user.id}, PRIORITY_REFRESH_COOKIES, delay,
+                                  dedupe_key=f"refresh_cookies:{user.id}")]))
+
+
+def enqueue_scan_course(course_id: int, delay: float = 0) -> bool:
+    return bool(enqueue([make_job("scan_course", {"course_id": course_id}, PRIORITY_SCAN_COURSE, delay,
+                                  dedupe_key=f"scan_course:{course_id}")]))
+
+
+async def _sign_in(activity_id: int, user_id: int, solution: str = None, save_solution: bool = False):
+    activity = db.crud.get_activity(id=activity_id)
+    user = db.crud.get_user(user_id=user_id)
+    if activity is None or user is None or activity not in user.activities:
+        # 已经签到，或用户已退出登录
+        return
+    if not await workers.run("sign_in", activity.id, user.id, solution or activity.solve):
+        raise PermanentJobError("学习通未接受签到")
+    db.crud.mark_signed_in(user, activity)
+    if save_solution and solution and activity.solve != solution:
+        db.crud.set_activity_solution(activity, solution)
+    # 任务可能由不负责该学生的分片执行，通过通知队列发送
+    db.crud.queue_messages(activity, [user], f"签到活动 {activity.name}（ID: {activity.id}）已自动签到")
+
+
+async def _refresh_cookies(user_id: int):
+    user = db.crud.get_user(user_id=user_id)
+    if user is None or user.qq_num is None:
+        return
+    try:
+        await workers.run("refresh_cookies", user.id)
+    except IncorrectPasswordError as e:
+        raise PermanentJobError(e)
+
+
+async def _scan_course(course_id: int):
+    import poller
+
+    await poller.poll_course(course_id)
+
+
+HANDLERS = {
+    "sign_in": _sign_in,
+    "refresh_cookies": _refresh_cookies,
+    "scan_course": _scan_course,
+}
+
+
+def retry_at(job: Job, error: Exception) -> int | None:
+    """
+    :return: 下次重试的时间戳，不再重试（转入死信）时为 None。
+    """
+    if isinstance(error, PermanentJobError) or job.attempts >= job.max_attempts:
+        return None
+    return int(time.time() + c.job_queue.retry_delay * 2 ** (job.attempts - 1))
+
+
+async def execute(job: Job) -> bool:
+    """
+    执行一个已领取的任务并记录结果。任务在单独的会话中执行，最长执行到租约到期。
+
+    :return: 是否成功。
+    """
+    try:
+        handler = HANDLERS.get(job.kind)
+        if handler is None:
+            raise PermanentJobError(f"未知的任务类型 {job.kind}")
+        with session_scope():
+            await asyncio.wait_for(handler(**json.loads(job.payload)), c.job_queue.lease)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        next_run = retry_at(job, e)
+        with session_scope():
+            db.crud.fail_job(job, error, next_run)
+        if next_run is None:
+            metrics.job_queue_jobs.inc(job.kind, "dead")
+            l.error("任务 {} ({}) 第 {} 次执行失败，已转入死信: {}", job.id, job.kind, job.attempts, error)
+        else:
+            metrics.job_queue_jobs.inc(job.kind, "retry")
+            l.warning("任务 {} ({}) 第 {} 次执行失败，{} 秒后重试: {}",
+                      job.id, job.kind, job.attempts, next_run - int(time.time()), error)
+        return False
+
+    with session_scope():
+        if not db.crud.complete_job(job):
+            l.warning("任务 {} ({}) 执行完成时租约已过期", job.id, job.kind)
+    metrics.job_queue_jobs.inc(job.kind, "done")
+    return True
+
+
+async def run():
+    """|coro|
+    从队列中领取任务并执行，同时执行的任务不超过 job_queue.concurrency 个。
+    有空闲的并发名额时按优先级领取；队列为空时每 poll_interval 秒检查一次，本进程加入任务或任务完成时立即检查。
+    """
+    global _wakeup
+
+    _wakeup = asyncio.Event()
+    running: set[asyncio.Task] = set()
+    purged_at = 0.0
+    l.info("已开启任务队列")
+
+    def done(task: asyncio.Task):
+        running.discard(task)
+        _wakeup.set()
+
+    while True:
+        _wakeup.clear()
+        try:
+            free = c.job_queue.concurrency - len(running)
+            jobs = []
+            with session_scope():
+                if free > 0:
+                    jobs = db.crud.claim_jobs(free, c.job_queue.lease, sharding.shard_index)
+                if time.time() - purged_at > PURGE_INTERVAL:
+                    deleted = db.crud.delete_finished_jobs(int(time.time() - c.job_queue.done_retention))
+                    if deleted:
+                        l.info(f"已删除 {deleted} 个过期的已完成任务")
+                    purged_at = time.time()
+            for job in jobs:
+                task = asyncio.create_task(execute(job))
+                running.add(task)
+                task.add_done_callback(done)
+            if jobs:
+                l.debug("领取了 {} 个任务，正在执行 {} 个", len(jobs), len(running))
+        except Exception as e:
+            l.error(f"领取任务时出错: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), c.job_queue.poll_interval)
+        except asyncio.TimeoutError:
+            pass
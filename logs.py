@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import os
+import queue
+import sys
+import threading
+import time
+from typing import TextIO
+
+from loguru import logger
+
+import metrics
+from config import c
+
+TEXT_FORMAT = ("<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+               "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>")
+
+_queued_sinks: list[QueuedSink] = []
+
+
+def mask(secret: str | None, keep: int = 3) -> str:
+    """只保留开头几位，用于在日志中标识手机号等敏感信息。"""
+    if not secret:
+        return ""
+    return secret[:keep] + "*" * max(len(secret) - keep, 0)
+
+
+class CallSiteSampler:
+    """
+    按调用位置（模块 + 行号）对低级别的日志限流：每个位置平均每秒最多 rate 条，允许短时间内连续 burst 条。
+    被省略的条数记入指标，并附在该位置下一条输出的日志上。
+    作为 loguru 的 filter 使用，每个输出各用一个实例。
+    """
+
+    def __init__(self, max_level: str, rate: float, burst: int):
+        self.max_level = logger.level(max_level).no
+        self.rate = rate
+        self.burst = burst
+        # (模块, 行号) -> [令牌数, 上次更新时间, 省略的条数]
+        self._sites: dict[tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record) -> bool:
+        if record["level"].no > self.max_level or self.rate <= 0:
+            return True
+        site = (record["name"], record["line"])
+        now = time.monotonic()
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None:
+                state = self._sites[site] = [float(self.burst), now, 0]
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+            if state[0] < 1:
+                state[2] += 1
+                metrics.log_suppressed.inc(f"{site[0]}:{site[1]}")
+                return False
+            state[0] -= 1
+            suppressed, state[2] = state[2], 0
+        if suppressed:
+            record["extra"]["suppressed"] = suppressed
+        return True
+
+
+class RotatingFile:
+    """按大小轮换的日志文件：超过 max_bytes 后依次改名为 .1、.2……，最多保留 backups 个。"""
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def write(self, text: str):
+        size = len(text.encode("utf-8"))
+        if self.max_bytes > 0 and self._size and self._size + size > self.max_bytes:
+            self._rotate()
+        self._file.write(text)
+        self._size += size
+
+    def flush(self):
+        self._file.flush()
+
+    def stop(self):
+        self._file.close()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = 0
+
+
+class QueuedSink:
+    """
+    loguru 的输出：格式化后的日志放入进程内的队列，由后台线程批量写入 target，调用方不等待终端或磁盘。
+    loguru 自带的 enqueue 会把每条记录序列化后经管道传给写入线程，调用方的开销比直接写入还大，这里不使用。
+    """
+
+    def __init__(self, target: TextIO | RotatingFile):
+        self.target = target
+        self._queue: queue.Queue[str | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        _queued_sinks.append(self)
+
+    def write(self, message: str):
+        self._queue.put(message)
+
+    def join(self):
+        """等待队列中的日志写完。"""
+        self._queue.join()
+
+    def stop(self):
+        # logger.remove() 时调用
+        self._queue.put(None)
+        self._thread.join()
+        if isinstance(self.target, RotatingFile):
+            self.target.stop()
+        _queued_sinks.remove(self)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for message in batch:
+                    if message is None:
+                        self.target.flush()
+                        return
+                    self.target.write(message)
+                self.target.flush()
+            except Exception as e:
+                print(f"写入日志失败: {e}", file=sys.__stderr__)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+def text_format(record) -> str:
+    suffix = f"（省略了此处的 {record['extra']['suppressed']} 条日志）" if record["extra"].get("suppressed") else ""
+    return TEXT_FORMAT + suffix + "\n{exception}"
+
+
+def setup():
+    """
+    按配置重新设置日志输出。
+    enqueue 时日志放入队列，由后台线程写入；serialize 时每条日志输出为一行 JSON（loguru 的 serialize 格式），
+    便于日志系统收集。调试日志按调用位置限流。
+    """
+    config = c.logging
+    logger.remove()
+
+    def add(target, colorize: bool):
+        logger.add(QueuedSink(target) if config.enqueue else target, level=config.level,
+                   serialize=config.serialize, colorize=colorize and not config.serialize,
+                   format="{message}" if config.serialize else text_format,
+                   filter=CallSiteSampler(config.sample_max_level, config.sample_rate, config.sample_burst))
+
+    add(sys.stderr, colorize=sys.stderr.isatty())
+    if config.file:
+        add(RotatingFile(config.file, int(config.file_max_mb * 1024 * 1024), config.file_backups), colorize=False)
+
+
+def pending() -> int:
+    """队列中尚未写入的日志条数。"""
+    return sum(sink._queue.qsize() for sink in _queued_sinks)
+
+
+def flush():
+    """等待所有队列中的日志写完。"""
+    for sink in list(_queued_sinks):
+        sink.join()
@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Tuple
+
+from loguru import logger as l
+
+import tracing
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STARTED_AT = time.time()
+"""进程启动（导入本模块）的时间戳"""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """单调递增的计数器。"""
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        """所有标签组合的当前值。"""
+        return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    """可以任意设置的数值。"""
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *label_values: str):
+        self._values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """固定分桶的延迟直方图，输出格式与 Prometheus 客户端一致。"""
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合：[各桶计数（非累积）..., +Inf 桶计数, 总和]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def label_values(self) -> list[Tuple[str, ...]]:
+        return sorted(self._series)
+
+    def quantile(self, q: float, *label_values: str) -> float | None:
+        """
+        由分桶计数估计分位数：在所在的桶内线性插值（与 Prometheus 的 histogram_quantile 相同）。
+        落在最大的桶之外时返回最大桶的上限。
+
+        :param q: 0 到 1 之间的分位数。
+        :return: 没有记录时为 None。
+        """
+        series = self._series.get(label_values)
+        total = sum(series[:-1]) if series else 0
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets, series):
+            if n and cumulative + n >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / n
+            cumulative += n
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class RecentRate:
+    """最近 window 秒内的事件数。按秒分桶，每次记录只更新一个桶。"""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self._counts = [0] * window
+        self._seconds = [0] * window
+        self._lock = threading.Lock()
+
+    def mark(self, amount: int = 1):
+        now = int(time.time())
+        i = now % self.window
+        with self._lock:
+            if self._seconds[i] != now:
+                self._seconds[i] = now
+                self._counts[i] = 0
+            self._counts[i] += amount
+
+    def total(self) -> int:
+        now = int(time.time())
+        return sum(n for n, second in zip(self._counts, self._seconds) if now - second < self.window)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# kind -> (延迟直方图, 错误计数器)
+_FAMILIES: Dict[str, Tuple[Histogram, Counter]] = {
+    "xxt_api": (
+        registry.register(Histogram("xxt_api_request_seconds", "学习通各接口的请求耗时", ("endpoint",))),
+        registry.register(Counter("xxt_api_errors_total", "学习通各接口的请求失败次数", ("endpoint",))),
+    ),
+    "command": (
+        registry.register(Histogram("bot_command_seconds", "各指令的处理耗时", ("command",))),
+        registry.register(Counter("bot_command_errors_total", "各指令处理时未捕获的异常次数", ("command",))),
+    ),
+    "crud": (
+        registry.register(Histogram("db_crud_seconds", "各数据库操作函数的耗时", ("function",))),
+        registry.register(Counter("db_crud_errors_total", "各数据库操作函数引发异常的次数", ("function",))),
+    ),
+    "send": (
+        registry.register(Histogram("bot_send_seconds", "发送消息的耗时（不含回复延迟）", ("platform",))),
+        registry.register(Counter("bot_send_errors_total", "发送消息失败的次数", ("platform",))),
+    ),
+}
+
+xxt_api_retries = registry.register(Counter("xxt_api_retries_total", "学习通各接口的重试次数", ("endpoint",)))
+xxt_api_circuit_state = registry.register(
+    Gauge("xxt_api_circuit_state", "学习通各主机的熔断器状态：0 关闭，1 半开，2 打开", ("host",)))
+log_suppressed = registry.register(
+    Counter("log_messages_suppressed_total", "按调用位置限流而省略的日志条数", ("site",)))
+http_cache_requests = registry.register(
+    Counter("xxt_http_cache_requests_total", "学习通页面缓存的结果：hit 命中，miss 未命中，revalidated 重新验证后命中",
+            ("endpoint", "result")))
+xxt_api_in_flight = registry.register(Gauge("xxt_api_in_flight_requests", "正在进行的学习通请求数"))
+xxt_cookie_sessions = registry.register(
+    Counter("xxt_cookie_sessions_total",
+            "使用已保存的 cookies 的结果：recently_checked 近期确认过有效而直接使用，reused 校验有效并复用，"
+            "relogin 失效后重新登录",
+            ("result",)))
+db_queries = registry.register(Counter("db_queries_total", "执行的 SQL 语句数", ("statement",)))
+messages_per_minute = RecentRate(60)
+"""最近一分钟收到的消息数"""
+job_queue_jobs = registry.register(
+    Counter("job_queue_jobs_total", "任务队列中各类任务的执行结果：done 完成，retry 稍后重试，dead 转入死信",
+            ("kind", "result")))
+
+
+def observe(kind: str, name: str, seconds: float, error: bool = False):
+    """
+    记录一次耗时，失败时同时累加错误计数。
+
+    :param kind: 指标类别：xxt_api, command, crud, send。
+    :param name: 接口名、指令名、函数名或平台名。
+    :param seconds: 耗时（秒）。
+    :param error: 是否失败。
+    """
+    histogram, errors = _FAMILIES[kind]
+    histogram.observe(seconds, name)
+    if error:
+        errors.inc(name)
+
+
+def family(kind: str) -> Tuple[Histogram, Counter]:
+    """某个类别的 (延迟直方图, 错误计数器)。"""
+    return _FAMILIES[kind]
+
+
+@contextmanager
+def measure(kind: str, name: str):
+    """记录代码块耗时的上下文管理器，代码块引发异常时计为一次错误。在消息的追踪中同时记录为一个 span。"""
+    start = time.perf_counter()
+    try:
+        with tracing.span(kind, name):
+            yield
+    except BaseException:
+        observe(kind, name, time.perf_counter() - start, error=True)
+        raise
+    observe(kind, name, time.perf_counter() - start)
+
+
+def timed(kind: str, name: str = None) -> Callable:
+    """
+    记录函数耗时的装饰器，同时支持普通函数和协程函数。
+
+    :param kind: 指标类别。
+    :param name: 指标名，默认使用函数名。
+    """
+
+    def decorator(func: Callable) -> Callable:
+        metric_name = name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with measure(kind, metric_name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(kind, metric_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def _metrics_handler(request):
+    from aiohttp import web
+
+    return web.Response(text=registry.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+def add_metrics_route(app, path: str = "/metrics"):
+    """
+    在已有的 aiohttp Application 上挂载指标接口，例如反向 ws 使用的 AiohttpServerService.wsgi_handler。
+    """
+    app.router.add_get(path, _metrics_handler)
+
+
+async def start_metrics_server(host: str, port: int, path: str = "/metrics"):
+    """|coro|
+    启动独立的本地 aiohttp 服务器，以 Prometheus 文本格式输出指标
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    add_metrics_route(app, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    l.info(f"指标接口已启动: http://{host}:{port}{path}")
+    return runner
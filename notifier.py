@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import defaultdict
+
+from loguru import logger as l
+
+import db.crud
+import platforms
+import sharding
+from config import c
+from db.db import session_scope
+from db.db_models import Course, Notification, SignInActivity, User
+from resilience import RateLimiter
+
+CHECK_INTERVAL = 2
+"""检查通知队列的间隔（秒）。同一轮中同一用户的多条通知合并为一条消息"""
+
+RETRY_DELAY = 60
+"""发送失败（机器人未连接、不是好友等）后第一次重试前的等待时间（秒），之后每次加倍"""
+
+MAX_ATTEMPTS = 5
+"""发送失败这么多次后放弃该通知"""
+
+
+def queue_new_activities(course: Course, activities: list[SignInActivity], syncing_user: User = None,
+                         notify_syncing_user: bool = False) -> int:
+    """
+    为课程的新活动通知课程的学生，把通知写入数据库中的队列。
+    通知队列在数据库中，由负责该用户的进程（分片）发送，重启后未发送的通知也不会丢失。
+    其他学生的签到状态没有查询过（可能已签到或被教师代签），所以只通知有新活动，不把活动加入其待签到列表，
+    也不会为其批量签到；学生发送“签到”或“查询课程”时再按其签到状态处理。
+
+    :param course: 课程。
+    :param activities: 新记录的活动。
+    :param syncing_user: 取得活动列表的学生，已经查询过签到状态，不再关联。
+    :param notify_syncing_user: 是否也通知 syncing_user（后台轮询时为 True，用户主动查询时已经看到了结果）。
+    :return: 加入队列的通知数。
+    """
+    if not c.system.notify_new_activities or not activities:
+        return 0
+
+    students = [user for user in course.students if user.qq_num and not user.is_banned and user is not syncing_user]
+    queued = 0
+    for activity in activities:
+        recipients = list(students)
+        if notify_syncing_user and syncing_user is not None and activity in syncing_user.activities:
+            recipients.append(syncing_user)
+        queued += db.crud.queue_notifications(activity, recipients)
+    return queued
+
+
+def build_digest(notifications: list[Notification]) -> str:
+    """把一个用户的多条通知合并为一条消息：先是各条消息，再是按课程分组的新活动。"""
+    lines = [notification.message for notification in notifications if notification.message]
+    by_course: dict[str, list[SignInActivity]] = defaultdict(list)
+    for notification in notifications:
+        if notification.message:
+            continue
+        activity = notification.activity
+        course_name = activity.course[0].name if activity.course else "未知课程"
+        by_course[course_name].append(activity)
+    if not by_course:
+        return "\n".join(lines)
+
+    lines.append(f"有 {sum(len(activities) for activities in by_course.values())} 个新的签到活动：")
+    for course_name, activities in by_course.items():
+        lines.append(f"【{course_name}】")
+        lines.extend(f"  {activity.name}: {activity.type_name}, ID: {activity.id}" for activity in activities)
+    lines.append("发送'签到 [活动ID]'进行签到，已签到的可以忽略")
+    return "\n".join(lines)
+
+
+def record_failure(notifications: list[Notification], error: object):
+    """
+    记录一个用户的通知发送失败：按失败次数退避重试，达到 MAX_ATTEMPTS 次后放弃（标记为已发送）。
+
+    :param error: send_private_message 的返回值（False）或引发的异常。
+    """
+    qq_num = notifications[0].user.qq_num
+    reason = error if isinstance(error, BaseException) else "平台未发送（未连接、不是好友或发送出错）"
+    attempts = max(notification.attempts or 0 for notification in notifications) + 1
+    if attempts >= MAX_ATTEMPTS:
+        l.warning(f"向 {qq_num} 发送通知失败 {attempts} 次，放弃发送: {reason}")
+        db.crud.mark_notifications_sent(notifications)
+        return
+    delay = RETRY_DELAY * 2 ** (attempts - 1)
+    l.warning(f"向 {qq_num} 发送通知失败（第 {attempts} 次），{delay} 秒后重试: {reason}")
+    db.crud.record_notification_failure(notifications, int(time.time()) + delay)
+
+
+async def flush(limiter: RateLimiter) -> int:
+    """
+    发送队列中本分片用户的通知，每个用户一条汇总消息，在发送速率限制内并发发送。
+
+    :return: 发送成功的消息数。
+    """
+    by_user: dict[int, list[Notification]] = defaultdict(list)
+    now = int(time.time())
+    for notification in db.crud.get_pending_notifications(now):
+        user = notification.user
+        if user.qq_num is None or user.is_banned:
+            # 用户已退出登录或被封禁，不再发送
+            db.crud.mark_notifications_sent([notification])
+            continue
+        if sharding.owns(user.qq_num):
+            by_user[notification.user_id].append(notification)
+    if not by_user:
+        return 0
+
+    semaphore = asyncio.Semaphore(c.system.notify_concurrency)
+
+    async def send(notifications: list[Notification]) -> bool:
+        async with semaphore:
+            await limiter.acquire()
+            return await platforms.send_private_message(notifications[0].user.qq_num, build_digest(notifications))
+
+    groups = list(by_user.values())
+    results = await asyncio.gather(*(send(group) for group in groups), return_exceptions=True)
+
+    sent = 0
+    for group, ok in zip(groups, results):
+        if ok is True:
+            db.crud.mark_notifications_sent(group)
+            sent += 1
+        else:
+            record_failure(group, ok)
+    l.info(f"已发送 {sent} 条通知，共 {len(groups)} 个用户")
+    return sent
+
+
+async def run():
+    """|coro|
+    后台发送通知队列中的新活动通知和其他消息（如自动签到的结果）。
+    """
+    limiter = RateLimiter(c.system.notify_rate)
+    l.info("已开启通知队列的发送")
+    while True:
+        try:
+            with session_scope():
+                await flush(limiter)
+        except Exception as e:
+            l.error(f"发送新活动通知时出错: {e}")
+        await asyncio.sleep(CHECK_INTERVAL)
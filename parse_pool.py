@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from loguru import logger as l
+
+import tracing
+from config import c
+
+_executor: Executor | None = None
+_mode: str | None = None
+
+
+def _get_executor(mode: str) -> Executor:
+    global _executor, _mode
+
+    if _executor is None or _mode != mode:
+        shutdown()
+        if mode == "process":
+            # spawn 的子进程只导入解析函数所在的模块，不会复制事件循环和数据库连接
+            _executor = ProcessPoolExecutor(max_workers=c.system.parse_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        else:
+            _executor = ThreadPoolExecutor(max_workers=c.system.parse_workers, thread_name_prefix="parse")
+        _mode = mode
+        l.debug(f"网页解析使用 {mode} 池，{c.system.parse_workers} 个工作者")
+    return _executor
+
+
+async def run(func: Callable, *args):
+    """|coro|
+    按配置的 parse_executor 执行解析函数：inline 直接在事件循环中执行，thread 或 process 在对应的池中执行。
+    使用进程池时 func 必须是模块级函数，参数和返回值必须可以 pickle（见 xxt_parse）。
+    """
+    mode = c.system.parse_executor
+    with tracing.span("parse", func.__name__, executor=mode):
+        if mode == "inline":
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(mode), func, *args)
+
+
+def shutdown():
+    """关闭解析池。"""
+    global _executor, _mode
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _mode = None
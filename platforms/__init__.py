@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from typing import Awaitable, Callable, Dict
+
+from loguru import logger as l
+
+import sharding
+
+# 平台名 -> 向指定 QQ 号发送私聊消息的协程函数，由各平台启动时注册
+_senders: Dict[str, Callable[[str, str], Awaitable]] = {}
+
+
+def register_sender(platform: str, send: Callable[[str, str], Awaitable]):
+    """
+    注册平台的私聊发送函数，供主动通知等不依赖收到消息的场景使用。
+
+    :param platform: 平台名。
+    :param send: 协程函数 send(qq_num, message)。
+    """
+    _senders[platform] = send
+
+
+async def send_private_message(qq_num: str, message: str) -> bool:
+    """
+    主动向用户发送私聊消息。分片模式下只能发送给本分片负责的用户，其他用户的消息不会被转发。
+    调用者必须处理返回 False 的情况；可能属于其他分片的用户应改用 db.crud.queue_messages 写入通知队列，
+    由所属分片的进程发送。
+
+    :param qq_num: 用户的 QQ 号。
+    :param message: 消息文本。
+    :return: 是否已由本进程发送。
+    """
+    if not sharding.owns(qq_num):
+        l.warning(f"{qq_num} 不属于本分片，未发送消息")
+        return False
+    if not _senders:
+        l.warning(f"没有可用的平台，无法向 {qq_num} 发送消息")
+        return False
+    for platform, send in _senders.items():
+        try:
+            await send(qq_num, message)
+            return True
+        except Exception as e:
+            l.warning(f"通过 {platform} 向 {qq_num} 发送消息失败: {e}")
+    return False
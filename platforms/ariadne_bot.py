@@ -18,47 +18,79 @@ from graia.ariadne.model import Friend, Group, Member, AriadneBaseModel
 from loguru import logger
 from typing_extensions import Annotated
 
+import metrics
+import platforms
+import sharding
+import tracing
+import warmup
 from handle_msg import handle_message
 from config import c as config
 
-# Refer to https://graia.readthedocs.io/ariadne/quickstart/
-if config.mirai.reverse_ws_port:
-    Ariadne.config(default_account=config.mirai.qq)
-    app = Ariadne(
-        ariadne_config(
-            config.mirai.qq,  # 配置详见
-            config.mirai.api_key,
-            WebsocketServerConfig()
-        ),
-    )
-    app.launch_manager.add_launchable(AiohttpServerService(config.mirai.reverse_ws_host, config.mirai.reverse_ws_port))
-else:
-    app = Ariadne(
-        ariadne_config(
-            config.mirai.qq,  # 配置详见
-            config.mirai.api_key,
-            HttpClientConfig(host=config.mirai.http_url),
-            WebsocketClientConfig(host=config.mirai.ws_url),
-        ),
-    )
+app: Ariadne = None
+
+
+def create_app() -> Ariadne:
+    """
+    根据配置创建 Ariadne 实例并注册事件监听器。
+    在 start_task 中调用，而不是在导入时，以便先载入配置文件。
+    """
+    global app
+
+    # Refer to https://graia.readthedocs.io/ariadne/quickstart/
+    if config.mirai.reverse_ws_port:
+        Ariadne.config(default_account=config.mirai.qq)
+        app = Ariadne(
+            ariadne_config(
+                config.mirai.qq,  # 配置详见
+                config.mirai.api_key,
+                WebsocketServerConfig()
+            ),
+        )
+        server_service = AiohttpServerService(config.mirai.reverse_ws_host, config.mirai.reverse_ws_port)
+        if config.metrics.enable and config.metrics.share_reverse_ws_server:
+            metrics.add_metrics_route(server_service.wsgi_handler, config.metrics.path)
+        app.launch_manager.add_launchable(server_service)
+    else:
+        app = Ariadne(
+            ariadne_config(
+                config.mirai.qq,  # 配置详见
+                config.mirai.api_key,
+                HttpClientConfig(host=config.mirai.http_url),
+                WebsocketClientConfig(host=config.mirai.ws_url),
+            ),
+        )
+
+    app.broadcast.receiver("FriendMessage", priority=19)(friend_message_listener)
+    app.broadcast.receiver("GroupMessage", priority=19)(group_message_listener)
+    app.broadcast.receiver("NewFriendRequestEvent")(on_friend_request)
+    app.broadcast.receiver("BotInvitedJoinGroupRequestEvent")(on_group_invite)
+    app.broadcast.receiver(AccountLaunch)(start_background)
+    platforms.register_sender("ariadne", send_friend_message)
+    return app
 
 
 def response(target: Union[Friend, Group], source: Source):
     async def respond(msg: AriadneBaseModel, qq_number: str = None):
-        await asyncio.sleep(config.respond.reply_latency)
-        event = await app.send_message(
-            target if qq_number is None else await Ariadne.get_friend(friend_id=int(qq_number)),
-            msg
-        )
+        await tracing.sleep(config.respond.reply_latency, "reply_latency")
+        with metrics.measure("send", "ariadne"):
+            event = await app.send_message(
+                target if qq_number is None else await Ariadne.get_friend(friend_id=int(qq_number)),
+                msg
+            )
         return event
 
     return respond
 
 
-@app.broadcast.receiver("FriendMessage", priority=19)
+async def send_friend_message(qq_num: str, msg: str):
+    await tracing.sleep(config.respond.reply_latency, "reply_latency")
+    with metrics.measure("send", "ariadne"):
+        return await app.send_friend_message(int(qq_num), msg)
+
+
 async def friend_message_listener(target: Friend, source: Source,
                                   chain: MessageChain):
-    if target.id == config.mirai.qq:
+    if target.id == config.mirai.qq or target.id in sharding.bot_accounts():
         return
 
     await handle_message(
@@ -73,7 +105,6 @@ async def friend_message_listener(target: Friend, source: Source,
 GroupTrigger = Annotated[MessageChain, MentionMe(True)]
 
 
-@app.broadcast.receiver("GroupMessage", priority=19)
 async def group_message_listener(target: Group, source: Source, chain: GroupTrigger, member: Member):
     await handle_message(
         response(target, source),
@@ -84,19 +115,16 @@ async def group_message_listener(target: Group, source: Source, chain: GroupTrig
     )
 
 
-@app.broadcast.receiver("NewFriendRequestEvent")
 async def on_friend_request(event: NewFriendRequestEvent):
     if config.system.accept_friend_request:
         await event.accept()
 
 
-@app.broadcast.receiver("BotInvitedJoinGroupRequestEvent")
-async def on_friend_request(event: BotInvitedJoinGroupRequestEvent):
+async def on_group_invite(event: BotInvitedJoinGroupRequestEvent):
     if config.system.accept_group_invite:
         await event.accept()
 
 
-@app.broadcast.receiver(AccountLaunch)
 async def start_background():
     logger.info("尝试从 Mirai 服务中读取机器人 QQ 的 session key……")
     if config.mirai.reverse_ws_port:
@@ -106,11 +134,13 @@ async def start_background():
     else:
         logger.info("[提示] 当前为正向 ws + http 模式，请确保你的 mirai api http 设置了正确的 ws 和 http 配置")
         logger.info("[提示] 配置不正确或 Mirai 未登录 QQ 都会导致 【Websocket reconnecting...】 提示的出现。")
+    warmup.start()
 
 
 async def start_task():
     """|coro|
     以异步方式启动
     """
+    create_app()
     app._patch_launch_manager()
     await app.launch_manager.launch()
@@ -0,0 +1,102 @@
+import asyncio
+
+from aiocqhttp import CQHttp, Event, Message
+from loguru import logger
+
+import metrics
+import platforms
+import sharding
+import tracing
+import warmup
+from handle_msg import handle_message
+from config import c as config
+
+bot: CQHttp = None
+
+
+def create_bot() -> CQHttp:
+    """
+    根据配置创建 OneBot 反向 ws 服务端并注册事件监听器。
+    go-cqhttp 等 OneBot 实现需要以 Universal 客户端连接到 ws://reverse_ws_host:reverse_ws_port/ws/
+    """
+    global bot
+
+    bot = CQHttp(access_token=config.onebot.access_token or None)
+
+    bot.on_message('private')(private_message_listener)
+    bot.on_message('group')(group_message_listener)
+    bot.on_request('friend')(on_friend_request)
+    bot.on_request('group.invite')(on_group_invite)
+    bot.on_meta_event('lifecycle.connect')(start_background)
+    platforms.register_sender("onebot", send_private_message)
+    return bot
+
+
+def response(event: Event):
+    async def respond(msg, qq_number: str = None):
+        await tracing.sleep(config.respond.reply_latency, "reply_latency")
+        with metrics.measure("send", "onebot"):
+            if qq_number is None:
+                return await bot.send(event, str(msg))
+            return await bot.send_private_msg(user_id=int(qq_number), message=str(msg))
+
+    return respond
+
+
+async def send_private_message(qq_num: str, msg: str):
+    await tracing.sleep(config.respond.reply_latency, "reply_latency")
+    with metrics.measure("send", "onebot"):
+        return await bot.send_private_msg(user_id=int(qq_num), message=str(msg))
+
+
+def is_mentioned(message: Message, self_id: int) -> bool:
+    return any(segment.type == 'at' and str(segment.data.get('qq')) == str(self_id) for segment in message)
+
+
+async def private_message_listener(event: Event):
+    if event.user_id == event.self_id or event.user_id in sharding.bot_accounts():
+        return
+
+    await handle_message(
+        response(event),
+        str(event.user_id),
+        Message(event.message).extract_plain_text().strip(),
+        is_admin=event.user_id == config.onebot.manager_qq,
+    )
+
+
+async def group_message_listener(event: Event):
+    message = Message(event.message)
+    if not is_mentioned(message, event.self_id):
+        return
+
+    await handle_message(
+        response(event),
+        str(event.user_id),
+        message.extract_plain_text().strip(),
+        is_admin=event.user_id == config.onebot.manager_qq,
+    )
+
+
+async def on_friend_request(event: Event):
+    if config.system.accept_friend_request:
+        return {'approve': True}
+
+
+async def on_group_invite(event: Event):
+    if config.system.accept_group_invite:
+        return {'approve': True}
+
+
+async def start_background(event: Event):
+    logger.info(f"OneBot 客户端 {event.self_id} 已连接")
+    warmup.start()
+
+
+async def start_task():
+    """|coro|
+    以异步方式启动
+    """
+    create_bot()
+    logger.info(f"[提示] OneBot 反向 ws 地址: ws://{config.onebot.reverse_ws_host}:{config.onebot.reverse_ws_port}/ws/")
+    await bot.run_task(host=config.onebot.reverse_ws_host, port=config.onebot.reverse_ws_port)
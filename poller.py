@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import time
+from collections import Counter
+
+from loguru import logger as l
+
+import db.crud
+import job_queue
+import sharding
+import workers
+from config import c
+from db.db import session_scope
+from db.db_models import Course, User
+
+TICK = 5
+"""检查到期课程的间隔（秒）"""
+
+RELEARN_INTERVAL = 3600
+"""重新统计各课程活跃时间段的间隔（秒）"""
+
+WEEKDAYS = "一二三四五六日"
+
+
+def as_datetime(value) -> datetime.datetime | None:
+    """活动的开始时间可能以 datetime、时间戳或字符串的形式存储。"""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value)
+    try:
+        return datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def slot_of(moment: datetime.datetime) -> tuple[int, int]:
+    """时刻所在的时间段：(星期几, 当天第几个时间段)"""
+    return moment.weekday(), (moment.hour * 60 + moment.minute) // c.poller.slot_minutes
+
+
+class CourseSchedule:
+    """
+    一门课程的轮询计划。
+    在历史上经常发布活动的时间段（活跃时间段）内以 hot_interval 轮询；
+    其他时间从 base_interval 开始，每次没有变化就把间隔加倍，直到 max_interval。
+    """
+
+    def __init__(self, course_id: int, hot_slots: set[tuple[int, int]]):
+        self.course_id = course_id
+        self.hot_slots = hot_slots
+        self.idle_interval = c.poller.base_interval
+        self.next_poll_at = 0.0
+
+    def is_hot(self, moment: datetime.datetime) -> bool:
+        if not self.hot_slots:
+            return False
+        margin = datetime.timedelta(minutes=c.poller.hot_margin_minutes)
+        return slot_of(moment - margin) in self.hot_slots or slot_of(moment) in self.hot_slots \
+            or slot_of(moment + margin) in self.hot_slots
+
+    def next_hot_start(self, moment: datetime.datetime, horizon: float) -> datetime.datetime | None:
+        """horizon 秒内下一个活跃时间段开始的时刻，没有则返回 None。"""
+        if not self.hot_slots:
+            return None
+        step = datetime.timedelta(minutes=1)
+        end = moment + datetime.timedelta(seconds=horizon)
+        probe = moment
+        while probe < end:
+            probe += step
+            if self.is_hot(probe):
+                return probe
+        return None
+
+    def reschedule(self, moment: datetime.datetime, changed: bool) -> float:
+        """
+        根据本次轮询的结果安排下一次轮询。
+
+        :param moment: 本次轮询的时刻。
+        :param changed: 本次轮询是否发现了变化。
+        :return: 距下一次轮询的秒数。
+        """
+        if self.is_hot(moment):
+            self.idle_interval = c.poller.base_interval
+            interval = c.poller.hot_interval
+        elif changed:
+            self.idle_interval = c.poller.base_interval
+            interval = c.poller.base_interval
+        else:
+            interval = self.idle_interval
+            self.idle_interval = min(self.idle_interval * 2, c.poller.max_interval)
+            # 退避期间不能错过下一个活跃时间段的开始
+            hot_start = self.next_hot_start(moment, interval)
+            if hot_start is not None:
+                interval = (hot_start - moment).total_seconds()
+        self.next_poll_at = moment.timestamp() + interval
+        return interval
+
+    def describe_hot_slots(self) -> str:
+        minutes = c.poller.slot_minutes
+        return ", ".join(
+            f"周{WEEKDAYS[weekday]} {slot * minutes // 60:02d}:{slot * minutes % 60:02d}"
+            for weekday, slot in sorted(self.hot_slots)
+        ) or "无"
+
+
+class RequestBudget:
+    """所有课程共用的请求预算（令牌桶），每小时最多 requests_per_hour 个请求。"""
+
+    def __init__(self, requests_per_hour: int):
+        self.capacity = requests_per_hour
+        self.tokens = float(requests_per_hour)
+        self.updated = time.monotonic()
+
+    def try_spend(self, amount: int) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 3600)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+def learn_hot_slots(now: datetime.datetime = None) -> dict[int, set[tuple[int, int]]]:
+    """
+    统计最近 history_days 天内各课程发布活动的时间段。
+
+    :return: Course.id -> 活跃时间段集合
+    """
+    now = now or datetime.datetime.now()
+    since = now - datetime.timedelta(days=c.poller.history_days)
+    counts: dict[int, Counter] = {}
+    for course_id, start_time in db.crud.get_activity_start_times(since):
+        start_time = as_datetime(start_time)
+        if start_time is None or start_time < since:
+            continue
+        counts.setdefault(course_id, Counter())[slot_of(start_time)] += 1
+    return {course_id: {slot for slot, n in slots.items() if n >= c.poller.min_history}
+            for course_id, slots in counts.items()}
+
+
+def build_schedules(schedules: dict[int, CourseSchedule] = None) -> dict[int, CourseSchedule]:
+    """
+    为本分片负责的课程建立（或更新）轮询计划，保留已有计划的退避状态。
+    分片模式下按课程的 class_id 分配，每门课程只由一个分片轮询。
+    """
+    schedules = schedules or {}
+    hot_slots = learn_hot_slots()
+    updated = {}
+    for course in db.crud.get_courses_with_students():
+        if not sharding.owns(course.class_id):
+            continue
+        schedule = schedules.get(course.id) or CourseSchedule(course.id, set())
+        schedule.hot_slots = hot_slots.get(course.id, set())
+        updated[course.id] = schedule
+    return updated
+
+
+def pick_student(course: Course) -> User | None:
+    """选一个可用的学生代表课程取得活动列表，活动列表对同一课程的学生都相同。"""
+    for user in course.students:
+        if user.cookies and not user.is_banned:
+            return user
+    return None
+
+
+async def poll_course(course_id: int) -> bool:
+    """
+    轮询一门课程的活动。
+
+    :return: 是否发现了变化。
+    """
+    course = db.crud.get_course(course_id=course_id)
+    user = pick_student(course) if course else None
+    if user is None:
+        return False
+    counts = await workers.run("scan_course", course.id, user.id, notify_user=True)
+    if any(counts.values()):
+        l.info(f"轮询课程 {course.name}: 新增 {counts['new']} 个活动，结束 {counts['closed']} 个")
+    return any(counts.values())
+
+
+async def run():
+    """|coro|
+    后台按各课程的轮询计划取得活动，所有课程共用请求预算，活跃时间段内的课程优先。
+    """
+    budget = RequestBudget(c.poller.requests_per_hour)
+    schedules: dict[int, CourseSchedule] = {}
+    learned_at = 0.0
+    l.info("已开启课程活动轮询")
+
+    while True:
+        try:
+            if time.time() - learned_at > RELEARN_INTERVAL:
+                with session_scope():
+                    schedules = build_schedules(schedules)
+                learned_at = time.time()
+                l.debug("已更新 {} 门课程的轮询计划", len(schedules))
+
+            now = datetime.datetime.now()
+            due = [s for s in schedules.values() if s.next_poll_at <= now.timestamp()]
+            due.sort(key=lambda s: (not s.is_hot(now), s.next_poll_at))
+            for schedule in due:
+                if not budget.try_spend(c.poller.requests_per_poll):
+                    l.debug("轮询预算已用完，{} 门课程推迟轮询", len(due))
+                    break
+                try:
+                    with session_scope():
+                        changed = await poll_course(schedule.course_id)
+                except Exception as e:
+                    l.warning(f"轮询课程 {schedule.course_id} 失败: {e}")
+                    changed = False
+                    if c.job_queue.enable:
+                        # 不等下一次轮询，由任务队列按退避时间重试
+                        with session_scope():
+                            job_queue.enqueue_scan_course(schedule.course_id, delay=c.job_queue.retry_delay)
+                schedule.reschedule(datetime.datetime.now(), changed)
+        except Exception as e:
+            l.error(f"轮询课程活动时出错: {e}")
+        await asyncio.sleep(TICK)
+
+
+def expected_polls_per_day(schedule: CourseSchedule, start: datetime.datetime, days: int = 7) -> float:
+    """
+    假设一直没有变化，模拟 days 天的轮询，得到平均每天的轮询次数。
+    """
+    simulated = CourseSchedule(schedule.course_id, schedule.hot_slots)
+    moment = start
+    end = start + datetime.timedelta(days=days)
+    polls = 0
+    while moment < end:
+        polls += 1
+        moment += datetime.timedelta(seconds=simulated.reschedule(moment, changed=False))
+    return polls / days
+
+
+def report(days: int = 7):
+    """
+    预估每门课程每天的轮询次数和请求数（dry run，不发送请求）。
+    """
+    schedules = build_schedules()
+    start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    courses = {course.id: course for course in db.crud.get_courses_with_students()}
+
+    total = 0.0
+    print(f"{'课程':<20}{'轮询/天':>10}{'请求/天':>10}  活跃时间段")
+    for course_id, schedule in sorted(schedules.items()):
+        polls = expected_polls_per_day(schedule, start, days)
+        total += polls
+        print(f"{courses[course_id].name:<20}{polls:>10.0f}{polls * c.poller.requests_per_poll:>10.0f}  "
+              f"{schedule.describe_hot_slots()}")
+
+    requests = total * c.poller.requests_per_poll
+    budget = c.poller.requests_per_hour * 24
+    print(f"合计 {len(schedules)} 门课程，预计每天 {total:.0f} 次轮询，{requests:.0f} 个请求，"
+          f"预算 {budget} 个请求（{requests / budget:.0%}）")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from config import init_config
+    from db.db import init_db
+
+    parser = argparse.ArgumentParser(description="预估课程活动轮询每天的请求数")
+    parser.add_argument("--days", type=int, default=7, help="模拟的天数")
+    args = parser.parse_args()
+
+    init_config()
+    init_db()
+    report(args.days)
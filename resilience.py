@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import random
+import threading
+import time
+from typing import Callable
+from urllib.parse import urlparse
+
+from loguru import logger as l
+
+import metrics
+from config import c
+
+
+class UpstreamError(Exception):
+    """Raised when chaoxing fails or returns something that cannot be understood."""
+
+    def __init__(self, message="学习通请求失败"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without sending a request while the host's circuit breaker is open."""
+
+    def __init__(self, message="学习通暂时不可用"):
+        super().__init__(message)
+
+
+class RateLimiter:
+    """把速率限制在每秒 rate 次以内（rate 为 0 时不限制），多个协程共用。用于主动通知和批量登录等。"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class EndpointPolicy:
+    """
+    接口的请求策略。
+
+    :param timeout: 单次请求的超时（秒）。
+    :param budget: 包括重试在内的总耗时上限（秒）。
+    :param retries: 失败后最多重试几次，只对幂等的 GET 接口设置。
+    """
+
+    def __init__(self, timeout: float = 10, budget: float = 15, retries: int = 0):
+        self.timeout = timeout
+        self.budget = budget
+        self.retries = retries
+
+
+DEFAULT_POLICY = EndpointPolicy()
+
+ENDPOINT_POLICIES = {
+    # 查询类接口，重复请求没有副作用，可以重试
+    "activelist": EndpointPolicy(timeout=5, budget=12, retries=2),
+    "getPPTActiveInfo": EndpointPolicy(timeout=5, budget=10, retries=2),
+    "getAttendInfo": EndpointPolicy(timeout=5, budget=10, retries=2),
+    # 登录和签到不重试，避免重复提交
+    "fanyalogin": EndpointPolicy(timeout=10, budget=10),
+    "signIn": EndpointPolicy(timeout=8, budget=8),
+}
+
+RETRY_BASE_DELAY = 0.5
+"""第一次重试前的平均等待时间（秒），之后每次加倍，并随机浮动 ±50%"""
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    主机级熔断器。连续失败 circuit_failure_threshold 次后打开，期间直接失败而不发送请求；
+    circuit_recovery_time 秒后进入半开状态，只放行一个试探请求，成功则关闭，失败则再次打开。
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            l.warning(f"学习通主机 {self.host} 的熔断器: {self.state} -> {state}")
+        self.state = state
+        metrics.xxt_api_circuit_state.set(_STATE_VALUES[state], self.host)
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + c.xxt_api.circuit_recovery_time - time.monotonic())
+
+    def before_request(self):
+        """:raise CircuitOpenError: 熔断器打开，或半开时已有试探请求。"""
+        with self._lock:
+            if self.state == OPEN:
+                if self.retry_in() > 0:
+                    raise CircuitOpenError(f"学习通 {self.host} 暂时不可用，{math.ceil(self.retry_in())} 秒后重试")
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError(f"学习通 {self.host} 暂时不可用，正在检查是否恢复")
+                self._probing = True
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.failures = 0
+                self._set_state(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= c.xxt_api.circuit_failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    host = urlparse(url).hostname or ""
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def status() -> dict[str, dict]:
+    """
+    各主机熔断器的状态。
+
+    :return: 主机名 -> {"state": 状态, "failures": 连续失败次数, "retry_in": 打开时距离试探的秒数}
+    """
+    return {host: {"state": b.state, "failures": b.failures, "retry_in": round(b.retry_in(), 1) if b.state == OPEN else 0}
+            for host, b in _breakers.items()}
+
+
+def is_failure(response) -> bool:
+    """服务器错误和限流视为上游故障；其他 4xx 说明上游正常，由调用方处理。"""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def call(endpoint: str, method: str, url: str, send: Callable[[float], object]):
+    """
+    按接口策略发送请求：每次请求有超时，幂等的 GET 接口失败后以带随机抖动的指数退避重试，
+    总耗时不超过接口的预算，并经过主机的熔断器。在线程中调用（会 sleep）。
+
+    :param endpoint: 接口名。
+    :param method: HTTP 方法。
+    :param url: 请求地址，用于确定主机。
+    :param send: send(timeout) 发送一次请求并返回 requests.Response。
+    :return: 最后一次请求的 requests.Response。
+    :raise CircuitOpenError: 熔断器打开。
+    """
+    import requests
+
+    policy = ENDPOINT_POLICIES.get(endpoint, DEFAULT_POLICY)
+    retries = policy.retries if method.upper() == "GET" else 0
+    breaker = breaker_for(url)
+    deadline = time.monotonic() + policy.budget
+
+    attempt = 0
+    while True:
+        breaker.before_request()
+        timeout = max(0.1, min(policy.timeout, deadline - time.monotonic()))
+        try:
+            response = send(timeout)
+        except requests.RequestException as e:
+            response, error = None, e
+        except BaseException:
+            # 其他异常（如畸形的重定向地址）也要记录，否则半开状态的试探标记不会清除，该主机的请求会一直被拒绝
+            breaker.record(False)
+            raise
+        else:
+            error = None
+
+        failed = error is not None or is_failure(response)
+        breaker.record(not failed)
+        if not failed:
+            return response
+
+        delay = RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+        if attempt >= retries or time.monotonic() + delay >= deadline:
+            if error is not None:
+                raise error
+            return response
+
+        attempt += 1
+        metrics.xxt_api_retries.inc(endpoint)
+        l.debug("{} 请求失败（{}），{:.2f} 秒后第 {} 次重试", endpoint, error or response.status_code, delay, attempt)
+        time.sleep(delay)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import zlib
+
+from config import c
+
+shard_index: int = 0
+"""当前进程负责的分片序号，未开启分片时为 0"""
+
+
+def is_enabled() -> bool:
+    return bool(c.mirai_shards)
+
+
+def shard_count() -> int:
+    return len(c.mirai_shards) if c.mirai_shards else 1
+
+
+def shard_of(qq_num: str | int) -> int:
+    """
+    用户所属的分片。使用 crc32 而不是 hash()，保证在不同进程和重启之间结果一致。
+
+    :param qq_num: 用户的 QQ 号。
+    :return: 分片序号。
+    """
+    return zlib.crc32(str(qq_num).encode()) % shard_count()
+
+
+def owns(qq_num: str | int | None) -> bool:
+    """当前进程是否负责该用户的主动通知。"""
+    return qq_num is not None and shard_of(qq_num) == shard_index
+
+
+def owner_account(qq_num: str | int) -> int | None:
+    """负责该用户的机器人 QQ 号。"""
+    if is_enabled():
+        return c.mirai_shards[shard_of(qq_num)].qq
+    return c.mirai.qq if c.mirai else None
+
+
+def bot_accounts() -> set[int]:
+    """所有分片的机器人 QQ 号。"""
+    if is_enabled():
+        return {shard.qq for shard in c.mirai_shards}
+    return {c.mirai.qq} if c.mirai else set()
+
+
+def activate(index: int):
+    """
+    在分片子进程中调用：记录分片序号，并把该分片的账号配置作为当前进程的 mirai 配置。
+    指标接口的端口按分片序号依次递增，避免端口冲突。
+
+    :param index: 分片序号。
+    """
+    global shard_index
+
+    shard_index = index
+    c.mirai = c.mirai_shards[index]
+    c.metrics.port += index
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import asyncio
+
+from loguru import logger as l
+
+import db.crud
+import job_queue
+import workers
+from logs import mask
+from config import c
+from db.db import session_scope
+from db.db_models import User, SignInActivity
+
+
+async def sign_in_linked_users(activity: SignInActivity, solution: str) -> list[User]:
+    """
+    用同一个解为该活动下所有尚未签到的学生并发签到，签到成功的学生会收到通知。
+
+    :param activity: 签到活动。
+    :param solution: 签到解。
+    :return: 签到成功的用户列表。
+    """
+    semaphore = asyncio.Semaphore(c.system.sign_in_batch_concurrency)
+    users = list(activity.users)
+    activity_id, active_id = activity.id, activity.active_id
+
+    async def sign_in(user: User) -> bool:
+        user_id, phone_number = user.id, user.phone_number
+        async with semaphore:
+            # 每个签到使用自己的会话，一个签到出错回滚时不影响其他签到
+            with session_scope(fresh=True):
+                try:
+                    return await workers.run("sign_in", activity_id, user_id, solution)
+                except Exception as e:
+                    l.warning("为 {} 批量签到 {} 失败: {}", mask(phone_number), active_id, e)
+                    return False
+
+    results = await asyncio.gather(*(sign_in(user) for user in users))
+    signed = [user for user, ok in zip(users, results) if ok]
+
+    # 签到请求并发进行，数据库更新在全部完成后依次进行
+    for user in signed:
+        db.crud.mark_signed_in(user, activity)
+    # 通过数据库中的通知队列发送，分片模式下由负责各学生的进程发送
+    if signed:
+        db.crud.queue_messages(activity, signed, f"签到活动 {activity.name}（ID: {activity.id}）已使用同学提交的解自动签到")
+
+    l.info(f"活动 {activity.active_id} 批量签到: 成功 {len(signed)} 个，失败 {len(users) - len(signed)} 个")
+    return signed
+
+
+async def share_solution(activity: SignInActivity, solution: str, verified: bool) -> list[User]:
+    """
+    为活动下其他学生签到，有人签到成功（解已被验证）时保存该解，之后的学生签到时直接使用。
+
+    :param activity: 签到活动。
+    :param solution: 签到解。
+    :param verified: 提交者是否已用该解签到成功。
+    :return: 签到成功的用户列表。
+    """
+    if verified:
+        db.crud.set_activity_solution(activity, solution)
+    signed = await sign_in_linked_users(activity, solution)
+    if signed and not verified:
+        db.crud.set_activity_solution(activity, solution)
+    return signed
+
+
+def queue_solution(activity: SignInActivity, solution: str, verified: bool) -> int:
+    """
+    与 share_solution 相同，但把活动下其他学生的签到加入任务队列，重启后未完成的签到继续执行，失败的签到自动重试。
+    解未被验证时，第一个用该解签到成功的任务保存该解。
+
+    :return: 加入队列的签到数。
+    """
+    if verified:
+        db.crud.set_activity_solution(activity, solution)
+    queued = job_queue.enqueue_sign_ins(activity, list(activity.users), solution, save_solution=not verified)
+    l.info(f"活动 {activity.active_id} 的 {queued} 个签到已加入任务队列")
+    return queued
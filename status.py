@@ -0,0 +1,102 @@
+"""
+管理员“状态”指令的报告：运行时间、吞吐量、各指令延迟、队列、数据库和缓存等运行状况。
+除队列长度和用户数外都取自本进程内的指标（metrics），分片或工作进程模式下只反映当前进程。
+"""
+from __future__ import annotations
+
+import time
+
+import db.crud
+import http_cache
+import logs
+import metrics
+import warmup
+import workers
+from config import c
+
+
+def format_duration(seconds: float) -> str:
+    minutes, _ = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days} 天 {hours} 小时 {minutes} 分钟" if days else f"{hours} 小时 {minutes} 分钟"
+
+
+def ratio(part: float, total: float) -> str:
+    return f"{part / total:.0%}" if total else "-"
+
+
+def command_latency_lines() -> list[str]:
+    histogram, errors = metrics.family("command")
+    lines = []
+    for (command,) in histogram.label_values():
+        p50, p95, p99 = (histogram.quantile(q, command) * 1000 for q in (0.5, 0.95, 0.99))
+        lines.append(f"  {command}: {histogram.count(command)} 次，错误 {int(errors.get(command))} 次，"
+                     f"p50 {p50:.0f}ms p95 {p95:.0f}ms p99 {p99:.0f}ms")
+    return lines or ["  暂无"]
+
+
+def xxt_api_line() -> str:
+    histogram, errors = metrics.family("xxt_api")
+    requests = sum(histogram.count(*labels) for labels in histogram.label_values())
+    failed = sum(errors.values().values())
+    return (f"学习通请求: 进行中 {metrics.xxt_api_in_flight.get():.0f} 个，累计 {requests} 次，"
+            f"失败 {failed:.0f} 次（{ratio(failed, requests)}）")
+
+
+def queue_line() -> str:
+    jobs = db.crud.count_jobs()
+    parts = [f"任务 等待 {jobs.get('pending', 0)} / 执行中 {jobs.get('running', 0)} / 死信 {jobs.get('dead', 0)}",
+             f"待发送通知 {db.crud.count_pending_notifications()}",
+             f"日志 {logs.pending()}"]
+    if c.workers.processes > 0:
+        parts.append(f"工作进程待返回 {workers.pending()}")
+    return "队列: " + "，".join(parts)
+
+
+def db_line() -> str:
+    queries = metrics.db_queries.values()
+    total = sum(queries.values())
+    by_statement = " ".join(f"{statement} {n:.0f}" for (statement,), n in sorted(queries.items()))
+    return f"数据库: 执行 {total:.0f} 条语句（{by_statement or '-'}）"
+
+
+def cache_lines() -> list[str]:
+    checked = metrics.xxt_cookie_sessions.get("recently_checked")
+    reused = metrics.xxt_cookie_sessions.get("reused")
+    relogin = metrics.xxt_cookie_sessions.get("relogin")
+    total = checked + reused + relogin
+    lines = [f"登录会话: 免校验 {checked:.0f} 次，校验后复用 {reused:.0f} 次，重新登录 {relogin:.0f} 次，"
+             f"复用率 {ratio(checked + reused, total)}"]
+    for endpoint, outcomes in sorted(http_cache.stats().items()):
+        hits = outcomes.get("hit", 0) + outcomes.get("revalidated", 0)
+        total = hits + outcomes.get("miss", 0)
+        lines.append(f"页面缓存 {endpoint}: 命中 {hits} / {total} 次（{ratio(hits, total)}），"
+                     f"其中重新验证 {outcomes.get('revalidated', 0)} 次")
+    return lines
+
+
+def warmup_line() -> str:
+    report = warmup.last_report
+    if report is None:
+        return "启动预热: 未完成" if c.system.warmup_enable else "启动预热: 未开启"
+    return (f"启动预热: 用时 {report.seconds:.1f} 秒，{report.users} 个用户（重新登录 {report.relogin}，"
+            f"失败 {report.failed}），{report.courses} 门课程")
+
+
+def build_report() -> str:
+    now = time.time()
+    valid, logged_in = db.crud.count_users_with_valid_cookies(int(now))
+    lines = [
+        f"运行时间: {format_duration(now - metrics.STARTED_AT)}",
+        f"消息: 最近一分钟 {metrics.messages_per_minute.total()} 条",
+        "指令延迟:",
+        *command_latency_lines(),
+        xxt_api_line(),
+        queue_line(),
+        db_line(),
+        *cache_lines(),
+        warmup_line(),
+        f"用户: 已登录 {logged_in}，cookies 未过期 {valid}（{ratio(valid, logged_in)}）",
+    ]
+    return "\n".join(lines)
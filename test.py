@@ -3,7 +3,9 @@ from requests.cookies import RequestsCookieJar
 import asyncio
 import loguru
 from xxt_api import xxt_get_cookies_by_phone_password_login
-from config import c
+from config import c, init_config
+
+init_config()
 
 
 async def l():
@@ -0,0 +1,146 @@
+"""
+按消息记录处理过程的时间线。
+
+每条收到的消息开始一个追踪（trace），处理过程中的学习通请求、数据库操作、网页解析、发送消息和各处的等待
+记录为其中的 span。处理时间超过 tracing.slow_threshold 秒的追踪写入 tracing.dir 目录，
+格式为 Chrome trace event JSON，可以用 chrome://tracing 或 https://ui.perfetto.dev 打开。
+追踪保存在 ContextVar 中，消息处理中创建的任务和 asyncio.to_thread 的线程都记录到同一个追踪。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from loguru import logger as l
+
+from config import c
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.events: list[dict] = []
+        self.dropped = 0
+        # 任务或线程 -> Chrome trace 中的 tid
+        self._tids: dict[int, int] = {}
+
+    def tid(self) -> int:
+        """当前 asyncio 任务（在线程池中时为当前线程）在时间线中的行号，并发的任务各占一行。"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task is not None else threading.get_ident()
+        tid = self._tids.get(key)
+        if tid is None:
+            tid = self._tids.setdefault(key, len(self._tids) + 1)
+            thread_name = task.get_name() if task is not None else threading.current_thread().name
+            self.events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                                "args": {"name": thread_name}})
+        return tid
+
+    def add(self, category: str, name: str, start: float, end: float, args: dict):
+        if len(self.events) >= c.tracing.max_spans:
+            self.dropped += 1
+            return
+        self.events.append({"name": name, "cat": category, "ph": "X", "pid": 1, "tid": self.tid(),
+                            "ts": round((start - self.start) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+                            "args": args})
+
+    def to_json(self) -> dict:
+        return {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "name": self.name, "start": self.wall_start,
+                          "dropped_spans": self.dropped},
+        }
+
+
+_current: ContextVar[Trace | None] = ContextVar("trace", default=None)
+
+
+def current_trace_id() -> str | None:
+    trace = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def trace(name: str, **args):
+    """
+    开始一个追踪，代码块作为其根 span。结束时超过 slow_threshold 秒则写入文件。
+    已在追踪中时只记录为一个普通的 span。
+
+    :param name: 追踪名，如指令名。
+    :param args: 附加在根 span 上的信息，不要包含密码等敏感信息。
+    """
+    if not c.tracing.enable or _current.get() is not None:
+        with span("trace", name, **args):
+            yield
+        return
+
+    current = Trace(name)
+    token = _current.set(current)
+    try:
+        with l.contextualize(trace_id=current.trace_id), span("trace", name, **args):
+            yield
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - current.start
+        if elapsed >= c.tracing.slow_threshold:
+            dump(current, elapsed)
+
+
+@contextmanager
+def span(category: str, name: str, **args):
+    """
+    把代码块记录为当前追踪中的一个 span，不在追踪中时什么也不做。
+
+    :param category: 类别：xxt_api, crud, parse, send, sleep 等。
+    :param name: 接口名、函数名等。
+    """
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        current.add(category, name, start, time.perf_counter(), {**args, "error": type(e).__name__})
+        raise
+    current.add(category, name, start, time.perf_counter(), args)
+
+
+async def sleep(seconds: float, name: str):
+    """|coro|
+    asyncio.sleep，并把等待记录为 span，用于配置的人为延迟（web_requests_lantency、reply_latency）。
+    """
+    with span("sleep", name):
+        await asyncio.sleep(seconds)
+
+
+def dump(current: Trace, elapsed: float):
+    """把追踪写入 tracing.dir，只保留最新的 tracing.max_files 个文件。"""
+    try:
+        os.makedirs(c.tracing.dir, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(current.wall_start))}-" \
+                   f"{current.name}-{current.trace_id}.json"
+        path = os.path.join(c.tracing.dir, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(current.to_json(), f, ensure_ascii=False)
+        l.warning("处理 {} 用时 {:.1f} 秒，时间线已写入 {}", current.name, elapsed, path)
+
+        files = sorted(name for name in os.listdir(c.tracing.dir) if name.endswith(".json"))
+        for name in files[:max(len(files) - c.tracing.max_files, 0)]:
+            os.remove(os.path.join(c.tracing.dir, name))
+    except OSError as e:
+        l.warning(f"写入时间线失败: {e}")
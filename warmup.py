@@ -0,0 +1,90 @@
+"""
+启动预热。
+
+机器人连接成功（AccountLaunch 或 OneBot 客户端连接）后，以 system.warmup_concurrency 的并发校验本分片所有已登录用户的
+cookies，失效的重新登录，并取得各课程的跳转页放入页面缓存。校验结果记录在 User.cookies_checked_at，
+之后 xxt_api.cookies_check_ttl 秒内的指令不必再校验 cookies，重启后的第一条指令不会因此变慢。
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+from loguru import logger as l
+
+import db.crud
+import sharding
+import workers
+from config import c
+from db.db import session_scope
+from logs import mask
+
+
+@dataclass
+class WarmUpReport:
+    users: int = 0
+    relogin: int = 0
+    """cookies 已失效而重新登录的用户数"""
+    failed: int = 0
+    """校验和登录都失败的用户数"""
+    courses: int = 0
+    """取得跳转页的课程数"""
+    course_errors: int = 0
+    seconds: float = 0
+    finished_at: float = 0
+
+
+last_report: WarmUpReport | None = None
+"""最近一次完成的预热的结果，用于“状态”指令"""
+
+_task: asyncio.Task | None = None
+
+
+async def warm_up() -> WarmUpReport:
+    """|coro|
+    预热本分片的所有已登录用户。
+
+    :return: 预热结果。
+    """
+    global last_report
+    start = time.perf_counter()
+    with session_scope():
+        user_ids = [user.id for user in db.crud.get_logged_in_users() if sharding.owns(user.qq_num)]
+    l.info(f"开始预热 {len(user_ids)} 个用户的登录会话和课程缓存")
+
+    report = WarmUpReport(users=len(user_ids))
+    semaphore = asyncio.Semaphore(c.system.warmup_concurrency)
+
+    async def warm_up_user(user_id: int):
+        async with semaphore:
+            # 每个用户单独一个会话，并发的用户之间不共享 ORM 对象
+            with session_scope():
+                try:
+                    result = await workers.run("warm_up", user_id)
+                except Exception as e:
+                    report.failed += 1
+                    user = db.crud.get_user(user_id=user_id)
+                    l.warning("预热用户 {} 失败: {}", mask(user.phone_number) if user else user_id, e)
+                    return
+        report.relogin += result["relogin"]
+        report.courses += result["courses"]
+        report.course_errors += result["course_errors"]
+
+    await asyncio.gather(*(warm_up_user(user_id) for user_id in user_ids))
+    report.seconds = time.perf_counter() - start
+    report.finished_at = time.time()
+    last_report = report
+    l.success(f"预热完成，用时 {report.seconds:.1f} 秒: {report.users} 个用户，重新登录 {report.relogin} 个，"
+              f"失败 {report.failed} 个；{report.courses} 门课程，失败 {report.course_errors} 门")
+    return report
+
+
+def start():
+    """
+    在后台开始预热。机器人重连时再次触发不会重复预热。
+    """
+    global _task
+    if not c.system.warmup_enable or _task is not None:
+        return
+    _task = asyncio.get_running_loop().create_task(warm_up())
@@ -0,0 +1,203 @@
+"""
+学习通工作进程。
+
+workers.processes 大于 0 时，前端进程（QQ 连接和指令处理）把登录、取得课程、扫描活动、签到等任务
+（见 xxt_jobs）放入进程间队列，由若干工作进程执行，请求学习通、解析网页和写数据库分散到多个 CPU 核心。
+任务完成后结果立即经结果队列送回前端。为 0 时任务直接在当前进程中执行。
+"""
+from __future__ import annotations
+
+import asyncio
+import atexit
+import itertools
+import multiprocessing
+import pickle
+import threading
+from typing import Any
+
+from loguru import logger as l
+
+import tracing
+from config import c
+from db.db import db_session, session_scope
+
+SUPERVISE_INTERVAL = 5
+"""检查工作进程是否存活的间隔（秒）"""
+
+_pool: WorkerPool | None = None
+
+
+def _portable_error(e: BaseException) -> BaseException:
+    """异常要经过 pickle 送回前端，不能 pickle 的换成 RuntimeError。"""
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+
+
+async def _execute(job_id: int, name: str, args: tuple, kwargs: dict) -> tuple[int, bool, Any]:
+    import xxt_jobs
+
+    func = xxt_jobs.JOBS[name]
+    try:
+        with session_scope():
+            result = func(*args, **kwargs)
+            if asyncio.iscoroutine(result):
+                result = await result
+        return job_id, True, result
+    except Exception as e:
+        return job_id, False, _portable_error(e)
+
+
+async def _serve(index: int, jobs: multiprocessing.Queue, results: multiprocessing.Queue):
+    semaphore = asyncio.Semaphore(c.workers.concurrency)
+
+    async def run(job):
+        try:
+            results.put(await _execute(*job))
+        finally:
+            semaphore.release()
+
+    tasks = set()
+    while True:
+        # 只在有空闲的并发名额时取任务，忙碌的进程不会取走其他进程可以马上执行的任务
+        await semaphore.acquire()
+        job = await asyncio.to_thread(jobs.get)
+        if job is None:
+            break
+        task = asyncio.create_task(run(job))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    l.info(f"工作进程 {index} 已退出")
+
+
+def _worker_main(index: int, jobs: multiprocessing.Queue, results: multiprocessing.Queue):
+    """工作进程入口。"""
+    import logs
+    from config import init_config
+    from db.db import init_db
+
+    init_config()
+    logs.setup()
+    init_db()
+    l.info(f"工作进程 {index} 已启动")
+    asyncio.run(_serve(index, jobs, results))
+
+
+class WorkerPool:
+    """
+    前端持有的工作进程池。所有进程从同一个任务队列中取任务，结果由读取线程交给事件循环。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._processes: dict[int, multiprocessing.Process] = {}
+        self._futures: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopped = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        for index in range(self.size):
+            self._spawn(index)
+        threading.Thread(target=self._read_results, name="worker-results", daemon=True).start()
+        threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True).start()
+        l.info(f"已启动 {self.size} 个学习通工作进程")
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=_worker_main, args=(index, self._jobs, self._results),
+                                    name=f"xxt-worker-{index}")
+        process.start()
+        self._processes[index] = process
+
+    def _supervise(self):
+        while not self._stopped.wait(SUPERVISE_INTERVAL):
+            for index, process in list(self._processes.items()):
+                if not process.is_alive() and process.exitcode is not None:
+                    # 该进程正在执行的任务不会有结果，由调用方的超时结束
+                    l.error(f"工作进程 {index} 已退出，退出码 {process.exitcode}，重新启动……")
+                    self._spawn(index)
+
+    def _read_results(self):
+        while True:
+            job_id, ok, value = self._results.get()
+            self._loop.call_soon_threadsafe(self._resolve, job_id, ok, value)
+
+    def _resolve(self, job_id: int, ok: bool, value: Any):
+        future = self._futures.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    async def call(self, name: str, *args, **kwargs) -> Any:
+        job_id = next(self._ids)
+        future = self._loop.create_future()
+        self._futures[job_id] = future
+        self._jobs.put((job_id, name, args, kwargs))
+        try:
+            return await asyncio.wait_for(future, c.workers.job_timeout)
+        finally:
+            self._futures.pop(job_id, None)
+
+    def stop(self):
+        self._stopped.set()
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+
+def pending() -> int:
+    """已交给工作进程、尚未返回结果的任务数。"""
+    return len(_pool._futures) if _pool is not None else 0
+
+
+def start(loop: asyncio.AbstractEventLoop):
+    """按配置启动工作进程。"""
+    global _pool
+
+    if c.workers.processes <= 0 or _pool is not None:
+        return
+    _pool = WorkerPool(c.workers.processes)
+    _pool.start(loop)
+    atexit.register(_pool.stop)
+
+
+async def run(name: str, *args, **kwargs) -> Any:
+    """|coro|
+    执行 xxt_jobs 中的任务：有工作进程时交给工作进程，否则在当前进程中执行。
+
+    交给工作进程前先提交当前会话，使工作进程能读到本次操作已做的修改；
+    完成后使当前会话中的对象过期，之后访问时重新读取工作进程写入的数据。
+
+    :param name: 任务名，见 xxt_jobs.JOBS。
+    :return: 任务的返回值。
+    :raise asyncio.TimeoutError: 工作进程在 workers.job_timeout 秒内没有返回结果。
+    """
+    with tracing.span("job", name, process="worker" if _pool is not None else "local"):
+        if _pool is None:
+            import xxt_jobs
+
+            with session_scope():
+                result = xxt_jobs.JOBS[name](*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                return result
+
+        db_session.commit()
+        try:
+            return await _pool.call(name, *args, **kwargs)
+        finally:
+            db_session.expire_all()
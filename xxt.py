@@ -2,29 +2,132 @@ import os, sys
 
 sys.path.append(os.getcwd())
 
-import creart
 from asyncio import AbstractEventLoop
 import asyncio
+import multiprocessing
+import time
 from loguru import logger
-from config import c
-import db.db, platforms
-
-loop = creart.create(AbstractEventLoop)
-
-bots = []
+from config import c, init_config
+from db.db import init_db
+import logs
+import sharding
 
 platform_class_names = {
     'mirai': 'ariadne_bot',
-    # 'onebot': 'onebot_bot'
+    'onebot': 'onebot_bot'
 }
 
-for platform, module in platform_class_names.items():
-    if getattr(c, platform):
-        logger.info(f"检测到 {platform} 配置，将启动 {module} 模式……")
-        module = __import__(f'platforms.{module}', fromlist=['start_task'])
-        bots.append(loop.create_task(module.start_task()))
 
-loop.run_until_complete(asyncio.gather(*bots))
-loop.run_forever()
+def run():
+    """
+    在当前进程中启动已配置的各平台机器人，直到程序退出。
+    """
+    if c.mirai:
+        # Ariadne 需要使用 creart 创建的事件循环；creart 会载入 Graia 的全部组件，其他平台不需要
+        import creart
+
+        loop = creart.create(AbstractEventLoop)
+    else:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+    bots = []
+
+    if c.workers.processes > 0:
+        import workers
+
+        workers.start(loop)
+
+    for platform, module in platform_class_names.items():
+        if getattr(c, platform):
+            logger.info(f"检测到 {platform} 配置，将启动 {module} 模式……")
+            module = __import__(f'platforms.{module}', fromlist=['start_task'])
+            bots.append(loop.create_task(module.start_task()))
+
+    if c.metrics.enable and not (c.metrics.share_reverse_ws_server and c.mirai and c.mirai.reverse_ws_port):
+        import metrics
+
+        bots.append(loop.create_task(metrics.start_metrics_server(c.metrics.host, c.metrics.port, c.metrics.path)))
+
+    if c.system.cookies_auto_refresh:
+        import cookie_refresher
+
+        bots.append(loop.create_task(cookie_refresher.run()))
+
+    if c.system.course_sync_interval > 0:
+        import course_sync
+
+        bots.append(loop.create_task(course_sync.run()))
+
+    # 通知队列中除新活动通知外还有自动签到的结果等消息，总是发送
+    import notifier
+
+    bots.append(loop.create_task(notifier.run()))
+
+    if c.poller.enable:
+        import poller
+
+        bots.append(loop.create_task(poller.run()))
+
+    if c.job_queue.enable:
+        import job_queue
+
+        bots.append(loop.create_task(job_queue.run()))
+
+    loop.run_until_complete(asyncio.gather(*bots))
+    loop.run_forever()
+
+
+def run_shard(index: int):
+    """
+    分片子进程入口：只运行第 index 个账号，与其他分片共用一个数据库。
+    """
+    init_config()
+    logs.setup()
+    init_db()
+    sharding.activate(index)
+    logger.info(f"分片 {index}: 启动账号 {c.mirai.qq}")
+    run()
+
+
+def run_shards():
+    """
+    为每个分片账号启动一个子进程，子进程意外退出时重新启动。
+    """
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+
+    def start(index: int):
+        process = ctx.Process(target=run_shard, args=(index,), name=f"shard-{index}")
+        process.start()
+        processes[index] = process
+
+    logger.info(f"检测到 {len(c.mirai_shards)} 个分片账号，将以多进程模式启动……")
+    for index in range(len(c.mirai_shards)):
+        start(index)
+
+    try:
+        while True:
+            time.sleep(5)
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    logger.error(f"分片 {index} 已退出，退出码 {process.exitcode}，重新启动……")
+                    start(index)
+    finally:
+        for process in processes.values():
+            process.terminate()
+
+
+def main():
+    init_config()
+    logs.setup()
+    init_db()
+
+    if sharding.is_enabled():
+        run_shards()
+    else:
+        run()
 
 
+if __name__ == '__main__':
+    main()
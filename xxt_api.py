@@ -3,23 +3,30 @@ from __future__ import annotations
 import datetime
 import json
 import re
-import lxml
 
-import requests, base64
-from requests import utils
+import base64
 import time
 from base64 import b64encode
-from Crypto.Cipher import AES, DES
-from Crypto.Util.Padding import pad
-from requests.cookies import RequestsCookieJar
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING
 import asyncio
 from loguru import logger as l
 
 import db.crud
+import http_cache
+import metrics
+import parse_pool
+import resilience
+import tracing
+import xxt_parse
 from config import c, ConfigError
+from resilience import UpstreamError, CircuitOpenError
 from db.db_models import User, Course, SignInActivity
 
+# requests、bs4、lxml 和 pycryptodome 导入较慢，只在第一次用到时导入，以加快启动和工具脚本的导入
+if TYPE_CHECKING:
+    import requests
+    from requests.cookies import RequestsCookieJar
+
 
 class IncorrectPasswordError(Exception):
     """Raised when the provided password is incorrect."""
@@ -45,68 +52,160 @@ class GetCoursesError(Exception):
         super().__init__(self.message)
 
 
-async def xxt_get_courses_raw(cookies: RequestsCookieJar) -> str:
-    try:
-        await asyncio.sleep(c.system.web_requests_lantency)
-        resp = requests.post("https://mooc2-ans.chaoxing.com/mooc2-ans/visit/courselistdata",
-                             headers=c.xxt_api.request_user_agent, cookies=cookies, data={
-                "courseType": 1,
-                "courseFolderId": 0,
-                "query": "",
-                "superstarClass": 0
-            })
-
-        return resp.text
-    except Exception as e:
-        raise GetCoursesError(f"无法从学习通服务器取得课程列表 {str(e)}")
+def _request(endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    向学习通发送请求，并按接口记录每次请求的耗时和失败次数（请求异常或 HTTP 状态码非 2xx/3xx）。
+    超时、重试和熔断由 resilience 按接口策略处理。
 
+    :param endpoint: 接口名，用作指标标签。
+    :param method: HTTP 方法。
+    :param url: 请求地址。
+    :return: requests.Response 对象。
+    :raise CircuitOpenError: 学习通主机的熔断器打开。
+    """
+    import requests
 
-def xxt_parse_raw_courses_to_courses_list(courses_raw: str) -> list[Course]:
-    courses = []
+    def send(timeout: float) -> requests.Response:
+        start = time.perf_counter()
+        metrics.xxt_api_in_flight.inc()
+        try:
+            with tracing.span("xxt_api", endpoint, method=method):
+                resp = requests.request(method, url, timeout=timeout, **kwargs)
+        except Exception:
+            metrics.observe("xxt_api", endpoint, time.perf_counter() - start, error=True)
+            raise
+        finally:
+            metrics.xxt_api_in_flight.dec()
+        metrics.observe("xxt_api", endpoint, time.perf_counter() - start, error=not resp.ok)
+        return resp
+
+    return resilience.call(endpoint, method, url, send)
+
+
+def _json(resp: requests.Response, endpoint: str) -> dict:
+    """
+    解析接口返回的 JSON。cookies 失效时学习通会返回登录页等 HTML。
+
+    :raise UpstreamError: 返回的内容不是 JSON。
+    """
+    try:
+        return resp.json()
+    except ValueError:
+        raise UpstreamError(f"{endpoint} 返回了无法解析的内容（HTTP {resp.status_code}）")
+
+
+async def _request_async(endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    在线程中执行 _request，不阻塞事件循环，使多个请求可以并发进行。
+    """
+    return await asyncio.to_thread(_request, endpoint, method, url, **kwargs)
+
+
+class Profile:
+    """
+    个人空间页面（https://i.chaoxing.com/base）。
+    登录和校验 cookies 时都要下载这个页面，之后的步骤复用同一份，不再重复下载和解析。
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._user_name = None
+
+    @property
+    def user_name(self) -> str | None:
+        """学生姓名，第一次访问时解析。"""
+        if self._user_name is None:
+            self._user_name = get_user_name(self.text)
+        return self._user_name
+
+    async def parse_user_name(self) -> str | None:
+        """在解析池中解析学生姓名，结果与 user_name 共用。"""
+        if self._user_name is None:
+            self._user_name = await parse_pool.run(xxt_parse.parse_user_name, self.text)
+        return self._user_name
+
+
+async def xxt_get_courses_raw(cookies: RequestsCookieJar, revalidate: bool = False) -> str:
+    """
+    取得课程列表页面，经过页面缓存。
+
+    :param revalidate: 即使缓存未过期也向学习通确认是否有变化。
+    """
+    url = "https://mooc2-ans.chaoxing.com/mooc2-ans/visit/courselistdata"
+    data = {
+        "courseType": 1,
+        "courseFolderId": 0,
+        "query": "",
+        "superstarClass": 0
+    }
+
+    def send(headers: dict) -> requests.Response:
+        return _request("courselistdata", "POST", url, headers={**c.xxt_api.request_user_agent, **headers},
+                        cookies=cookies, data=data)
 
     try:
-        soup = BeautifulSoup(courses_raw, 'html.parser')
-        courses_raw_list = soup.find_all('li', class_='course')
+        await tracing.sleep(c.system.web_requests_lantency, "web_requests_lantency")
+        return await asyncio.to_thread(http_cache.fetch, "courselistdata", "POST", url, cookies, send,
+                                       revalidate, data)
     except Exception as e:
-        raise GetCoursesError(f"无法解析取得的课程网页 {str(e)}")
+        raise GetCoursesError(f"无法从学习通服务器取得课程列表 {str(e)}")
+
 
+def xxt_parse_raw_courses_to_courses_list(courses_raw: str) -> list[Course]:
     try:
-        for course in courses_raw_list:
-            clazzId = course.find('input', class_='clazzId')['value']
-            courseId = course.find('input', class_='courseId')['value']
+        return [Course(**course) for course in xxt_parse.parse_courses(courses_raw)]
+    except ValueError as e:
+        raise GetCoursesError(str(e))
 
-            # 获取课程的URL链接，然后从该链接中提取cpi参数
-            course_url = course.find('a', class_='color1')['href']
-            cpi = course_url.split('&cpi=')[1].split('&')[0]
 
-            course_name = course.find('span', class_='course-name').text
-            teacher_name = course.find('p', class_='line2 color3').text
+async def xxt_parse_courses(courses_raw: str) -> list[Course]:
+    """
+    在解析池中解析课程列表网页，解析池只返回字典，Course 对象在这里创建。
+    """
+    try:
+        return [Course(**course) for course in await parse_pool.run(xxt_parse.parse_courses, courses_raw)]
+    except ValueError as e:
+        raise GetCoursesError(str(e))
 
-            # 将提取的信息实例化为一个 Course 对象，然后添加到列表中
-            course_info = Course(
-                class_id=clazzId,
-                course_id=courseId,
-                cpi=cpi,
-                name=course_name,
-                teacher_name=teacher_name
-            )
 
-            courses.append(course_info)
-        return courses
+async def xxt_get_course_activities(course: Course, user: User) -> list[SignInActivity]:
+    cookies = await validate_cookies(user.cookies, phone_number=user.phone_number, password=user.password)
+    course_activities_raw = await xxt_get_course_active_list(course, cookies)
+    try:
+        course_activities = []
 
+        for activity_dict in course_activities_raw:
+            activity = await package_activity_info(activity_dict, cookies)
+            # 若用户已经签到（attend_info["data"]["status"] != 0），就对这个用户丢弃这个活动
+            if activity:
+                course_activities.append(activity)
     except Exception as e:
-        raise GetCoursesError(f"无法格式化已解析的课程网页: {e}")
+        raise Exception(f"无法格式化取得的活动列表: {e}")
+    return course_activities
 
 
-async def xxt_get_course_activities(course: Course, user: User) -> list[SignInActivity]:
-    cookies = await validate_cookies(user.cookies, phone_number=user.phone_number, password=user.password)
+async def xxt_get_course_params(course: Course, cookies: RequestsCookieJar) -> dict:
+    """
+    取得课程跳转页（经过页面缓存）中获取活动列表所需的参数。
+    """
     try:
-        course_redirect_page = get_course_redirect_page(cookies, course)
-        param_dict = get_param_dict_from_course_redirect_page(course_redirect_page)
+        course_redirect_page = await asyncio.to_thread(get_course_redirect_page, cookies, course.course_id,
+                                                       course.class_id, course.cpi)
+        return await parse_pool.run(xxt_parse.parse_course_redirect_params, course_redirect_page)
     except Exception as e:
         raise Exception(f"无法取得获取活动列表的必要的参数: {e}")
+
+
+async def xxt_get_course_active_list(course: Course, cookies: RequestsCookieJar) -> list[dict]:
+    """
+    取得课程中正在进行（status 为 1）的活动的原始数据。
+
+    :return: activelist 接口返回的活动字典列表。
+    """
+    param_dict = await xxt_get_course_params(course, cookies)
     try:
-        course_activities_list_raw_json = requests.get(
+        course_activities_list_raw_json = await _request_async(
+            "activelist", "GET",
             url="https://mobilelearn.chaoxing.com/v2/apis/active/student/activelist",
             params={
                 "fid": int(param_dict["cfid"]),
@@ -119,35 +218,26 @@ async def xxt_get_course_activities(course: Course, user: User) -> list[SignInAc
             headers=c.xxt_api.request_user_agent
         )
         if not course_activities_list_raw_json.ok:
-            raise Exception(f"无法取得活动列表: HTTP 请求失败")
+            raise UpstreamError(f"无法取得活动列表: HTTP {course_activities_list_raw_json.status_code}")
+    except UpstreamError:
+        raise
     except Exception as e:
         raise Exception(f"无法取得活动列表: {e}")
 
+    data = _json(course_activities_list_raw_json, "activelist")
     try:
-        data = json.loads(course_activities_list_raw_json.text)
         # 提取 activeList
         active_list = data.get('data', {}).get('activeList', [])
 
         # 提取状态为 1 的活动信息
-        course_activities_raw = [activity for activity in active_list if activity.get('status') == 1]
-
-    except Exception as e:
-        raise Exception(f"无法格式化取得的活动列表: {e}")
-    try:
-        course_activities = []
-
-        for activity_dict in course_activities_raw:
-            activity = await package_activity_info(activity_dict, cookies)
-            # 若用户已经签到（attend_info["data"]["status"] != 0），就对这个用户丢弃这个活动
-            if activity:
-                course_activities.append(activity)
+        return [activity for activity in active_list if activity.get('status') == 1]
     except Exception as e:
         raise Exception(f"无法格式化取得的活动列表: {e}")
-    return course_activities
 
 
 async def get_activity_info(activity: SignInActivity, cookies: RequestsCookieJar):
-    return requests.get(
+    return await _request_async(
+        "getPPTActiveInfo", "GET",
         url="https://mobilelearn.chaoxing.com/v2/apis/active/getPPTActiveInfo",
         params={
             "activeId": activity.active_id
@@ -157,19 +247,23 @@ async def get_activity_info(activity: SignInActivity, cookies: RequestsCookieJar
     )
 
 
-async def package_activity_info(activity_dict: dict, cookies: RequestsCookieJar) -> SignInActivity | None:
-    def get_sign_type(other_id):
-        types = {
-            '0': '普通签到',
-            # 照片签到已被合并到普通签到
-            '2': '二维码签到',
-            '3': '手势签到',
-            '4': '位置签到',
-            '5': '签到码签到',
-        }
-        return types.get(str(other_id), '未知签到类型')
-
-    activity = SignInActivity(
+def get_sign_type(other_id) -> str:
+    types = {
+        '0': '普通签到',
+        # 照片签到已被合并到普通签到
+        '2': '二维码签到',
+        '3': '手势签到',
+        '4': '位置签到',
+        '5': '签到码签到',
+    }
+    return types.get(str(other_id), '未知签到类型')
+
+
+def activity_from_dict(activity_dict: dict) -> SignInActivity:
+    """
+    把 activelist 接口返回的活动字典转换为 SignInActivity，不发送请求，不包含活动详情。
+    """
+    return SignInActivity(
         name=activity_dict["nameOne"],
         type_name=get_sign_type(activity_dict["otherId"]),
         start_time=datetime.datetime.fromtimestamp(activity_dict["startTime"] / 1000.0),
@@ -187,31 +281,71 @@ async def package_activity_info(activity_dict: dict, cookies: RequestsCookieJar)
         active_type=int(activity_dict["activeType"]),
         active_id=str(activity_dict["id"]),  # activeId
     )
-    # Check activity
-    info = await get_activity_info(activity, cookies)
-    info_dict = json.loads(info.text)["data"]
-    activity.location_range = int(info_dict["locationRange"])
 
-    if info_dict["ifphoto"] == 1:
-        activity.require_photo = True
+
+async def fill_activity_details(activity: SignInActivity, cookies: RequestsCookieJar):
+    """
+    补全活动详情（位置范围、是否需要照片和位置），并在活动类型名称后标注。
+    """
+    # 活动详情对所有学生都相同，数据库中已有时直接使用，只有签到状态需要按用户查询
+    known_activity = db.crud.get_activity(active_id=activity.active_id)
+    if known_activity is not None and known_activity.location_range is not None:
+        activity.location_range = known_activity.location_range
+        activity.require_photo = known_activity.require_photo
+        activity.require_location = known_activity.require_location
+    else:
+        info = await get_activity_info(activity, cookies)
+        info_dict = _json(info, "getPPTActiveInfo")["data"]
+        activity.location_range = int(info_dict["locationRange"])
+        activity.require_photo = info_dict["ifphoto"] == 1
+        activity.require_location = info_dict["ifopenAddress"] == 1
+
+    activity.type_name = get_sign_type(activity.other_id)
+    if activity.require_photo:
         activity.type_name += "[需照片]"
-    if info_dict["ifopenAddress"] == 1:
-        activity.require_location = True
+    if activity.require_location:
         activity.type_name += "[需位置]"
 
-    await asyncio.sleep(c.system.web_requests_lantency)
-    attend_info = json.loads(
-        requests.get(
+
+async def xxt_get_attend_status(activity: SignInActivity, cookies: RequestsCookieJar) -> int:
+    """
+    查询用户在活动中的签到状态。
+
+    :return: 0 为未签到。
+    """
+    await tracing.sleep(c.system.web_requests_lantency, "web_requests_lantency")
+    attend_info = _json(
+        await _request_async(
+            "getAttendInfo", "GET",
             url=f"https://mobilelearn.chaoxing.com/v2/apis/sign/getAttendInfo?activeId={activity.active_id}",
             cookies=cookies,
             headers=c.xxt_api.request_user_agent_android_app
-        ).text
+        ),
+        "getAttendInfo"
     )
+    return attend_info["data"]["status"]
+
 
-    return activity if attend_info["data"]["status"] == 0 else None
+async def package_activity_info(activity_dict: dict, cookies: RequestsCookieJar) -> SignInActivity | None:
+    activity = activity_from_dict(activity_dict)
+    await fill_activity_details(activity, cookies)
+    return activity if await xxt_get_attend_status(activity, cookies) == 0 else None
 
 
 async def xxt_get_cookies_by_phone_password_login(phone: str, password: str) -> RequestsCookieJar:
+    cookies, _ = await xxt_login(phone, password)
+    return cookies
+
+
+async def xxt_login(phone: str, password: str) -> tuple[RequestsCookieJar, Profile]:
+    """
+    以手机号和密码登录学习通。
+
+    :return: (cookies, 登录过程中取得的个人空间页面)
+    """
+    from Crypto.Cipher import AES, DES
+    from Crypto.Util.Padding import pad
+
     def encrypt_by_aes(message: str, key: str) -> str:
         key_bytes = key.encode('utf-8')[:16]  # Ensure key is 16 bytes long for AES-128
         iv = key_bytes  # Using same key as iv as per your JavaScript function
@@ -239,63 +373,56 @@ async def xxt_get_cookies_by_phone_password_login(phone: str, password: str) ->
         raise ConfigError("学习通登录加密算法填写有误")
 
     try:
-        await asyncio.sleep(c.system.web_requests_lantency)
-        login_res = requests.post(url="https://passport2.chaoxing.com/fanyalogin", headers=c.xxt_api.request_user_agent,
-                                  data={"fid": -1,
-                                        "uname": phone_encrypt,
-                                        "password": password_encrypt,
-                                        "refer": "https%3A%2F%2Fi.chaoxing.com",
-                                        "t": "true",
-                                        "forbidotherlogin": 0,
-                                        "validate": '',
-                                        "doubleFactorLogin": 0,
-                                        "independentId": 0
-                                        },
-                                  )
-        resp_data = login_res.json()
+        await tracing.sleep(c.system.web_requests_lantency, "web_requests_lantency")
+        login_res = await _request_async("fanyalogin", "POST", url="https://passport2.chaoxing.com/fanyalogin",
+                             headers=c.xxt_api.request_user_agent,
+                             data={"fid": -1,
+                                   "uname": phone_encrypt,
+                                   "password": password_encrypt,
+                                   "refer": "https%3A%2F%2Fi.chaoxing.com",
+                                   "t": "true",
+                                   "forbidotherlogin": 0,
+                                   "validate": '',
+                                   "doubleFactorLogin": 0,
+                                   "independentId": 0
+                                   },
+                             )
+        resp_data = _json(login_res, "fanyalogin")
     except Exception as e:
         raise e
 
     if 'status' in resp_data and resp_data['status']:
         try:
-            profile = get_profile(cookies=login_res.cookies)
+            profile = await asyncio.to_thread(get_profile, login_res.cookies)
             merged_cookies = login_res.cookies
             merged_cookies.update(profile.cookies)
-            mooc_cookies = get_mooc_cookies(merged_cookies, profile.text)
+            s_param = await parse_pool.run(xxt_parse.parse_s_param, profile.text)
+            mooc_cookies = await asyncio.to_thread(get_mooc_cookies, merged_cookies, s_param=s_param)
             merged_cookies.update(mooc_cookies)
         except Exception as e:
             raise Exception(f"取得中间 cookies 时失败: {e}")
-        return merged_cookies
+        return merged_cookies, Profile(profile.text)
     elif 'status' in resp_data and 'msg2' in resp_data and not resp_data['status']:
         raise IncorrectPasswordError(f"学习通返回消息：{resp_data['msg2']}")
     else:
         raise LoginError("登录方法有变，需要检查或更新软件")
 
 
-def get_mooc_cookies(cookies: RequestsCookieJar, profile_text: str) -> RequestsCookieJar:
-    mooc = requests.get(url="https://mooc2-ans.chaoxing.com/visit/interaction", cookies=cookies,
-                        headers=c.xxt_api.request_user_agent,
-                        data={
-                            "s": extract_s_param_from_profile_text(profile_text)
-                        })
+def get_mooc_cookies(cookies: RequestsCookieJar, profile_text: str = None, s_param: str = None) -> RequestsCookieJar:
+    """
+    :param profile_text: 个人空间网页，未提供 s_param 时从中解析。
+    :param s_param: 已解析的 s 参数。
+    """
+    mooc = _request("interaction", "GET", url="https://mooc2-ans.chaoxing.com/visit/interaction", cookies=cookies,
+                    headers=c.xxt_api.request_user_agent,
+                    data={
+                        "s": s_param if s_param is not None else extract_s_param_from_profile_text(profile_text)
+                    })
     return mooc.cookies
 
 
 def extract_s_param_from_profile_text(profile_text: str) -> str:
-    # 创建BeautifulSoup对象并指定解析器
-    soup = BeautifulSoup(profile_text, 'lxml')
-
-    # 查找包含URL的a标签
-    a_tag = soup.find('a', attrs={'dataurl': re.compile(r'http://hunauxs\.portal\.chaoxing\.com/\?s=.*')})
-
-    # 如果找到了a标签，从中提取s参数的值
-    if a_tag:
-        dataurl = a_tag.get('dataurl')
-        match = re.search(r's=([0-9a-f]+)', dataurl)
-        if match:
-            return match.group(1)
-        else:
-            raise ValueError("无法从个人主页取得 s 字段")
+    return xxt_parse.parse_s_param(profile_text)
 
 
 class GetProfileError(Exception):
@@ -308,8 +435,10 @@ class GetProfileError(Exception):
 
 def get_profile(cookies: RequestsCookieJar) -> requests.Response:
     try:
-        profile = requests.get(f"https://i.chaoxing.com/base?t={str(int(time.time() * 1000))}", cookies=cookies,
-                               headers=c.xxt_api.request_user_agent)
+        profile = _request("base", "GET", f"https://i.chaoxing.com/base?t={str(int(time.time() * 1000))}",
+                           cookies=cookies, headers=c.xxt_api.request_user_agent)
+    except CircuitOpenError:
+        raise
     except Exception as e:
         raise GetProfileError("取得个人空间失败")
     return profile
@@ -323,109 +452,228 @@ def get_profile_text(cookies: RequestsCookieJar) -> str:
     return get_profile(cookies).text
 
 
-def get_course_redirect_page(cookies: RequestsCookieJar, course: Course) -> str:
-    course_page_res = requests.get(
-        f"https://mooc1.chaoxing.com/visit/stucoursemiddle?courseid={course.course_id}&clazzid={course.class_id}&cpi={course.cpi}&ismooc2=1",
-        cookies=cookies, headers=c.xxt_api.request_user_agent)
-    return course_page_res.text
-
+def get_course_redirect_page(cookies: RequestsCookieJar, course_id: str, class_id: str, cpi: str) -> str:
+    """在线程中调用，只接收普通的值，不读取 ORM 对象（会话不能跨线程使用）。"""
+    url = f"https://mooc1.chaoxing.com/visit/stucoursemiddle?courseid={course_id}&clazzid={class_id}&cpi={cpi}&ismooc2=1"
 
-def get_param_dict_from_course_redirect_page(page: str) -> dict:
-    soup = BeautifulSoup(page, 'html.parser')
+    def send(headers: dict) -> requests.Response:
+        return _request("stucoursemiddle", "GET", url, cookies=cookies,
+                        headers={**c.xxt_api.request_user_agent, **headers})
 
-    # 为了提高效率，我们直接查找具有特定id的input标签
-    ids_to_extract = [
-        'enc', 'cfid', 'bbsid', 'fid', 'openc', 'oldenc', 'workEnc', 'examEnc'
-    ]
+    return http_cache.fetch("stucoursemiddle", "GET", url, cookies, send)
 
-    extracted_data = {}
-    for id_value in ids_to_extract:
-        input_tag = soup.find('input', {'id': id_value})
-        if input_tag:
-            extracted_data[id_value] = input_tag['value']
 
-    return extracted_data
+def get_param_dict_from_course_redirect_page(page: str) -> dict:
+    return xxt_parse.parse_course_redirect_params(page)
 
 
 def get_user_name(profile: str) -> str:
-    try:
-        soup = BeautifulSoup(profile, 'html.parser')
-        user_name_tag = soup.find('p', class_='user-name')
-        if user_name_tag:
-            return user_name_tag.text
-    except Exception as e:
-        raise ValueError("无法从个人空间网页取得学生姓名")
+    return xxt_parse.parse_user_name(profile)
 
 
 def cookie_jar_to_json_str(cookies: RequestsCookieJar) -> str:
+    import requests.utils
+
     cookie_dict = requests.utils.dict_from_cookiejar(cookies)
     cookie_json = json.dumps(cookie_dict)
     return cookie_json
 
 
+def cookies_expire_at(cookies: RequestsCookieJar) -> int:
+    """
+    估计刚取得的 cookies 的失效时间：取尚未过期的 cookies 中最早的失效时间，
+    且不晚于 cookies_max_lifetime 秒之后（会话 cookies 没有失效时间）。
+    cookie_jar_to_json_str 只保存名称和值，需要在保存前调用。
+
+    :return: 时间戳。
+    """
+    now = int(time.time())
+    expires = [cookie.expires for cookie in cookies if cookie.expires and cookie.expires > now]
+    return min(expires + [now + int(c.system.cookies_max_lifetime)])
+
+
 def json_str_to_cookie_jar(cookie_json: str) -> RequestsCookieJar:
+    import requests.utils
+
     cookie_dict = json.loads(cookie_json)
     cookie_jar = requests.utils.cookiejar_from_dict(cookie_dict)
     return cookie_jar
 
 
-async def is_cookies_valid(cookies: RequestsCookieJar) -> bool:
+async def probe_cookies(cookies: RequestsCookieJar | None) -> Profile | None:
+    """
+    用 cookies 下载个人空间页面来检查 cookies 是否有效。
+    cookies 失效时学习通返回登录页，其中没有学生姓名。
+
+    :return: 有效时返回个人空间页面，供后续步骤复用；无效时返回 None。
+    """
     if cookies is None:
-        return False
+        return None
+    profile = Profile(await asyncio.to_thread(get_profile_text, cookies))
     try:
-        name = get_user_name(get_profile_text(cookies))
-        l.debug(f"以本地 cookies 取得用户姓名 {name}")
+        name = await profile.parse_user_name()
     except ValueError as ve:
-        return False
-    return True
+        return None
+    if not name:
+        return None
+    l.debug("以本地 cookies 取得用户姓名 {}", name)
+    return profile
+
+
+async def is_cookies_valid(cookies: RequestsCookieJar) -> bool:
+    return await probe_cookies(cookies) is not None
 
 
 async def validate_cookies(cookies_raw: str | RequestsCookieJar | None, phone_number: str,
                            password: str) -> RequestsCookieJar:
-    cookies = None
+    """
+    校验 cookies，失效时重新登录。传入的是数据库中保存的 cookies，且在 xxt_api.cookies_check_ttl 秒内
+    确认过有效（见 User.cookies_checked_at）时直接使用，不再请求学习通。
+    """
+    if cookies_raw is None or isinstance(cookies_raw, str):
+        user = db.crud.get_user(phone_number=phone_number)
+        if user is not None and user.cookies and cookies_raw in (None, user.cookies) and user.cookies_checked_at \
+                and time.time() - user.cookies_checked_at < c.xxt_api.cookies_check_ttl:
+            metrics.xxt_cookie_sessions.inc("recently_checked")
+            return json_str_to_cookie_jar(user.cookies)
+    cookies, _ = await validate_cookies_with_profile(cookies_raw, phone_number, password)
+    return cookies
+
+
+def load_cookies(cookies_raw: str | RequestsCookieJar | None, phone_number: str) -> RequestsCookieJar | None:
+    """
+    把传入的 cookies 转换为 RequestsCookieJar，未传入时使用数据库中该手机号用户的 cookies。不检查有效性。
+    """
+    from requests.cookies import RequestsCookieJar
 
     if isinstance(cookies_raw, RequestsCookieJar):
-        cookies = cookies_raw if await is_cookies_valid(cookies_raw) else None
+        return cookies_raw
     elif isinstance(cookies_raw, str) and cookies_raw:
-        cookies_converted = json_str_to_cookie_jar(cookies_raw)
-        cookies = cookies_converted if await is_cookies_valid(cookies_converted) else None
+        return json_str_to_cookie_jar(cookies_raw)
     elif cookies_raw is None:
         # 如果 cookies_raw 为空，尝试根据 phone_number 获取 user，然后获取 user.cookies
         user = db.crud.get_user(phone_number=phone_number)
         if user and user.cookies:
-            cookies_converted = json_str_to_cookie_jar(user.cookies)
-            cookies = cookies_converted if await is_cookies_valid(cookies_converted) else None
+            return json_str_to_cookie_jar(user.cookies)
+    return None
 
-    if cookies is None:
+
+async def validate_cookies_with_profile(cookies_raw: str | RequestsCookieJar | None, phone_number: str,
+                                        password: str) -> tuple[RequestsCookieJar, Profile]:
+    """
+    校验 cookies，失效时重新登录。
+
+    :return: (有效的 cookies, 校验或登录时取得的个人空间页面)
+    """
+    cookies = load_cookies(cookies_raw, phone_number)
+    profile = await probe_cookies(cookies)
+
+    if profile is None:
+        metrics.xxt_cookie_sessions.inc("relogin")
         l.debug("本地没有 cookies 或已失效，重新获取 cookies")
-        cookies = await xxt_get_cookies_by_phone_password_login(phone_number, password)
+        cookies, profile = await xxt_login(phone_number, password)
         user = db.crud.get_user(phone_number=phone_number)
         if user:
             try:
                 user.cookies = cookie_jar_to_json_str(cookies)
+                user.cookies_expire_at = cookies_expire_at(cookies)
+                user.cookies_checked_at = int(time.time())
                 db.crud.update_user(user)
             except Exception as e:
                 l.debug("更新本地已有用户的 cookies 失败")
                 raise e
             l.debug("已更新本地已有用户的 cookies")
     else:
+        metrics.xxt_cookie_sessions.inc("reused")
         l.debug("本地 cookies 有效，用之")
+        user = db.crud.get_user(phone_number=phone_number)
+        if user and user.cookies == cookie_jar_to_json_str(cookies):
+            user.cookies_checked_at = int(time.time())
+            db.crud.update_user(user)
+
+    return cookies, profile
+
 
+async def refresh_user_cookies(user: User) -> RequestsCookieJar:
+    """
+    重新登录并保存新的 cookies 和失效时间。
+
+    :param user: 用户对象。
+    :return: 新的 cookies。
+    """
+    cookies, _ = await xxt_login(user.phone_number, user.password)
+    user.cookies = cookie_jar_to_json_str(cookies)
+    user.cookies_expire_at = cookies_expire_at(cookies)
+    user.cookies_checked_at = int(time.time())
+    db.crud.update_user(user)
     return cookies
 
 
-async def xxt_sign_in(activity: SignInActivity, user: User) -> bool:
-    result = requests.get(
-        url=f"https://mobilelearn.chaoxing.com/v2/apis/sign/signIn?activeId={activity.active_id}",
+# 需要提供解的签到类型（otherId）及解的说明
+SOLUTION_REQUIRED_SIGN_TYPES = {
+    2: "二维码中的 enc 参数或二维码链接",
+    3: "手势对应的数字，如 14789",
+    4: "位置，格式为 经度,纬度[,地址]",
+    5: "签到码",
+}
+
+
+def solution_to_params(other_id: int, solution: str) -> dict:
+    """
+    把用户提交的签到解转换为签到接口的参数。
+
+    :param other_id: 签到类型（otherId）。
+    :param solution: 签到解。
+    :return: 请求参数字典，不需要解的签到类型返回空字典。
+    :raise ValueError: 解的格式不正确。
+    """
+    if other_id not in SOLUTION_REQUIRED_SIGN_TYPES or not solution:
+        return {}
+    hint = f"格式不正确，应为{SOLUTION_REQUIRED_SIGN_TYPES[other_id]}"
+
+    if other_id == 2:
+        match = re.search(r'enc=([0-9A-Za-z]+)', solution)
+        enc = match.group(1) if match else solution
+        if not re.fullmatch(r'[0-9A-Za-z]+', enc):
+            raise ValueError(hint)
+        return {"enc": enc}
+    if other_id == 3:
+        if not re.fullmatch(r'[1-9]{2,9}', solution):
+            raise ValueError(hint)
+        return {"signCode": solution}
+    if other_id == 4:
+        match = re.fullmatch(r'(-?\d{1,3}\.\d+),(-?\d{1,2}\.\d+)(?:,(.+))?', solution)
+        if not match:
+            raise ValueError(hint)
+        longitude, latitude, address = match.groups()
+        return {"longitude": longitude, "latitude": latitude, "address": address or ""}
+    if not re.fullmatch(r'\d{4,8}', solution):
+        raise ValueError(hint)
+    return {"signCode": solution}
+
+
+async def xxt_sign_in(activity: SignInActivity, user: User, solution: str = None) -> bool:
+    """
+    为用户签到。
+
+    :param activity: 签到活动。
+    :param user: 用户对象。
+    :param solution: 手势、签到码、位置或二维码等签到需要的解。
+    :return: 是否签到成功。
+    """
+    result = await _request_async(
+        "signIn", "GET",
+        url="https://mobilelearn.chaoxing.com/v2/apis/sign/signIn",
+        params={"activeId": activity.active_id, **solution_to_params(activity.other_id, solution)},
         cookies=await validate_cookies(phone_number=user.phone_number, password=user.password,
                                        cookies_raw=user.cookies),
         headers=c.xxt_api.request_user_agent_android_app
     )
 
     if not result.ok:
-        raise Exception("网络错误")
+        raise UpstreamError(f"签到请求失败: HTTP {result.status_code}")
 
-    res_dict = json.loads(result.text)
+    res_dict = _json(result, "signIn")
     if res_dict["result"] == 1 and res_dict["msg"] == "success":
         return True
     else:
@@ -434,20 +682,68 @@ async def xxt_sign_in(activity: SignInActivity, user: User) -> bool:
 
 async def xxt_get_user_and_courses_info(phone: str, password: str, qq_num: str, is_admin: bool,
                                         cookies_raw: RequestsCookieJar = None) -> dict:
+    """
+    登录流程：校验 cookies（失效时登录）→ 取得课程列表，同时解析个人空间中的学生姓名 → 解析课程列表。
+    个人空间页面在校验 cookies 或登录时已经下载，直接复用，不再重复请求。
+    本地已有 cookies 时，在校验的同时就用它下载课程列表；校验通过则直接使用，否则登录后重新下载。
+
+    :return: {"user": User, "courses": 课程列表, "timings": {阶段名: 耗时（秒）}}
+    """
     info = {}
-    cookies = await validate_cookies(cookies_raw, phone_number=phone, password=password)
-    courses_raw = await xxt_get_courses_raw(cookies)
+    timings = {}
+    start = time.perf_counter()
+
+    async def stage(name: str, awaitable):
+        stage_start = time.perf_counter()
+        result = await awaitable
+        timings[name] = time.perf_counter() - stage_start
+        return result
+
+    stored_cookies = load_cookies(cookies_raw, phone)
+    speculative_courses = None
+    if stored_cookies is not None:
+        speculative_courses = asyncio.create_task(stage("fetch_courses", xxt_get_courses_raw(stored_cookies)))
+
+    try:
+        cookies, profile = await stage("validate_cookies",
+                                       validate_cookies_with_profile(stored_cookies, phone_number=phone,
+                                                                     password=password))
+    except BaseException:
+        if speculative_courses:
+            speculative_courses.cancel()
+        raise
+
+    if cookies is stored_cookies:
+        courses_fetch = speculative_courses
+    else:
+        # 本地 cookies 已失效，提前下载的课程列表不可用
+        if speculative_courses:
+            speculative_courses.cancel()
+        courses_fetch = stage("fetch_courses", xxt_get_courses_raw(cookies))
+
+    # 课程列表的下载与个人空间的解析互不依赖，同时进行
+    courses_raw, user_name = await asyncio.gather(
+        courses_fetch,
+        stage("parse_profile", profile.parse_user_name()),
+    )
 
     info["user"] = User(
         xxt_user_id=str(cookies.get("UID")),
         qq_num=qq_num,
-        name=get_user_name(get_profile_text(cookies)),
+        name=user_name,
         cookies=cookie_jar_to_json_str(cookies),
+        # 沿用本地 cookies 时失效时间不变，由调用方保留原值
+        cookies_expire_at=None if cookies is stored_cookies else cookies_expire_at(cookies),
         phone_number=phone,
         password=password,
         is_admin=is_admin
     )
 
-    info["courses"] = xxt_parse_raw_courses_to_courses_list(courses_raw)
+    info["courses"] = await stage("parse_courses", xxt_parse_courses(courses_raw))
+
+    timings["total"] = time.perf_counter() - start
+    info["timings"] = timings
+    l.opt(lazy=True).info("登录流程耗时: {}", lambda: ", ".join(f"{name} {seconds * 1000:.0f}ms"
+                                                              for name, seconds in timings.items()))
 
     return info
@@ -0,0 +1,94 @@
+"""
+可以交给工作进程执行的学习通任务。
+
+任务的参数和返回值都要能 pickle：用数据库 id 代替 ORM 对象，任务在执行它的进程中重新查询，
+结果写入数据库后只返回摘要。前端进程和工作进程通过同一个数据库共享状态。
+"""
+from __future__ import annotations
+
+import db.crud
+import xxt_parse
+from activity_sync import sync_course_activities
+from course_sync import sync_user
+from config import c
+from xxt_api import xxt_get_user_and_courses_info, xxt_sign_in, refresh_user_cookies, validate_cookies, \
+    xxt_get_course_params
+
+
+async def login(phone: str, password: str, qq_num: str, is_admin: bool) -> dict:
+    """
+    登录学习通并取得用户信息和课程列表。
+
+    :return: xxt_get_user_and_courses_info 的结果，其中的 User 和 Course 都是尚未写入数据库的对象。
+    """
+    return await xxt_get_user_and_courses_info(phone, password, qq_num, is_admin)
+
+
+async def scan_course(course_id: int, user_id: int, notify_user: bool = False) -> dict[str, int]:
+    """
+    以学生的身份取得课程的活动列表并同步到数据库。
+
+    :return: 新增、变化和结束的活动数。
+    """
+    course = db.crud.get_course(course_id=course_id)
+    user = db.crud.get_user(user_id=user_id)
+    diff = await sync_course_activities(course, user, notify_user)
+    return {"new": len(diff.new), "changed": len(diff.changed), "closed": len(diff.closed)}
+
+
+async def sign_in(activity_id: int, user_id: int, solution: str = None) -> bool:
+    activity = db.crud.get_activity(id=activity_id)
+    user = db.crud.get_user(user_id=user_id)
+    return await xxt_sign_in(activity=activity, user=user, solution=solution)
+
+
+async def sync_courses(user_id: int) -> tuple[int, int, int]:
+    """
+    增量同步用户的课程列表。
+
+    :return: 新关联、移除关联和字段有变化的课程数。
+    """
+    added, removed, changed = await sync_user(db.crud.get_user(user_id=user_id))
+    return len(added), len(removed), len(changed)
+
+
+async def refresh_cookies(user_id: int):
+    await refresh_user_cookies(db.crud.get_user(user_id=user_id))
+
+
+async def warm_up(user_id: int) -> dict[str, int]:
+    """
+    校验用户的 cookies（失效时重新登录），并按 system.warmup_prefetch_courses 取得各课程的跳转页，
+    使之进入页面缓存。
+
+    :return: relogin（是否重新登录）、courses（取得的课程数）、course_errors（失败的课程数）。
+    """
+    user = db.crud.get_user(user_id=user_id)
+    cookies_before = user.cookies
+    cookies = await validate_cookies(cookies_raw=user.cookies, phone_number=user.phone_number,
+                                     password=user.password)
+    result = {"relogin": int(user.cookies != cookies_before), "courses": 0, "course_errors": 0}
+    if c.system.warmup_prefetch_courses:
+        for course in user.courses:
+            try:
+                await xxt_get_course_params(course, cookies)
+                result["courses"] += 1
+            except Exception:
+                result["course_errors"] += 1
+    return result
+
+
+def parse_courses(courses_raw: str) -> list[dict]:
+    """解析课程列表页面，只占用 CPU。"""
+    return xxt_parse.parse_courses(courses_raw)
+
+
+JOBS = {
+    "login": login,
+    "scan_course": scan_course,
+    "sign_in": sign_in,
+    "sync_courses": sync_courses,
+    "refresh_cookies": refresh_cookies,
+    "warm_up": warm_up,
+    "parse_courses": parse_courses,
+}
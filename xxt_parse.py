@@ -0,0 +1,103 @@
+"""
+学习通网页的解析函数。
+只依赖 bs4 和 lxml，参数和返回值都是字符串、字典等可以 pickle 的普通对象，可以在线程池或进程池中运行，
+进程池的子进程也只需导入本模块。
+"""
+from __future__ import annotations
+
+import re
+
+
+def parse_courses(courses_raw: str) -> list[dict]:
+    """
+    解析课程列表网页。
+
+    :return: 课程字典列表，键与 Course 的字段相同。
+    :raise ValueError: 网页格式不正确。
+    """
+    from bs4 import BeautifulSoup
+
+    try:
+        soup = BeautifulSoup(courses_raw, 'html.parser')
+        courses_raw_list = soup.find_all('li', class_='course')
+    except Exception as e:
+        raise ValueError(f"无法解析取得的课程网页 {str(e)}")
+
+    courses = []
+    try:
+        for course in courses_raw_list:
+            clazzId = course.find('input', class_='clazzId')['value']
+            courseId = course.find('input', class_='courseId')['value']
+
+            # 获取课程的URL链接，然后从该链接中提取cpi参数
+            course_url = course.find('a', class_='color1')['href']
+            cpi = course_url.split('&cpi=')[1].split('&')[0]
+
+            course_name = course.find('span', class_='course-name').text
+            teacher_name = course.find('p', class_='line2 color3').text
+
+            courses.append({
+                "class_id": clazzId,
+                "course_id": courseId,
+                "cpi": cpi,
+                "name": course_name,
+                "teacher_name": teacher_name,
+            })
+    except Exception as e:
+        raise ValueError(f"无法格式化已解析的课程网页: {e}")
+    return courses
+
+
+def parse_s_param(profile_text: str) -> str | None:
+    """从个人空间网页取得 s 参数。"""
+    from bs4 import BeautifulSoup
+
+    # 创建BeautifulSoup对象并指定解析器
+    soup = BeautifulSoup(profile_text, 'lxml')
+
+    # 查找包含URL的a标签
+    a_tag = soup.find('a', attrs={'dataurl': re.compile(r'http://hunauxs\.portal\.chaoxing\.com/\?s=.*')})
+
+    # 如果找到了a标签，从中提取s参数的值
+    if a_tag:
+        dataurl = a_tag.get('dataurl')
+        match = re.search(r's=([0-9a-f]+)', dataurl)
+        if match:
+            return match.group(1)
+        else:
+            raise ValueError("无法从个人主页取得 s 字段")
+    return None
+
+
+def parse_course_redirect_params(page: str) -> dict:
+    """从课程中转页取得获取活动列表需要的参数。"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page, 'html.parser')
+
+    # 为了提高效率，我们直接查找具有特定id的input标签
+    ids_to_extract = [
+        'enc', 'cfid', 'bbsid', 'fid', 'openc', 'oldenc', 'workEnc', 'examEnc'
+    ]
+
+    extracted_data = {}
+    for id_value in ids_to_extract:
+        input_tag = soup.find('input', {'id': id_value})
+        if input_tag:
+            extracted_data[id_value] = input_tag['value']
+
+    return extracted_data
+
+
+def parse_user_name(profile: str) -> str | None:
+    """从个人空间网页取得学生姓名，cookies 失效时（登录页）返回 None。"""
+    from bs4 import BeautifulSoup
+
+    try:
+        soup = BeautifulSoup(profile, 'html.parser')
+        user_name_tag = soup.find('p', class_='user-name')
+        if user_name_tag:
+            return user_name_tag.text
+    except Exception as e:
+        raise ValueError("无法从个人空间网页取得学生姓名")
+    return None